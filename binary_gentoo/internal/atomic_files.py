@@ -0,0 +1,65 @@
+# Copyright (C) 2021 Sebastian Pipping <sebastian@pipping.org>
+# Licensed under GNU Affero GPL version 3 or later
+
+import json
+import os
+from contextlib import contextmanager, suppress
+
+from .json_formatter import dump_json_for_humans
+
+
+@contextmanager
+def atomically_written(filename, mode="w"):
+    """Open a temporary file that replaces ``filename`` only once written completely"""
+    temp_filename = f"{filename}.tmp"
+    try:
+        with open(temp_filename, mode) as f:
+            yield f
+        os.rename(temp_filename, filename)
+    except BaseException:
+        with suppress(FileNotFoundError):
+            os.remove(temp_filename)
+        raise
+
+
+def save_versioned_json(filename, version: int, doc: dict, compact: bool = False):
+    """Write ``doc`` with key ``"version"`` added to ``filename``, atomically
+
+    Compact output is for files that are large and not meant for humans, e.g. caches.
+    """
+    doc = {"version": version, **doc}
+    with atomically_written(filename) as f:
+        if compact:
+            json.dump(doc, f, separators=(",", ":"), sort_keys=True)
+        else:
+            dump_json_for_humans(doc, f)
+
+
+def load_versioned_json(
+    filename, version: int, required: bool = False, cache: bool = False
+) -> dict | None:
+    """Load a document written by ``save_versioned_json``
+
+    Returns ``None`` for files that are empty or missing (unless ``required``).
+    Documents of any other version raise ``ValueError``, except for caches
+    where ``None`` is returned so as to start over rather than fail.
+    """
+    try:
+        with open(filename) as f:
+            content = f.read()
+    except FileNotFoundError:
+        if required:
+            raise
+        return None
+
+    if not content:
+        return None
+
+    doc = json.loads(content)
+
+    if doc.get("version") != version:
+        if cache:
+            return None
+        raise ValueError(f"File {filename!r} has unsupported version")
+
+    return doc
@@ -10,6 +10,7 @@ _v_pattern = (
 _cpv_pattern = f"{_cp_pattern}-{_v_pattern}"
 _atom_cpv_pattern = f"={_cp_pattern}-{_v_pattern}"
 _set_pattern = "(?P<set>@[a-z0-9-_]+)"
+_version_suffix_pattern = re.compile("-[0-9][^-/]*(-r[0-9]+)?$")
 
 ATOM_LIKE_DISPLAY = "[=]<category>/<package>[-<version>[-r<revision>]]"
 SET_DISPLAY = "@<set>"
@@ -25,6 +26,15 @@ def extract_category_package_from(atomlike):
     return match.group("category"), match.group("package")
 
 
+def strip_version_from(cpv):
+    """Turn ``<category>/<package>-<version>[-r<revision>]`` into ``<category>/<package>``
+
+    Unlike ``extract_category_package_from``, this is lenient towards
+    package names and versions (e.g. with underscores) that the atom syntax above does not cover.
+    """
+    return _version_suffix_pattern.sub("", cpv)
+
+
 def extract_set_from(set_candidate):
     match = re.compile(_set_pattern).match(set_candidate)
     if match is None:
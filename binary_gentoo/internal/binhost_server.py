@@ -0,0 +1,319 @@
+# Copyright (C) 2021 Sebastian Pipping <sebastian@pipping.org>
+# Licensed under GNU Affero GPL version 3 or later
+
+import asyncio
+import gzip
+import os
+import re
+import time
+from contextlib import suppress
+from email.utils import formatdate, parsedate_to_datetime
+from http import HTTPStatus
+from stat import S_ISREG
+from urllib.parse import unquote
+
+from .atomic_files import atomically_written
+
+_INDEX_PATH = "Packages"
+_COMPRESSED_INDEX_PATH = "Packages.gz"
+
+_timestamp_pattern = re.compile("^TIMESTAMP: ([0-9]+)$", flags=re.MULTILINE)
+_byte_range_pattern = re.compile("^bytes=([0-9]*)-([0-9]*)$")
+
+
+def _read_index_timestamp(index_filename) -> int:
+    with open(index_filename) as f:
+        header = f.read(64 * 1024).split("\n\n", maxsplit=1)[0]
+    match = _timestamp_pattern.search(header)
+    if match is None:
+        raise ValueError(f"Index file {index_filename!r} lacks a TIMESTAMP header")
+    return int(match.group(1))
+
+
+def _write_compressed_index(index_filename, compressed_index_filename, timestamp):
+    with (
+        open(index_filename, "rb") as fin,
+        atomically_written(compressed_index_filename, "wb") as fout,
+    ):
+        with gzip.GzipFile(fileobj=fout, mode="wb", mtime=timestamp) as gzip_file:
+            while chunk := fin.read(1024 * 1024):
+                gzip_file.write(chunk)
+
+
+def parse_byte_range(range_header: str, file_size: int) -> tuple[int, int] | None:
+    """Turn a single-range ``Range`` header value into an ``(offset, length)`` tuple
+
+    Returns ``None`` for ranges that cannot be satisfied
+    and raises ``ValueError`` for ranges that are not supported.
+    """
+    match = _byte_range_pattern.match(range_header.strip())
+    if match is None or match.groups() == ("", ""):
+        raise ValueError(f"Unsupported range {range_header!r}")
+    first, last = match.groups()
+
+    if not first:  # i.e. suffix range "bytes=-N"
+        length = min(int(last), file_size)
+        if length == 0:
+            return None
+        return file_size - length, length
+
+    first = int(first)
+    last = file_size - 1 if not last else min(int(last), file_size - 1)
+    if first > last:
+        return None
+    return first, last - first + 1
+
+
+class _Response:
+    def __init__(self, status: HTTPStatus, headers: dict | None = None):
+        self.status = status
+        self.headers = headers or {}
+        self.bytes_sent = 0
+
+
+class BinhostServer:
+    """Serves a pkgdir over HTTP, with the index-derived caching metadata that emerge can use
+
+    Where ``Packages.gz`` cannot be written to the pkgdir (e.g. for lack of permission),
+    the index is served uncompressed only.
+    """
+
+    def __init__(self, host_pkgdir):
+        self._host_pkgdir = os.path.realpath(host_pkgdir)
+        self._index_filename = os.path.join(self._host_pkgdir, _INDEX_PATH)
+        self._compressed_index_filename = os.path.join(self._host_pkgdir, _COMPRESSED_INDEX_PATH)
+        self._index_signature = None
+        self._index_timestamp = None
+        self._index_compressed = False
+        self._index_lock = asyncio.Lock()
+
+    async def start(self, host, port) -> asyncio.Server:
+        return await asyncio.start_server(self._handle_connection, host, port)
+
+    async def _refresh_index(self):
+        """Re-read TIMESTAMP and regenerate Packages.gz whenever Packages changed"""
+        async with self._index_lock:
+            stat = os.stat(self._index_filename)
+            signature = (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+            if signature == self._index_signature:
+                return
+
+            loop = asyncio.get_running_loop()
+            timestamp = _read_index_timestamp(self._index_filename)
+            try:
+                await loop.run_in_executor(
+                    None,
+                    _write_compressed_index,
+                    self._index_filename,
+                    self._compressed_index_filename,
+                    timestamp,
+                )
+            except OSError as e:  # e.g. PermissionError or a read-only file system
+                if self._index_compressed or self._index_signature is None:
+                    print(
+                        f"Serving {self._index_filename!r} uncompressed only"
+                        f" since {self._compressed_index_filename!r} cannot be written: {e}",
+                        flush=True,
+                    )
+                self._index_compressed = False
+            else:
+                self._index_compressed = True
+
+            self._index_signature = signature
+            self._index_timestamp = timestamp
+
+    def _resolve(self, target: str) -> str | None:
+        path = os.path.normpath(unquote(target.split("?", maxsplit=1)[0]).lstrip("/"))
+        if path.startswith("..") or os.path.isabs(path):
+            return None
+        filename = os.path.realpath(os.path.join(self._host_pkgdir, path))
+        if os.path.commonpath([filename, self._host_pkgdir]) != self._host_pkgdir:
+            return None
+        return filename
+
+    @staticmethod
+    def _is_not_modified(request_headers: dict, etag: str, last_modified: int) -> bool:
+        if_none_match = request_headers.get("if-none-match")
+        if if_none_match is not None:
+            candidates = {candidate.strip() for candidate in if_none_match.split(",")}
+            return "*" in candidates or etag in candidates
+
+        if_modified_since = request_headers.get("if-modified-since")
+        if if_modified_since is not None:
+            try:
+                return last_modified <= parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError):
+                pass
+
+        return False
+
+    async def _send_head(self, writer, response: _Response):
+        lines = [f"HTTP/1.1 {response.status.value} {response.status.phrase}"]
+        lines += [f"{name}: {value}" for name, value in response.headers.items()]
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1"))
+        await writer.drain()
+
+    async def _send_error(self, writer, status: HTTPStatus, headers=None) -> _Response:
+        body = f"{status.value} {status.phrase}\n".encode("ascii")
+        response = _Response(
+            status,
+            {
+                "Content-Type": "text/plain; charset=utf-8",
+                "Content-Length": str(len(body)),
+                **(headers or {}),
+            },
+        )
+        await self._send_head(writer, response)
+        writer.write(body)
+        await writer.drain()
+        response.bytes_sent = len(body)
+        return response
+
+    async def _serve_request(self, writer, method, target, request_headers) -> _Response:
+        if method not in ("GET", "HEAD"):
+            return await self._send_error(
+                writer, HTTPStatus.METHOD_NOT_ALLOWED, {"Allow": "GET, HEAD"}
+            )
+
+        filename = self._resolve(target)
+        if filename is None:
+            return await self._send_error(writer, HTTPStatus.NOT_FOUND)
+
+        response_headers = {}
+        index_timestamp = None
+        if filename in (self._index_filename, self._compressed_index_filename):
+            try:
+                await self._refresh_index()
+            except FileNotFoundError:
+                return await self._send_error(writer, HTTPStatus.NOT_FOUND)
+            except (OSError, ValueError):
+                return await self._send_error(writer, HTTPStatus.INTERNAL_SERVER_ERROR)
+            index_timestamp = self._index_timestamp
+            if filename == self._index_filename:
+                response_headers["Content-Type"] = "text/plain; charset=utf-8"
+                response_headers["Vary"] = "Accept-Encoding"
+                if self._index_compressed and "gzip" in request_headers.get("accept-encoding", ""):
+                    filename = self._compressed_index_filename
+                    response_headers["Content-Encoding"] = "gzip"
+            elif not self._index_compressed:  # i.e. a Packages.gz present would be stale
+                return await self._send_error(writer, HTTPStatus.NOT_FOUND)
+            else:
+                response_headers["Content-Type"] = "application/gzip"
+        else:
+            response_headers["Content-Type"] = "application/octet-stream"
+
+        try:
+            f = open(filename, "rb")
+        except (FileNotFoundError, IsADirectoryError, NotADirectoryError, PermissionError):
+            return await self._send_error(writer, HTTPStatus.NOT_FOUND)
+
+        with f:
+            stat = os.fstat(f.fileno())
+            if not S_ISREG(stat.st_mode):
+                return await self._send_error(writer, HTTPStatus.NOT_FOUND)
+
+            if index_timestamp is not None:
+                last_modified = index_timestamp
+                encoding_suffix = "-gzip" if filename == self._compressed_index_filename else ""
+                etag = f'"{index_timestamp}{encoding_suffix}"'
+            else:
+                last_modified = int(stat.st_mtime)
+                etag = f'"{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+
+            response_headers["ETag"] = etag
+            response_headers["Last-Modified"] = formatdate(last_modified, usegmt=True)
+            response_headers["Accept-Ranges"] = "bytes"
+
+            if self._is_not_modified(request_headers, etag, last_modified):
+                response = _Response(HTTPStatus.NOT_MODIFIED, response_headers)
+                await self._send_head(writer, response)
+                return response
+
+            offset, length = 0, stat.st_size
+            status = HTTPStatus.OK
+            range_header = request_headers.get("range")
+            if_range = request_headers.get("if-range")
+            if range_header is not None and if_range in (None, etag):
+                try:
+                    byte_range = parse_byte_range(range_header, stat.st_size)
+                except ValueError:
+                    byte_range = (offset, length)  # i.e. ignore, as permitted by RFC 9110
+                else:
+                    if byte_range is None:
+                        return await self._send_error(
+                            writer,
+                            HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE,
+                            {"Content-Range": f"bytes */{stat.st_size}"},
+                        )
+                    status = HTTPStatus.PARTIAL_CONTENT
+                    response_headers["Content-Range"] = (
+                        f"bytes {byte_range[0]}-{sum(byte_range) - 1}/{stat.st_size}"
+                    )
+                offset, length = byte_range
+
+            response_headers["Content-Length"] = str(length)
+            response = _Response(status, response_headers)
+            await self._send_head(writer, response)
+
+            if method == "GET" and length > 0:
+                loop = asyncio.get_running_loop()
+                response.bytes_sent = await loop.sendfile(writer.transport, f, offset, length)
+
+        return response
+
+    async def _handle_connection(self, reader, writer):
+        peer = writer.get_extra_info("peername")
+        client = peer[0] if peer else "-"
+        try:
+            while True:
+                try:
+                    request_line = await reader.readline()
+                    if not request_line:
+                        break
+                    started = time.monotonic()
+
+                    request_headers = {}
+                    while True:
+                        header_line = await reader.readline()
+                        if header_line in (b"\r\n", b"\n", b""):
+                            break
+                        name, _, value = header_line.decode("latin-1").partition(":")
+                        request_headers[name.strip().lower()] = value.strip()
+                except ValueError:  # i.e. a line exceeded the limit of the stream reader
+                    await self._send_error(writer, HTTPStatus.REQUEST_HEADER_FIELDS_TOO_LARGE)
+                    break
+
+                request_line = request_line.decode("latin-1").rstrip("\r\n")
+                try:
+                    method, target, version = request_line.split(" ")
+                except ValueError:
+                    response = await self._send_error(writer, HTTPStatus.BAD_REQUEST)
+                    version = "HTTP/1.0"
+                else:
+                    response = await self._serve_request(writer, method, target, request_headers)
+
+                elapsed_milliseconds = (time.monotonic() - started) * 1000
+                print(
+                    f'{client} "{request_line}" {response.status.value}'
+                    f" {response.bytes_sent} {elapsed_milliseconds:.1f}ms",
+                    flush=True,
+                )
+
+                if version != "HTTP/1.1" or request_headers.get("connection") == "close":
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+            pass
+        finally:
+            writer.close()
+
+
+async def serve_binhost(host_pkgdir, host, port):
+    binhost_server = BinhostServer(host_pkgdir)
+    with suppress(OSError, ValueError):  # i.e. left for requests to report
+        await binhost_server._refresh_index()  # i.e. have Packages.gz ready early
+    server = await binhost_server.start(host, port)
+    for sock in server.sockets:
+        address, port, *_ = sock.getsockname()
+        print(f"Serving {host_pkgdir!r} at http://{address}:{port}/ ...", flush=True)
+    async with server:
+        await server.serve_forever()
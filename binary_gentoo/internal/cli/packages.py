@@ -1,16 +1,27 @@
 # Copyright (C) 2021 Sebastian Pipping <sebastian@pipping.org>
 # Licensed under GNU Affero GPL version 3 or later
 
+import asyncio
 import datetime
+import hashlib
+import heapq
 import os
 import re
 import sys
 import time
-from argparse import ArgumentParser
+from argparse import ArgumentParser, ArgumentTypeError
+from array import array
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import suppress
 from dataclasses import dataclass
+from functools import partial
 from unittest.mock import Mock
 
+from ..atoms import strip_version_from
+from ..binhost_server import serve_binhost
+from ..json_formatter import dump_json_for_humans
+from ..packages_index import PackagesIndex
 from ..reporter import exception_reporting
 from ._enrich import enrich_host_pkgdir_of
 from ._parser import add_pkgdir_argument_to, add_version_argument_to
@@ -74,6 +85,15 @@ def adjust_index_file_header(
     return new_header
 
 
+def set_index_file_header_entry(header: str, key: str, value: str) -> str:
+    """Set entry ``key`` in an index file header, keeping entries sorted by key like Portage"""
+    lines = [line for line in header.split("\n") if not line.startswith(f"{key}: ")]
+    new_line = f"{key}: {value}"
+    position = next((i for i, line in enumerate(lines) if line > new_line), len(lines))
+    lines.insert(position, new_line)
+    return "\n".join(lines)
+
+
 def has_safe_package_path(package):
     return (
         not package.path.startswith("/")
@@ -82,85 +102,513 @@ def has_safe_package_path(package):
     )
 
 
-def read_packages_index_file(config):
-    packages_index_filename = os.path.join(config.host_pkgdir, "Packages")
-    with open(packages_index_filename) as f:
-        content = f.read()
-    blocks = content.split("\n\n")
-    header, *packages_blocks = blocks
-    return header, packages_blocks, packages_index_filename
-
+def read_packages_index(config) -> PackagesIndex:
+    return PackagesIndex.load(os.path.join(config.host_pkgdir, "Packages"))
 
-def run_delete(config):
-    header, packages_blocks, packages_index_filename = read_packages_index_file(config)
 
-    matcher = (
-        re.compile(config.metadata, flags=re.MULTILINE)
-        if config.metadata
-        else Mock(search=Mock(return_value=True))
+def save_packages_index(index: PackagesIndex, indices_to_keep):
+    header = adjust_index_file_header(
+        index.header,
+        new_package_count=len(indices_to_keep),
+        new_modification_timestamp=int(time.time()),
     )
-    packages_to_keep = []
-    packages_to_delete = []
-
-    empty_block_count = 0
-    for package_block in packages_blocks:
-        if not package_block:
-            empty_block_count += 1
-        target = (
-            packages_to_delete
-            if (package_block and matcher.search(package_block))
-            else packages_to_keep
+    index.save(index.filename, header, indices_to_keep)
+
+
+def remove_package_file(host_pkgdir, path):
+    """Remove a binary package file and its then-empty package and category directories"""
+    abs_path_package_file = os.path.join(host_pkgdir, path)
+    with suppress(FileNotFoundError):
+        os.remove(abs_path_package_file)
+        with suppress(OSError):
+            abs_path_package_dir = os.path.dirname(abs_path_package_file)
+            os.rmdir(abs_path_package_dir)
+            abs_path_category_dir = os.path.dirname(abs_path_package_dir)
+            os.rmdir(abs_path_category_dir)
+
+
+_BINARY_PACKAGE_FILENAME_SUFFIXES = (".gpkg.tar", ".tbz2", ".xpak")
+
+
+def _scan_directory_for_binary_packages(host_pkgdir, directory):
+    stat_of = {}
+    pending_directories = [directory]
+    while pending_directories:
+        with os.scandir(pending_directories.pop()) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    pending_directories.append(entry.path)
+                elif entry.name.endswith(_BINARY_PACKAGE_FILENAME_SUFFIXES) and entry.is_file(
+                    follow_symlinks=False
+                ):
+                    path = os.path.relpath(entry.path, host_pkgdir)
+                    stat_of[path] = entry.stat(follow_symlinks=False)
+    return stat_of
+
+
+def scan_pkgdir_for_binary_packages(host_pkgdir, jobs=None) -> dict[str, os.stat_result]:
+    """Map relative paths of all binary package files below ``host_pkgdir`` to their stats
+
+    Category directories are scanned in parallel.
+    """
+    with os.scandir(host_pkgdir) as entries:
+        category_directories = sorted(
+            entry.path for entry in entries if entry.is_dir(follow_symlinks=False)
         )
-        target.append(package_block)
-    original_package_count = len(packages_blocks) - empty_block_count
 
-    for package_block in packages_to_delete:
-        package = parse_package_block(package_block)
+    stat_of = {}
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        for category_stat_of in executor.map(
+            partial(_scan_directory_for_binary_packages, host_pkgdir), category_directories
+        ):
+            stat_of.update(category_stat_of)
+    return stat_of
+
+
+def _hash_file(filename):
+    hasher = hashlib.sha256()
+    with open(filename, "rb") as f:
+        for chunk in iter(partial(f.read, 1024 * 1024), b""):
+            hasher.update(chunk)
+    return hasher.digest()
+
+
+def find_duplicate_binary_packages(host_pkgdir, stat_of: dict, jobs=None) -> list[list[str]]:
+    """Find groups of byte-identical binary package files that are not hardlinked yet
+
+    Only files that share both file system and size with another file are hashed at all.
+    """
+    paths_of_device_and_size = defaultdict(list)
+    seen_inodes = set()
+    for path, stat in sorted(stat_of.items()):
+        inode = (stat.st_dev, stat.st_ino)
+        if inode in seen_inodes:  # i.e. hardlinked already
+            continue
+        seen_inodes.add(inode)
+        paths_of_device_and_size[(stat.st_dev, stat.st_size)].append(path)
+
+    candidate_paths = [
+        path for paths in paths_of_device_and_size.values() if len(paths) > 1 for path in paths
+    ]
+
+    paths_of_digest = defaultdict(list)
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        digests = executor.map(
+            _hash_file, [os.path.join(host_pkgdir, path) for path in candidate_paths]
+        )
+        for path, digest in zip(candidate_paths, digests):
+            stat = stat_of[path]
+            paths_of_digest[(stat.st_dev, stat.st_size, digest)].append(path)
+
+    return [paths for paths in paths_of_digest.values() if len(paths) > 1]
+
+
+def replace_with_hardlink(source_filename, target_filename):
+    """Replace file ``target_filename`` by a hardlink to ``source_filename``, atomically"""
+    temp_filename = f"{target_filename}.tmp-hardlink"
+    with suppress(FileNotFoundError):
+        os.remove(temp_filename)  # e.g. left over from an interrupted previous run
+    os.link(source_filename, temp_filename)
+    os.replace(temp_filename, target_filename)
+
+
+def run_dedupe(config):
+    stat_of = scan_pkgdir_for_binary_packages(config.host_pkgdir, jobs=config.jobs)
+
+    deduplicated_file_count = 0
+    bytes_saved = 0
+    for paths in find_duplicate_binary_packages(config.host_pkgdir, stat_of, jobs=config.jobs):
+        kept_path, *duplicate_paths = paths
+        for duplicate_path in duplicate_paths:
+            print(f"Replacing file {duplicate_path!r} by a hardlink to {kept_path!r}...")
+            if not config.pretend:
+                replace_with_hardlink(
+                    os.path.join(config.host_pkgdir, kept_path),
+                    os.path.join(config.host_pkgdir, duplicate_path),
+                )
+            deduplicated_file_count += 1
+            bytes_saved += stat_of[duplicate_path].st_size
+
+    print(
+        f"{deduplicated_file_count} duplicate file(s) hardlinked, {bytes_saved} bytes"
+        f" {'would be ' if config.pretend else ''}saved"
+    )
+
+
+def drop_packages(config, index: PackagesIndex, indices_to_delete, indices_to_keep):
+    for i in indices_to_delete:
+        package = parse_package_block(index.block(i))
         if has_safe_package_path(package):
             print(f"Dropping entry {package.full_name!r} and deleting file {package.path!r}...")
             if not config.pretend:
-                abs_path_package_file = os.path.join(config.host_pkgdir, package.path)
-                with suppress(FileNotFoundError):
-                    os.remove(abs_path_package_file)
-                    with suppress(OSError):
-                        abs_path_package_dir = os.path.dirname(abs_path_package_file)
-                        os.rmdir(abs_path_package_dir)
-                        abs_path_category_dir = os.path.dirname(abs_path_package_dir)
-                        os.rmdir(abs_path_category_dir)
+                remove_package_file(config.host_pkgdir, package.path)
         else:
             print(f"Dropping entry {package.full_name!r} BUT SKIPPING file {package.path!r}...")
 
-    new_package_count = len(packages_to_keep) - empty_block_count
-    now_seconds_since_epoch = int(time.time())
-    header = adjust_index_file_header(
-        header,
-        new_package_count=new_package_count,
-        new_modification_timestamp=now_seconds_since_epoch,
+    # NOTE: Saving regardless would bump TIMESTAMP and make consumers re-fetch the index
+    if not config.pretend and indices_to_delete:
+        save_packages_index(index, indices_to_keep)
+
+
+def run_delete(config):
+    matcher = (
+        re.compile(config.metadata, flags=re.MULTILINE)
+        if config.metadata
+        else Mock(search=Mock(return_value=True))
+    )
+
+    with read_packages_index(config) as index:
+        indices_to_keep = array("q")
+        indices_to_delete = array("q")
+        for i in range(len(index)):
+            target = indices_to_delete if matcher.search(index.block(i)) else indices_to_keep
+            target.append(i)
+
+        drop_packages(config, index, indices_to_delete, indices_to_keep)
+
+        print(f"{len(indices_to_delete)} of {len(index)} package(s) dropped")
+
+
+def run_orphans(config):
+    stat_of = scan_pkgdir_for_binary_packages(config.host_pkgdir, jobs=config.jobs)
+
+    with read_packages_index(config) as index:
+        # NOTE: Portage writes package files before adding them to the index, so files
+        #       not older than the index may well be about to be indexed
+        index_mtime_ns = os.stat(index.filename).st_mtime_ns
+
+        indexed_paths = set()
+        indices_to_keep = array("q")
+        indices_with_missing_files = array("q")
+        for i in range(len(index)):
+            path = index.path(i)
+            indexed_paths.add(path)
+            target = indices_to_keep if path in stat_of else indices_with_missing_files
+            target.append(i)
+
+        unindexed_paths = []
+        for path in sorted(set(stat_of) - indexed_paths):
+            if stat_of[path].st_mtime_ns >= index_mtime_ns:
+                print(f"Skipping file {path!r} that is not older than the index")
+                continue
+            unindexed_paths.append(path)
+
+        for i in indices_with_missing_files:
+            full_name, path = index.full_name(i), index.path(i)
+            if config.delete:
+                print(f"Dropping entry {full_name!r} of missing file {path!r}...")
+            else:
+                print(f"Entry {full_name!r} references missing file {path!r}")
+
+        for path in unindexed_paths:
+            if config.delete:
+                print(f"Deleting unindexed file {path!r}...")
+                if not config.pretend:
+                    remove_package_file(config.host_pkgdir, path)
+            else:
+                print(f"File {path!r} is not referenced by any entry")
+
+        if config.delete and not config.pretend and indices_with_missing_files:
+            save_packages_index(index, indices_to_keep)
+
+    if not config.delete:
+        outcome = "found"
+    elif config.pretend:
+        outcome = "would be removed"
+    else:
+        outcome = "removed"
+    print(
+        f"{len(indices_with_missing_files)} entry/entries without file"
+        f" and {len(unindexed_paths)} file(s) without entry {outcome}"
     )
 
-    if not config.pretend:
-        with open(packages_index_filename, "w") as f:
-            content = "\n\n".join([header] + packages_to_keep)
-            f.write(content)
 
-    print(f"{len(packages_to_delete)} of {original_package_count} package(s) dropped")
+def run_export_index(config):
+    matchers = [re.compile(pattern, flags=re.MULTILINE) for pattern in config.filters]
+    output_filename = os.path.realpath(config.output)
+    new_modification_timestamp = int(time.time())
+
+    # Make sure consumers see a monotonically increasing timestamp for the output, as well
+    with suppress(FileNotFoundError), PackagesIndex.load(output_filename) as previous_output:
+        match = re.search("^TIMESTAMP: ([0-9]+)$", previous_output.header, flags=re.MULTILINE)
+        if match is not None:
+            new_modification_timestamp = max(new_modification_timestamp, int(match.group(1)) + 1)
+
+    with read_packages_index(config) as index:
+        indices_to_export = array(
+            "q",
+            (
+                i
+                for i in range(len(index))
+                if all(matcher.search(index.block(i)) for matcher in matchers)
+            ),
+        )
+
+        header = adjust_index_file_header(
+            index.header,
+            new_package_count=len(indices_to_export),
+            new_modification_timestamp=new_modification_timestamp,
+        )
+        if config.uri is not None:
+            header = set_index_file_header_entry(header, "URI", config.uri)
+        os.makedirs(os.path.dirname(output_filename), exist_ok=True)
+        index.save(output_filename, header, indices_to_export)
+
+        print(f"{len(indices_to_export)} of {len(index)} package(s) exported")
 
 
 def run_list(config):
-    _header, packages_blocks, _packages_index_filename = read_packages_index_file(config)
+    with read_packages_index(config) as index:
+        for i in index.indices_sorted_by_build_time():
+            if config.atoms:
+                print(f"={index.cpvs[i]}")
+            else:
+                build_datetime = datetime.datetime.fromtimestamp(index.build_times[i])
+                print(f"[{build_datetime}] {index.full_name(i)}")
+
+
+def select_packages_to_retain(
+    index: PackagesIndex, now: int, max_age: int | None, max_bytes: int | None
+) -> tuple[array, array]:
+    """Split index entries into ``(indices_to_delete, indices_to_keep)``
+
+    Entries are evicted oldest-first for as long as they exceed ``max_age``
+    or the total size exceeds ``max_bytes``,
+    but the newest instance of each CPV is never evicted.
+    """
+    newest_index_of_cpv = {}
+    for i in range(len(index)):
+        newest_i = newest_index_of_cpv.setdefault(index.cpvs[i], i)
+        if (index.build_times[i], index.build_ids[i]) > (
+            index.build_times[newest_i],
+            index.build_ids[newest_i],
+        ):
+            newest_index_of_cpv[index.cpvs[i]] = i
+    protected_indices = set(newest_index_of_cpv.values())
+
+    eviction_heap = [
+        (index.build_times[i], index.full_name(i), i)
+        for i in range(len(index))
+        if i not in protected_indices
+    ]
+    heapq.heapify(eviction_heap)
+
+    total_bytes = sum(index.size(i) or 0 for i in range(len(index)))
+    oldest_build_time_to_keep = None if max_age is None else now - max_age
+    evicted_indices = set()
+    while eviction_heap:
+        build_time, _, i = eviction_heap[0]
+        too_old = oldest_build_time_to_keep is not None and build_time < oldest_build_time_to_keep
+        too_big = max_bytes is not None and total_bytes > max_bytes
+        if not (too_old or too_big):
+            break
+        heapq.heappop(eviction_heap)
+        evicted_indices.add(i)
+        total_bytes -= index.size(i) or 0
+
+    indices_to_delete = array("q")
+    indices_to_keep = array("q")
+    for i in range(len(index)):
+        target = indices_to_delete if i in evicted_indices else indices_to_keep
+        target.append(i)
+    return indices_to_delete, indices_to_keep
+
+
+def run_retain(config):
+    with read_packages_index(config) as index:
+        indices_to_delete, indices_to_keep = select_packages_to_retain(
+            index, now=int(time.time()), max_age=config.max_age, max_bytes=config.max_bytes
+        )
 
-    packages = []
-    for package_block in packages_blocks:
-        if not package_block:
-            continue
-        packages.append(parse_package_block(package_block))
+        drop_packages(config, index, indices_to_delete, indices_to_keep)
 
-    for package in sorted(packages, key=lambda p: (p.build_time, p.full_name)):
-        build_datetime = datetime.datetime.fromtimestamp(package.build_time)
-        if config.atoms:
-            print(f"={package.cpv}")
+        bytes_freed = sum(index.size(i) or 0 for i in indices_to_delete)
+        bytes_left = sum(index.size(i) or 0 for i in indices_to_keep)
+        print(
+            f"{len(indices_to_delete)} of {len(index)} package(s) dropped"
+            f", {bytes_freed} bytes freed, {bytes_left} bytes left"
+        )
+        if config.max_bytes is not None and bytes_left > config.max_bytes:
+            print(
+                f"WARNING: Only the newest instance of each CPV is left"
+                f" but {bytes_left} bytes still exceed {config.max_bytes} bytes",
+                file=sys.stderr,
+            )
+
+
+def run_serve(config):
+    asyncio.run(serve_binhost(config.host_pkgdir, config.address, config.port))
+
+
+def _top(bytes_and_count_of: dict, top: int) -> list[dict]:
+    items = sorted(bytes_and_count_of.items(), key=lambda item: (-item[1]["bytes"], item[0]))[:top]
+    return [{"name": name, **bytes_and_count} for name, bytes_and_count in items]
+
+
+def collect_stats(index: PackagesIndex, stat_of: dict, top: int) -> dict:
+    bytes_and_count_of_category = defaultdict(lambda: {"bytes": 0, "count": 0})
+    bytes_and_count_of_package = defaultdict(lambda: {"bytes": 0, "count": 0})
+    bytes_and_count_of_cpv = defaultdict(lambda: {"bytes": 0, "count": 0})
+    entries = []
+    missing_files = []
+    size_mismatches = []
+    indexed_paths = set()
+
+    for i in range(len(index)):
+        cpv, path, index_size = index.cpvs[i], index.path(i), index.size(i)
+        indexed_paths.add(path)
+        stat = stat_of.get(path)
+        if stat is None:
+            missing_files.append(path)
+            package_bytes = 0
         else:
-            print(f"[{build_datetime}] {package.full_name}")
+            package_bytes = stat.st_size
+            if index_size is not None and index_size != stat.st_size:
+                size_mismatches.append(
+                    {
+                        "disk_bytes": stat.st_size,
+                        "index_bytes": index_size,
+                        "path": path,
+                    }
+                )
+
+        for bytes_and_count in (
+            bytes_and_count_of_category[index.categories[i]],
+            bytes_and_count_of_package[strip_version_from(cpv)],
+            bytes_and_count_of_cpv[cpv],
+        ):
+            bytes_and_count["bytes"] += package_bytes
+            bytes_and_count["count"] += 1
+
+        entries.append({"bytes": package_bytes, "name": index.full_name(i), "path": path})
+
+    unindexed_paths = set(stat_of) - indexed_paths
+    stat_of_inode = {(stat.st_dev, stat.st_ino): stat for stat in stat_of.values()}
+    fan_out = {
+        cpv: bytes_and_count
+        for cpv, bytes_and_count in bytes_and_count_of_cpv.items()
+        if bytes_and_count["count"] > 1
+    }
+    build_id_fan_out = Counter(
+        bytes_and_count["count"] for bytes_and_count in bytes_and_count_of_cpv.values()
+    )
+
+    return {
+        "categories": _top(bytes_and_count_of_category, top),
+        "discrepancies": {
+            "missing_files": sorted(missing_files),
+            "size_mismatches": sorted(size_mismatches, key=lambda d: d["path"]),
+            "unindexed_files": {
+                "bytes": sum(stat_of[path].st_size for path in unindexed_paths),
+                "count": len(unindexed_paths),
+            },
+        },
+        "entries": sorted(entries, key=lambda d: (-d["bytes"], d["name"]))[:top],
+        "instances": {
+            "cpvs_per_instance_count": {
+                str(count): cpvs for count, cpvs in sorted(build_id_fan_out.items())
+            },
+            "multi_instance_cpvs": _top(fan_out, top),
+        },
+        "packages": _top(bytes_and_count_of_package, top),
+        "total": {
+            "disk_bytes": sum(stat.st_size for stat in stat_of_inode.values()),
+            "disk_files": len(stat_of),
+            "index_bytes": sum(size for size in index.sizes if size > 0),
+            "index_entries": len(index),
+        },
+    }
+
+
+def _print_stats_table(title, rows, columns):
+    print(f"{title}:")
+    if not rows:
+        print("  (none)")
+    for row in rows:
+        *number_columns, name_column = columns
+        numbers_flat = "  ".join(f"{row[column]:>12}" for column in number_columns)
+        print(f"  {numbers_flat}  {row[name_column]}")
+
+
+def run_stats(config):
+    stat_of = scan_pkgdir_for_binary_packages(config.host_pkgdir, jobs=config.jobs)
+    with read_packages_index(config) as index:
+        stats = collect_stats(index, stat_of, top=config.top)
+
+    if config.json:
+        dump_json_for_humans(stats, sys.stdout)
+        return
+
+    total = stats["total"]
+    print(
+        f"{total['index_entries']} index entries ({total['index_bytes']} bytes), "
+        f"{total['disk_files']} files on disk ({total['disk_bytes']} bytes)"
+    )
+    _print_stats_table("Heaviest categories", stats["categories"], ["bytes", "count", "name"])
+    _print_stats_table("Heaviest packages", stats["packages"], ["bytes", "count", "name"])
+    _print_stats_table(
+        "Heaviest multi-instance CPVs",
+        stats["instances"]["multi_instance_cpvs"],
+        ["bytes", "count", "name"],
+    )
+    _print_stats_table("Heaviest entries", stats["entries"], ["bytes", "name"])
+
+    discrepancies = stats["discrepancies"]
+    for path in discrepancies["missing_files"]:
+        print(f"Index entry file {path!r} is missing on disk")
+    for size_mismatch in discrepancies["size_mismatches"]:
+        print(
+            f"Index entry file {size_mismatch['path']!r} has {size_mismatch['disk_bytes']} bytes"
+            f" on disk but {size_mismatch['index_bytes']} bytes in the index"
+        )
+    unindexed_files = discrepancies["unindexed_files"]
+    print(
+        f"{unindexed_files['count']} file(s) on disk ({unindexed_files['bytes']} bytes)"
+        " not referenced by the index"
+    )
+
+
+_duration_pattern = re.compile("^(?P<count>[0-9]+)(?P<unit>[smhdw])$")
+_SECONDS_PER_DURATION_UNIT = {
+    "s": 1,
+    "m": 60,
+    "h": 60 * 60,
+    "d": 24 * 60 * 60,
+    "w": 7 * 24 * 60 * 60,
+}
+
+_byte_size_pattern = re.compile("^(?P<count>[0-9]+)(?P<unit>[KMGT]?)$")
+_BYTES_PER_BYTE_SIZE_UNIT = {
+    "": 1,
+    "K": 1024,
+    "M": 1024**2,
+    "G": 1024**3,
+    "T": 1024**4,
+}
+
+
+def parse_duration(text: str) -> int:
+    match = _duration_pattern.match(text)
+    if match is None:
+        raise ArgumentTypeError(f'Not valid "<count>(s|m|h|d|w)" syntax: {text!r}')
+    return int(match.group("count")) * _SECONDS_PER_DURATION_UNIT[match.group("unit")]
+
+
+def parse_byte_size(text: str) -> int:
+    match = _byte_size_pattern.match(text)
+    if match is None:
+        raise ArgumentTypeError(f'Not valid "<count>[K|M|G|T]" syntax: {text!r}')
+    return int(match.group("count")) * _BYTES_PER_BYTE_SIZE_UNIT[match.group("unit")]
+
+
+def _add_jobs_argument_to(parser):
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        metavar="N",
+        help="use up to N threads for scanning directories and hashing files"
+        " (default: auto-detect)",
+    )
 
 
 def parse_command_line(argv):
@@ -174,6 +622,19 @@ def parse_command_line(argv):
 
     subcommands = parser.add_subparsers(title="subcommands", required=True)
 
+    dedupe_command = subcommands.add_parser(
+        "dedupe",
+        help="replace byte-identical package files by hardlinks",
+    )
+    dedupe_command.add_argument(
+        "--pretend",
+        default=False,
+        action="store_true",
+        help="only display what would be hardlinked (default: replace files)",
+    )
+    _add_jobs_argument_to(dedupe_command)
+    dedupe_command.set_defaults(command_func=run_dedupe)
+
     delete_command = subcommands.add_parser(
         "delete",
         help="drop package entries and delete their respective .xpak/.tbz2 files",
@@ -193,6 +654,38 @@ def parse_command_line(argv):
     )
     delete_command.set_defaults(command_func=run_delete)
 
+    export_index_command = subcommands.add_parser(
+        "export-index",
+        help="write a filtered copy of the package index (e.g. for a group of consumers)",
+    )
+    export_index_command.add_argument(
+        "--filter",
+        dest="filters",
+        metavar="REGEX",
+        action="append",
+        default=[],
+        help="limit export to packages "
+        "where any metadata line matches "
+        'pattern REGEX (e.g. "CPV: virtual/.+"); '
+        "if given multiple times, all patterns need to match (default: export all packages)",
+    )
+    export_index_command.add_argument(
+        "--output",
+        metavar="FILE",
+        required=True,
+        help='location to write the filtered index to (e.g. "consumers/servers/Packages"); '
+        "package paths in the index remain relative to pkgdir",
+    )
+    export_index_command.add_argument(
+        "--uri",
+        metavar="URL",
+        help="base URL of pkgdir that package paths in the index are relative to, "
+        'for header "URI" (e.g. "https://binhost.example.org/packages/"); '
+        "needed where the filtered index is served from a location other than pkgdir "
+        "(default: keep the header of the index as is)",
+    )
+    export_index_command.set_defaults(command_func=run_export_index)
+
     list_command = subcommands.add_parser("list", help="list packages in chronological order")
     list_command.add_argument(
         "--atoms",
@@ -204,7 +697,98 @@ def parse_command_line(argv):
     )
     list_command.set_defaults(command_func=run_list)
 
-    return parser.parse_args(argv[1:])
+    orphans_command = subcommands.add_parser(
+        "orphans",
+        help="find (and optionally remove) package entries without files "
+        "as well as package files without entries",
+    )
+    orphans_command.add_argument(
+        "--delete",
+        default=False,
+        action="store_true",
+        help="drop entries without files and delete files without entries "
+        "that are older than the index (default: only display orphans)",
+    )
+    orphans_command.add_argument(
+        "--pretend",
+        default=False,
+        action="store_true",
+        help="with --delete, only display what would be cleaned (default: delete files)",
+    )
+    _add_jobs_argument_to(orphans_command)
+    orphans_command.set_defaults(command_func=run_orphans)
+
+    retain_command = subcommands.add_parser(
+        "retain",
+        help="drop oldest package entries (and files) to meet an age and/or size budget"
+        ", always keeping the newest instance of each CPV",
+    )
+    retain_command.add_argument(
+        "--max-age",
+        type=parse_duration,
+        metavar="DURATION",
+        help='drop packages built longer than DURATION ago (e.g. "90d", default: no limit)',
+    )
+    retain_command.add_argument(
+        "--max-bytes",
+        type=parse_byte_size,
+        metavar="SIZE",
+        help="drop oldest packages until their total size (as of the index)"
+        ' fits into SIZE bytes (e.g. "200G", default: no limit)',
+    )
+    retain_command.add_argument(
+        "--pretend",
+        default=False,
+        action="store_true",
+        help="only display what would be cleaned (default: delete files)",
+    )
+    retain_command.set_defaults(command_func=run_retain)
+
+    serve_command = subcommands.add_parser(
+        "serve", help="serve pkgdir over HTTP as a binary package host"
+    )
+    serve_command.add_argument(
+        "--address",
+        default="127.0.0.1",
+        metavar="ADDRESS",
+        help='listen on address ADDRESS (e.g. "0.0.0.0" for all interfaces'
+        ', default: "%(default)s")',
+    )
+    serve_command.add_argument(
+        "--port",
+        type=int,
+        default=8080,
+        metavar="PORT",
+        help="listen on TCP port PORT (default: %(default)s)",
+    )
+    serve_command.set_defaults(command_func=run_serve)
+
+    stats_command = subcommands.add_parser(
+        "stats",
+        help="report disk usage per category, package and build ID fan-out",
+    )
+    stats_command.add_argument(
+        "--top",
+        type=int,
+        default=10,
+        metavar="N",
+        help="limit rankings to the N heaviest entries (default: %(default)s)",
+    )
+    _add_jobs_argument_to(stats_command)
+    stats_command.add_argument(
+        "--json",
+        default=False,
+        action="store_true",
+        help="output machine-readable JSON (default: output human-readable text)",
+    )
+    stats_command.set_defaults(command_func=run_stats)
+
+    config = parser.parse_args(argv[1:])
+
+    if config.command_func is run_retain and config.max_age is None and config.max_bytes is None:
+        retain_command.error("one of the arguments --max-age --max-bytes is required")
+
+    return config
 
 
 def enrich_config(config):
@@ -0,0 +1,274 @@
+# Copyright (C) 2021 Sebastian Pipping <sebastian@pipping.org>
+# Licensed under GNU Affero GPL version 3 or later
+
+import gzip
+import hashlib
+import os
+import random
+from dataclasses import dataclass, field
+
+_OLD_MTIME_NS = 1_600_000_000 * 10**9
+_NEW_MTIME_NS = 1_700_000_000 * 10**9
+
+_ECLASS = "synthetic"
+_ECLASS_CONTENT = b"# Synthetic eclass\n\nsynthetic_src_configure() {\n\tdefault\n}\n"
+
+# NOTE: Only "x86" and "~arm64" ebuilds can gain a relevant keyword
+_KEYWORDS_CHOICES = ["amd64 x86", "~amd64 ~x86", "x86", "~arm64"]
+_ACCEPT_KEYWORDS = "~amd64"
+
+_EBUILD_TEMPLATE = """\
+# Copyright 1999-2021 Gentoo Authors
+# Distributed under the terms of the GNU General Public License v2
+
+EAPI=8
+
+inherit {eclass}
+
+DESCRIPTION="Synthetic package {category}/{package}"
+HOMEPAGE="https://example.org/{package}"
+SRC_URI="https://example.org/${{P}}.tar.gz"
+
+LICENSE="GPL-2"
+SLOT="0"
+KEYWORDS="{keywords}"
+IUSE="doc test"
+RESTRICT="!test? ( test )"
+
+DEPEND="dev-libs/foo"
+RDEPEND="${{DEPEND}}"
+
+src_configure() {{
+\tsynthetic_src_configure
+}}
+"""
+
+
+@dataclass
+class SyntheticPortdirPair:
+    """Files (by path relative to the portdir) of an old and a new synthetic portdir
+
+    Files map to ``(content, mtime_ns)``.  Unchanged files have the very same
+    modification time in both portdirs, as if synced by ``rsync --archive``.
+    """
+
+    old_files: dict[str, tuple[bytes, int]] = field(default_factory=dict)
+    new_files: dict[str, tuple[bytes, int]] = field(default_factory=dict)
+    accept_keywords: str = _ACCEPT_KEYWORDS
+    category_count: int = 0
+    package_count: int = 0
+    changed_package_count: int = 0
+    ebuild_count_in_changed_packages: int = 0
+    changed_ebuild_count: int = 0
+    expected_news: list[str] = field(default_factory=list)
+
+    @property
+    def max_file_size(self) -> int:
+        return max(len(content) for content, _ in self.new_files.values())
+
+
+def _create_ebuild_content(category, package, keywords) -> bytes:
+    return _EBUILD_TEMPLATE.format(
+        eclass=_ECLASS, category=category, package=package, keywords=keywords
+    ).encode("utf-8")
+
+
+def _create_md5_cache_entry(content: bytes, keywords: str) -> bytes:
+    eclass_md5 = hashlib.md5(_ECLASS_CONTENT).hexdigest()
+    return (
+        "DEFINED_PHASES=configure\n"
+        "EAPI=8\n"
+        f"KEYWORDS={keywords}\n"
+        "SLOT=0\n"
+        f"_eclasses_={_ECLASS}\t{eclass_md5}\n"
+        f"_md5_={hashlib.md5(content).hexdigest()}\n"
+    ).encode()
+
+
+def _create_manifest(
+    package, ebuild_content_of_version: dict[str, bytes], thick_manifests: bool
+) -> bytes:
+    lines = []
+    for version in sorted(ebuild_content_of_version):
+        distfile_digest = hashlib.blake2b(f"{package}-{version}".encode()).hexdigest()
+        lines.append(f"DIST {package}-{version}.tar.gz 123456 BLAKE2B {distfile_digest}\n")
+    if not thick_manifests:
+        return "".join(lines).encode("utf-8")
+    for version, content in sorted(ebuild_content_of_version.items()):
+        lines.append(
+            f"EBUILD {package}-{version}.ebuild {len(content)} "
+            f"BLAKE2B {hashlib.blake2b(content).hexdigest()}\n"
+        )
+    return "".join(lines).encode("utf-8")
+
+
+def _add_package(
+    files: dict[str, tuple[bytes, int]],
+    category,
+    package,
+    keywords_of_version: dict[str, str],
+    extra_content_of_version: dict[str, bytes],
+    mtime_ns_of_version: dict[str, int],
+    thick_manifests: bool,
+):
+    ebuild_content_of_version = {}
+    for version, keywords in keywords_of_version.items():
+        content = _create_ebuild_content(category, package, keywords)
+        content += extra_content_of_version.get(version, b"")
+        ebuild_content_of_version[version] = content
+        mtime_ns = mtime_ns_of_version[version]
+        files[f"{category}/{package}/{package}-{version}.ebuild"] = content, mtime_ns
+        files[f"metadata/md5-cache/{category}/{package}-{version}"] = (
+            _create_md5_cache_entry(content, keywords),
+            mtime_ns,
+        )
+    files[f"{category}/{package}/Manifest"] = (
+        _create_manifest(package, ebuild_content_of_version, thick_manifests),
+        max(mtime_ns_of_version.values()),
+    )
+
+
+def _add_category_manifest(files: dict[str, tuple[bytes, int]], category):
+    """Add a GLEP 74 category Manifest that covers all files of all packages of the category"""
+    lines = []
+    mtime_ns = _OLD_MTIME_NS
+    for relative_path, (content, file_mtime_ns) in sorted(files.items()):
+        if not relative_path.startswith(f"{category}/"):
+            continue
+        path = relative_path[len(f"{category}/") :]
+        tag = "MANIFEST" if path.endswith("/Manifest") else "DATA"
+        lines.append(
+            f"{tag} {path} {len(content)} BLAKE2B {hashlib.blake2b(content).hexdigest()}\n"
+        )
+        mtime_ns = max(mtime_ns, file_mtime_ns)
+    files[f"{category}/Manifest.gz"] = (
+        gzip.compress("".join(lines).encode("utf-8"), mtime=0),
+        mtime_ns,
+    )
+
+
+def generate_synthetic_portdir_pair(
+    categories: int,
+    packages_per_category: int,
+    ebuilds_per_package: int,
+    add_rate: float = 0.05,
+    keyword_rate: float = 0.05,
+    content_rate: float = 0.05,
+    seed: int = 0,
+    thick_manifests: bool = False,
+) -> SyntheticPortdirPair:
+    """Generate an old and a new portdir with KEYWORDS, Manifests and md5-cache
+
+    Package Manifests are thin (i.e. list distfiles only) like in ::gentoo
+    unless ``thick_manifests`` asks for ebuilds to be listed as well.
+
+    Per package, the new portdir differs from the old one with the given probability
+    by an added ebuild, by an ebuild that gained a relevant keyword,
+    and by an ebuild with changes other than to KEYWORDS.  Only the first two
+    are relevant (and hence expected news) for a non-pessimistic comparison.
+    """
+    rng = random.Random(seed)
+    pair = SyntheticPortdirPair()
+
+    for files in (pair.old_files, pair.new_files):
+        files[f"eclass/{_ECLASS}.eclass"] = _ECLASS_CONTENT, _OLD_MTIME_NS
+        files["profiles/repo_name"] = b"gentoo\n", _OLD_MTIME_NS
+
+    for category_index in range(categories):
+        category = f"cat-{category_index:03d}"
+        for package_index in range(packages_per_category):
+            package = f"pkg{package_index:04d}"
+            versions = [f"{version_index + 1}.0" for version_index in range(ebuilds_per_package)]
+            keywords_of_version = {version: rng.choice(_KEYWORDS_CHOICES) for version in versions}
+            mtime_ns_of_version = dict.fromkeys(versions, _OLD_MTIME_NS)
+
+            _add_package(
+                pair.old_files,
+                category,
+                package,
+                keywords_of_version,
+                {},
+                mtime_ns_of_version,
+                thick_manifests,
+            )
+
+            new_keywords_of_version = dict(keywords_of_version)
+            new_extra_content_of_version = {}
+            news = []
+
+            if rng.random() < add_rate:
+                version = f"{ebuilds_per_package + 1}.0"
+                new_keywords_of_version[version] = "~amd64 ~x86"
+                mtime_ns_of_version[version] = _NEW_MTIME_NS
+                news.append(version)
+
+            if rng.random() < keyword_rate:
+                candidates = [
+                    version for version in versions if "amd64" not in keywords_of_version[version]
+                ]
+                if candidates:
+                    version = rng.choice(candidates)
+                    new_keywords_of_version[version] += " ~amd64"
+                    mtime_ns_of_version[version] = _NEW_MTIME_NS
+                    news.append(version)
+
+            if rng.random() < content_rate:
+                version = rng.choice(versions)
+                new_extra_content_of_version[version] = b"\n# Unrelated change\n"
+                mtime_ns_of_version[version] = _NEW_MTIME_NS
+
+            _add_package(
+                pair.new_files,
+                category,
+                package,
+                new_keywords_of_version,
+                new_extra_content_of_version,
+                mtime_ns_of_version,
+                thick_manifests,
+            )
+
+            pair.package_count += 1
+            changed_versions = [
+                version
+                for version, mtime_ns in mtime_ns_of_version.items()
+                if mtime_ns == _NEW_MTIME_NS
+            ]
+            if changed_versions:
+                pair.changed_package_count += 1
+                pair.ebuild_count_in_changed_packages += len(new_keywords_of_version)
+                pair.changed_ebuild_count += len(changed_versions)
+            pair.expected_news += [
+                f"{category}/{package}-{version}"
+                for version in sorted(news, key=lambda version: float(version))
+            ]
+
+        for files in (pair.old_files, pair.new_files):
+            _add_category_manifest(files, category)
+        pair.category_count += 1
+
+    return pair
+
+
+def write_portdir(portdir, files: dict[str, tuple[bytes, int]]):
+    """Write files to ``portdir`` with their modification times
+
+    Directories get the latest modification time of their entries so that
+    unchanged directories have the very same modification time in either portdir.
+    """
+    mtime_ns_of_dir = {}
+    for relative_path, (content, mtime_ns) in files.items():
+        filename = os.path.join(portdir, relative_path)
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        with open(filename, "wb") as f:
+            f.write(content)
+        os.utime(filename, ns=(mtime_ns, mtime_ns))
+
+        relative_dir = os.path.dirname(relative_path)
+        mtime_ns_of_dir[relative_dir] = max(mtime_ns, mtime_ns_of_dir.get(relative_dir, 0))
+
+    # NOTE: Deepest directories first, so that parents are not bumped again later
+    for relative_dir, mtime_ns in sorted(
+        mtime_ns_of_dir.items(), key=lambda item: -item[0].count("/")
+    ):
+        dirname = os.path.join(portdir, relative_dir)
+        os.utime(dirname, ns=(mtime_ns, mtime_ns))
@@ -1,7 +1,10 @@
 # Copyright (C) 2021 Sebastian Pipping <sebastian@pipping.org>
 # Licensed under GNU Affero GPL version 3 or later
 
+import json
 import os
+import re
+from argparse import ArgumentTypeError
 from io import StringIO
 from tempfile import TemporaryDirectory
 from textwrap import dedent
@@ -15,10 +18,20 @@ from ..packages import (
     adjust_index_file_header,
     has_safe_package_path,
     main,
+    parse_byte_size,
+    parse_command_line,
+    parse_duration,
     parse_package_block,
-    read_packages_index_file,
+    read_packages_index,
+    replace_with_hardlink,
+    run_dedupe,
     run_delete,
+    run_export_index,
     run_list,
+    run_orphans,
+    run_retain,
+    run_stats,
+    scan_pkgdir_for_binary_packages,
 )
 
 
@@ -111,15 +124,15 @@ class HasSafePackagePathTest(TestCase):
         self.assertEqual(actual_is_safe, expected_is_safe)
 
 
-class ReadPackagesIndexFileTest(TestCase):
+class ReadPackagesIndexTest(TestCase):
     def test_success(self):
         expected_header = "K1: v1"
-        expected_packages_blocks = ["K2: v2", "K3: v3", ""]
+        packages_blocks = ["CPV: one/one-1\nBUILD_TIME: 1", "CPV: two/two-2\nBUILD_TIME: 2", ""]
 
         with TemporaryDirectory() as tempdir:
             expected_packages_index_filename = os.path.join(tempdir, "Packages")
             with open(expected_packages_index_filename, "w") as f:
-                flat_packages_blocks = "\n\n".join(expected_packages_blocks)
+                flat_packages_blocks = "\n\n".join(packages_blocks)
                 print(
                     f"{expected_header}\n\n{flat_packages_blocks}",
                     end="",
@@ -127,15 +140,10 @@ class ReadPackagesIndexFileTest(TestCase):
                 )
             config_mock = Mock(host_pkgdir=tempdir)
 
-            (
-                actual_header,
-                actual_packages_blocks,
-                actual_packages_index_filename,
-            ) = read_packages_index_file(config_mock)
-
-        self.assertEqual(actual_header, expected_header)
-        self.assertEqual(actual_packages_blocks, expected_packages_blocks)
-        self.assertEqual(actual_packages_index_filename, expected_packages_index_filename)
+            with read_packages_index(config_mock) as index:
+                self.assertEqual(index.header, expected_header)
+                self.assertEqual([index.block(i) for i in range(len(index))], packages_blocks[:2])
+                self.assertEqual(index.filename, expected_packages_index_filename)
 
 
 class RunDeleteTest(TestCase):
@@ -217,6 +225,109 @@ class RunDeleteTest(TestCase):
                 )
 
 
+class RunExportIndexTest(TestCase):
+    _ORIGINAL_DUMMY_INDEX_CONTENT = dedent("""\
+        PACKAGES: 3
+        TIMESTAMP: 123
+        VERSION: 0
+
+        BUILD_ID: 1
+        BUILD_TIME: 1
+        CPV: one/one-1
+        KEYWORDS: amd64
+
+        BUILD_ID: 1
+        BUILD_TIME: 2
+        CPV: two/two-2
+        KEYWORDS: ~amd64
+
+        BUILD_ID: 1
+        BUILD_TIME: 3
+        CPV: one/three-3
+        KEYWORDS: ~amd64
+
+    """)
+
+    def _run_export_index(self, tempdir, output_filename, now_epoch_seconds, uri=None):
+        config_mock = Mock(
+            host_pkgdir=tempdir,
+            filters=["CPV: one/", "KEYWORDS: ~amd64"],
+            output=output_filename,
+            uri=uri,
+        )
+        time_mock = Mock(return_value=float(now_epoch_seconds))
+        with patch("time.time", time_mock), patch("sys.stdout", StringIO()) as stdout_mock:
+            run_export_index(config_mock)
+        with open(output_filename) as f:
+            return f.read(), stdout_mock.getvalue()
+
+    def test_success(self):
+        with TemporaryDirectory() as tempdir:
+            with open(os.path.join(tempdir, "Packages"), "w") as f:
+                print(self._ORIGINAL_DUMMY_INDEX_CONTENT, end="", file=f)
+            output_filename = os.path.join(tempdir, "consumers", "servers", "Packages")
+
+            actual_content, actual_stdout = self._run_export_index(
+                tempdir, output_filename, now_epoch_seconds=456
+            )
+            self.assertEqual(
+                actual_content,
+                dedent("""\
+                    PACKAGES: 1
+                    TIMESTAMP: 456
+                    VERSION: 0
+
+                    BUILD_ID: 1
+                    BUILD_TIME: 3
+                    CPV: one/three-3
+                    KEYWORDS: ~amd64
+
+                """),
+            )
+            self.assertEqual(actual_stdout, "1 of 3 package(s) exported\n")
+
+            # The clock going backwards must not make the output timestamp go backwards
+            actual_content, _ = self._run_export_index(
+                tempdir, output_filename, now_epoch_seconds=300
+            )
+            self.assertIn("TIMESTAMP: 457\n", actual_content)
+
+            with open(os.path.join(tempdir, "Packages")) as f:
+                self.assertEqual(f.read(), self._ORIGINAL_DUMMY_INDEX_CONTENT)
+
+    def test_uri(self):
+        with TemporaryDirectory() as tempdir:
+            with open(os.path.join(tempdir, "Packages"), "w") as f:
+                print(
+                    self._ORIGINAL_DUMMY_INDEX_CONTENT.replace(
+                        "VERSION: 0\n", "URI: https://example.org/old/\nVERSION: 0\n"
+                    ),
+                    end="",
+                    file=f,
+                )
+            output_filename = os.path.join(tempdir, "consumers", "servers", "Packages")
+
+            actual_content, _ = self._run_export_index(
+                tempdir,
+                output_filename,
+                now_epoch_seconds=456,
+                uri="https://example.org/packages/",
+            )
+
+            self.assertTrue(
+                actual_content.startswith(
+                    dedent("""\
+                        PACKAGES: 1
+                        TIMESTAMP: 456
+                        URI: https://example.org/packages/
+                        VERSION: 0
+
+                        BUILD_ID: 1
+                    """)
+                )
+            )
+
+
 class RunListTest(TestCase):
     @staticmethod
     def _run_list_with_config(config):
@@ -261,12 +372,472 @@ class RunListTest(TestCase):
             self.assertEqual(actual_stdout__atoms, expected_stdout__atoms)
 
 
+class ScanPkgdirForBinaryPackagesTest(TestCase):
+    def test_success(self):
+        with TemporaryDirectory() as tempdir:
+            for path, size in (
+                ("Packages", 1),
+                ("cat/pkg/pkg-1-1.gpkg.tar", 2),
+                ("cat/pkg/pkg-1-2.xpak", 3),
+                ("cat/pkg-1.tbz2", 4),
+                ("cat/pkg/unrelated.txt", 5),
+                ("other/pkg/pkg-2-1.gpkg.tar", 6),
+            ):
+                filename = os.path.join(tempdir, path)
+                os.makedirs(os.path.dirname(filename), exist_ok=True)
+                with open(filename, "w") as f:
+                    f.write("x" * size)
+
+            stat_of = scan_pkgdir_for_binary_packages(tempdir, jobs=2)
+
+        self.assertEqual(
+            {path: stat.st_size for path, stat in stat_of.items()},
+            {
+                "cat/pkg/pkg-1-1.gpkg.tar": 2,
+                "cat/pkg/pkg-1-2.xpak": 3,
+                "cat/pkg-1.tbz2": 4,
+                "other/pkg/pkg-2-1.gpkg.tar": 6,
+            },
+        )
+
+
+class RunStatsTest(TestCase):
+    _DUMMY_INDEX_CONTENT = dedent("""\
+        PACKAGES: 4
+        TIMESTAMP: 123
+        VERSION: 0
+
+        BUILD_ID: 1
+        BUILD_TIME: 1
+        CPV: cat/pkg-1
+        PATH: cat/pkg/pkg-1-1.gpkg.tar
+        SIZE: 10
+
+        BUILD_ID: 2
+        BUILD_TIME: 2
+        CPV: cat/pkg-1
+        PATH: cat/pkg/pkg-1-2.gpkg.tar
+        SIZE: 20
+
+        BUILD_ID: 1
+        BUILD_TIME: 3
+        CPV: cat/other-2.0-r1
+        PATH: cat/other/other-2.0-r1-1.gpkg.tar
+        SIZE: 999
+
+        BUILD_ID: 1
+        BUILD_TIME: 4
+        CPV: dog/missing-3
+        PATH: dog/missing/missing-3-1.gpkg.tar
+        SIZE: 40
+
+    """)
+
+    @classmethod
+    def _run_stats_in_dummy_pkgdir(cls, **config_kwargs):
+        with TemporaryDirectory() as tempdir:
+            with open(os.path.join(tempdir, "Packages"), "w") as f:
+                print(cls._DUMMY_INDEX_CONTENT, end="", file=f)
+            for path, size in (
+                ("cat/pkg/pkg-1-1.gpkg.tar", 10),
+                ("cat/pkg/pkg-1-2.gpkg.tar", 20),
+                ("cat/other/other-2.0-r1-1.gpkg.tar", 30),
+                ("cat/other/other-2.0-r1-2.gpkg.tar", 5),
+            ):
+                filename = os.path.join(tempdir, path)
+                os.makedirs(os.path.dirname(filename), exist_ok=True)
+                with open(filename, "w") as f:
+                    f.write("x" * size)
+
+            config_mock = Mock(host_pkgdir=tempdir, jobs=None, **config_kwargs)
+            with patch("sys.stdout", StringIO()) as stdout_mock:
+                run_stats(config_mock)
+        return stdout_mock.getvalue()
+
+    def test_json(self):
+        stats = json.loads(self._run_stats_in_dummy_pkgdir(json=True, top=2))
+
+        self.assertEqual(
+            stats["categories"],
+            [
+                {"bytes": 60, "count": 3, "name": "cat"},
+                {"bytes": 0, "count": 1, "name": "dog"},
+            ],
+        )
+        self.assertEqual(
+            stats["packages"],
+            [
+                {"bytes": 30, "count": 1, "name": "cat/other"},
+                {"bytes": 30, "count": 2, "name": "cat/pkg"},
+            ],
+        )
+        self.assertEqual(
+            stats["entries"],
+            [
+                {
+                    "bytes": 30,
+                    "name": "cat/other-2.0-r1-1",
+                    "path": "cat/other/other-2.0-r1-1.gpkg.tar",
+                },
+                {"bytes": 20, "name": "cat/pkg-1-2", "path": "cat/pkg/pkg-1-2.gpkg.tar"},
+            ],
+        )
+        self.assertEqual(
+            stats["instances"],
+            {
+                "cpvs_per_instance_count": {"1": 2, "2": 1},
+                "multi_instance_cpvs": [{"bytes": 30, "count": 2, "name": "cat/pkg-1"}],
+            },
+        )
+        self.assertEqual(
+            stats["discrepancies"],
+            {
+                "missing_files": ["dog/missing/missing-3-1.gpkg.tar"],
+                "size_mismatches": [
+                    {
+                        "disk_bytes": 30,
+                        "index_bytes": 999,
+                        "path": "cat/other/other-2.0-r1-1.gpkg.tar",
+                    }
+                ],
+                "unindexed_files": {"bytes": 5, "count": 1},
+            },
+        )
+        self.assertEqual(
+            stats["total"],
+            {"disk_bytes": 65, "disk_files": 4, "index_bytes": 1069, "index_entries": 4},
+        )
+
+    def test_text(self):
+        stdout = self._run_stats_in_dummy_pkgdir(json=False, top=1)
+
+        self.assertEqual(
+            stdout,
+            dedent("""\
+                4 index entries (1069 bytes), 4 files on disk (65 bytes)
+                Heaviest categories:
+                            60             3  cat
+                Heaviest packages:
+                            30             1  cat/other
+                Heaviest multi-instance CPVs:
+                            30             2  cat/pkg-1
+                Heaviest entries:
+                            30  cat/other-2.0-r1-1
+                Index entry file 'dog/missing/missing-3-1.gpkg.tar' is missing on disk
+                Index entry file 'cat/other/other-2.0-r1-1.gpkg.tar' has 30 bytes on disk but 999 bytes in the index
+                1 file(s) on disk (5 bytes) not referenced by the index
+            """),  # noqa: E501
+        )
+
+
+class RunOrphansTest(TestCase):
+    @parameterized.expand(
+        [
+            ("only report", False, False),
+            ("delete", True, False),
+            ("pretend to delete", True, True),
+        ]
+    )
+    def test_success(self, _label, delete, pretend):
+        original_dummy_index_content = dedent("""\
+            PACKAGES: 2
+            TIMESTAMP: 123
+            VERSION: 0
+
+            BUILD_ID: 1
+            BUILD_TIME: 1
+            CPV: one/one-1
+            PATH: one/one/one-1-1.gpkg.tar
+
+            BUILD_ID: 1
+            BUILD_TIME: 2
+            CPV: two/two-2
+            PATH: two/two/two-2-1.gpkg.tar
+
+        """)
+        now_epoch_seconds = 456
+        expected_post_deletion_index_content = dedent(f"""\
+            PACKAGES: 1
+            TIMESTAMP: {now_epoch_seconds}
+            VERSION: 0
+
+            BUILD_ID: 1
+            BUILD_TIME: 1
+            CPV: one/one-1
+            PATH: one/one/one-1-1.gpkg.tar
+
+        """)
+
+        with TemporaryDirectory() as tempdir:
+            indexed_binary_path = os.path.join(tempdir, "one/one/one-1-1.gpkg.tar")
+            unindexed_binary_path = os.path.join(tempdir, "three/three/three-3-1.gpkg.tar")
+
+            with open(os.path.join(tempdir, "Packages"), "w") as f:
+                print(original_dummy_index_content, end="", file=f)
+            for filename in (indexed_binary_path, unindexed_binary_path):
+                os.makedirs(os.path.dirname(filename))
+                with open(filename, "w"):
+                    pass
+                os.utime(filename, ns=(0, 0))  # i.e. older than the index
+
+            config_mock = Mock(host_pkgdir=tempdir, delete=delete, pretend=pretend, jobs=None)
+
+            time_mock = Mock(return_value=float(now_epoch_seconds))
+            with patch("time.time", time_mock), patch("sys.stdout", StringIO()) as stdout_mock:
+                run_orphans(config_mock)
+
+            with open(os.path.join(tempdir, "Packages")) as f:
+                actual_post_deletion_index_content = f.read()
+
+            self.assertTrue(os.path.exists(indexed_binary_path))
+            if delete and not pretend:
+                self.assertFalse(os.path.exists(unindexed_binary_path))
+                self.assertFalse(os.path.exists(os.path.join(tempdir, "three")))
+                self.assertEqual(
+                    actual_post_deletion_index_content,
+                    expected_post_deletion_index_content,
+                )
+            else:
+                self.assertTrue(os.path.exists(unindexed_binary_path))
+                self.assertEqual(
+                    actual_post_deletion_index_content,
+                    original_dummy_index_content,
+                )
+
+        self.assertIn("two/two/two-2-1.gpkg.tar", stdout_mock.getvalue())
+        self.assertIn("three/three/three-3-1.gpkg.tar", stdout_mock.getvalue())
+
+    def test_files_not_older_than_index_kept(self):
+        with TemporaryDirectory() as tempdir:
+            packages_filename = os.path.join(tempdir, "Packages")
+            with open(packages_filename, "w") as f:
+                print("PACKAGES: 0\nTIMESTAMP: 123\nVERSION: 0\n", file=f)
+            os.utime(packages_filename, ns=(10**9, 10**9))
+            unindexed_binary_paths = []
+            for name, mtime_ns in (("old", 10**9 - 1), ("same", 10**9), ("new", 10**9 + 1)):
+                filename = os.path.join(tempdir, f"cat/{name}/{name}-1-1.gpkg.tar")
+                os.makedirs(os.path.dirname(filename))
+                with open(filename, "w"):
+                    pass
+                os.utime(filename, ns=(mtime_ns, mtime_ns))
+                unindexed_binary_paths.append(filename)
+
+            config_mock = Mock(host_pkgdir=tempdir, delete=True, pretend=False, jobs=None)
+            with patch("sys.stdout", StringIO()):
+                run_orphans(config_mock)
+
+            self.assertEqual(
+                [os.path.exists(filename) for filename in unindexed_binary_paths],
+                [False, True, True],
+            )
+
+
+class ReplaceWithHardlinkTest(TestCase):
+    def test_success(self):
+        with TemporaryDirectory() as tempdir:
+            source_filename = os.path.join(tempdir, "source")
+            target_filename = os.path.join(tempdir, "target")
+            for filename in (source_filename, target_filename, f"{target_filename}.tmp-hardlink"):
+                with open(filename, "w") as f:
+                    f.write("content")
+
+            replace_with_hardlink(source_filename, target_filename)
+
+            self.assertTrue(os.path.samefile(source_filename, target_filename))
+            self.assertEqual(sorted(os.listdir(tempdir)), ["source", "target"])
+
+
+class RunDedupeTest(TestCase):
+    @parameterized.expand(
+        [
+            ("pretend", True),
+            ("actually hardlink files", False),
+        ]
+    )
+    def test_success(self, _label, pretend):
+        with TemporaryDirectory() as tempdir:
+            for path, content in (
+                ("cat/pkg/pkg-1-1.gpkg.tar", "same"),
+                ("cat/pkg/pkg-1-2.gpkg.tar", "same"),
+                ("cat/pkg/pkg-1-3.gpkg.tar", "diff"),
+                ("cat/pkg/pkg-1-4.gpkg.tar", "same but longer"),
+                ("dog/pkg/pkg-1-1.gpkg.tar", "same"),
+            ):
+                filename = os.path.join(tempdir, path)
+                os.makedirs(os.path.dirname(filename), exist_ok=True)
+                with open(filename, "w") as f:
+                    f.write(content)
+
+            config_mock = Mock(host_pkgdir=tempdir, jobs=None, pretend=pretend)
+            with patch("sys.stdout", StringIO()) as stdout_mock:
+                run_dedupe(config_mock)
+
+            def is_hardlinked_to_first(path):
+                return os.path.samefile(
+                    os.path.join(tempdir, "cat/pkg/pkg-1-1.gpkg.tar"), os.path.join(tempdir, path)
+                )
+
+            self.assertEqual(is_hardlinked_to_first("cat/pkg/pkg-1-2.gpkg.tar"), not pretend)
+            self.assertEqual(is_hardlinked_to_first("dog/pkg/pkg-1-1.gpkg.tar"), not pretend)
+            self.assertFalse(is_hardlinked_to_first("cat/pkg/pkg-1-3.gpkg.tar"))
+            self.assertFalse(is_hardlinked_to_first("cat/pkg/pkg-1-4.gpkg.tar"))
+
+        self.assertTrue(
+            stdout_mock.getvalue().endswith(
+                "2 duplicate file(s) hardlinked, 8 bytes would be saved\n"
+                if pretend
+                else "2 duplicate file(s) hardlinked, 8 bytes saved\n"
+            )
+        )
+
+
+class ParseDurationTest(TestCase):
+    @parameterized.expand(
+        [
+            ("30s", 30),
+            ("5m", 5 * 60),
+            ("2h", 2 * 60 * 60),
+            ("90d", 90 * 24 * 60 * 60),
+            ("1w", 7 * 24 * 60 * 60),
+        ]
+    )
+    def test_valid(self, text, expected_seconds):
+        self.assertEqual(parse_duration(text), expected_seconds)
+
+    @parameterized.expand([("",), ("90",), ("d",), ("-1d",), ("1y",)])
+    def test_invalid(self, text):
+        with self.assertRaises(ArgumentTypeError):
+            parse_duration(text)
+
+
+class ParseByteSizeTest(TestCase):
+    @parameterized.expand(
+        [
+            ("123", 123),
+            ("2K", 2 * 1024),
+            ("3M", 3 * 1024**2),
+            ("200G", 200 * 1024**3),
+            ("1T", 1024**4),
+        ]
+    )
+    def test_valid(self, text, expected_bytes):
+        self.assertEqual(parse_byte_size(text), expected_bytes)
+
+    @parameterized.expand([("",), ("G",), ("1.5G",), ("1g",)])
+    def test_invalid(self, text):
+        with self.assertRaises(ArgumentTypeError):
+            parse_byte_size(text)
+
+
+class RunRetainTest(TestCase):
+    # NOTE: cat/pkg-1-3 and cat/other-1-1 are the newest instances of their CPV
+    _ORIGINAL_DUMMY_INDEX_CONTENT = dedent("""\
+        PACKAGES: 4
+        TIMESTAMP: 123
+        VERSION: 0
+
+        BUILD_ID: 1
+        BUILD_TIME: 100
+        CPV: cat/pkg-1
+        PATH: cat/pkg/pkg-1-1.gpkg.tar
+        SIZE: 10
+
+        BUILD_ID: 2
+        BUILD_TIME: 200
+        CPV: cat/pkg-1
+        PATH: cat/pkg/pkg-1-2.gpkg.tar
+        SIZE: 20
+
+        BUILD_ID: 3
+        BUILD_TIME: 300
+        CPV: cat/pkg-1
+        PATH: cat/pkg/pkg-1-3.gpkg.tar
+        SIZE: 30
+
+        BUILD_ID: 1
+        BUILD_TIME: 50
+        CPV: cat/other-1
+        PATH: cat/other/other-1-1.gpkg.tar
+        SIZE: 40
+
+    """)
+
+    @parameterized.expand(
+        [
+            ("no limits", None, None, [], ""),
+            ("age limit", 250, None, ["cat/pkg-1-1"], ""),
+            ("size limit", None, 90, ["cat/pkg-1-1"], ""),
+            ("both limits", 250, 75, ["cat/pkg-1-1", "cat/pkg-1-2"], ""),
+            (
+                "size limit not reachable",
+                None,
+                1,
+                ["cat/pkg-1-1", "cat/pkg-1-2"],
+                "WARNING: Only the newest instance of each CPV is left"
+                " but 70 bytes still exceed 1 bytes\n",
+            ),
+        ]
+    )
+    def test_success(self, _label, max_age, max_bytes, expected_dropped, expected_stderr):
+        now_epoch_seconds = 400
+        with TemporaryDirectory() as tempdir:
+            with open(os.path.join(tempdir, "Packages"), "w") as f:
+                print(self._ORIGINAL_DUMMY_INDEX_CONTENT, end="", file=f)
+            config_mock = Mock(
+                host_pkgdir=tempdir, max_age=max_age, max_bytes=max_bytes, pretend=False
+            )
+
+            time_mock = Mock(return_value=float(now_epoch_seconds))
+            with (
+                patch("time.time", time_mock),
+                patch("sys.stdout", StringIO()) as stdout_mock,
+                patch("sys.stderr", StringIO()) as stderr_mock,
+            ):
+                run_retain(config_mock)
+
+            with open(os.path.join(tempdir, "Packages")) as f:
+                actual_post_retention_index_content = f.read()
+
+        actual_dropped = re.findall("Dropping entry '([^']+)'", stdout_mock.getvalue())
+        self.assertEqual(actual_dropped, expected_dropped)
+        self.assertIn(
+            f"PACKAGES: {4 - len(expected_dropped)}\n", actual_post_retention_index_content
+        )
+        self.assertEqual(stderr_mock.getvalue(), expected_stderr)
+
+    def test_nothing_dropped_leaves_index_alone(self):
+        with TemporaryDirectory() as tempdir:
+            index_filename = os.path.join(tempdir, "Packages")
+            with open(index_filename, "w") as f:
+                print(self._ORIGINAL_DUMMY_INDEX_CONTENT, end="", file=f)
+            os.utime(index_filename, ns=(0, 0))
+            config_mock = Mock(host_pkgdir=tempdir, max_age=None, max_bytes=None, pretend=False)
+
+            with patch("sys.stdout", StringIO()):
+                run_retain(config_mock)
+
+            self.assertEqual(os.stat(index_filename).st_mtime_ns, 0)
+            with open(index_filename) as f:
+                self.assertEqual(f.read(), self._ORIGINAL_DUMMY_INDEX_CONTENT)
+
+    def test_budget_required(self):
+        argv = ["gentoo-packages", "retain", "--pretend"]
+        with patch("sys.stderr", StringIO()), self.assertRaises(SystemExit):
+            parse_command_line(argv)
+
+
 class MainTest(TestCase):
     @parameterized.expand(
         [
             ("gentoo-packages", "--help"),
+            ("gentoo-packages", "dedupe", "--help"),
             ("gentoo-packages", "delete", "--help"),
+            ("gentoo-packages", "export-index", "--help"),
             ("gentoo-packages", "list", "--help"),
+            ("gentoo-packages", "orphans", "--help"),
+            ("gentoo-packages", "retain", "--help"),
+            ("gentoo-packages", "serve", "--help"),
+            ("gentoo-packages", "stats", "--help"),
         ]
     )
     def test_help(self, *argv):  # plain smoke test
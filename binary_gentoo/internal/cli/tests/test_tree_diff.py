@@ -1,7 +1,9 @@
 # Copyright (C) 2021 Sebastian Pipping <sebastian@pipping.org>
 # Licensed under GNU Affero GPL version 3 or later
 
+import gzip
 import os
+import subprocess
 from contextlib import contextmanager
 from io import StringIO
 from tempfile import TemporaryDirectory
@@ -11,15 +13,43 @@ from unittest.mock import patch
 
 from parameterized import parameterized
 
+from ...keywords_cache import KeywordsCache
+from ...priority_queue import PriorityQueue
+from ...tree_changes import TreeChanges
+from ...tree_snapshot import TreeSnapshot
 from ..tree_diff import (
+    ReadStatistics,
     _replace_special_keywords_for_ebuild,
     enrich_config,
     iterate_new_and_changed_ebuilds,
     main,
     parse_command_line,
+    watch_new_and_changed_ebuilds,
 )
 
 
+@contextmanager
+def _temp_portdirs():
+    """Provide a temporary directory with empty portdirs "old" and "new" in it"""
+    with TemporaryDirectory() as tempdir:
+        old_portdir = os.path.join(tempdir, "old")
+        new_portdir = os.path.join(tempdir, "new")
+        os.mkdir(old_portdir)
+        os.mkdir(new_portdir)
+        yield tempdir, old_portdir, new_portdir
+
+
+def _run_main(argv) -> tuple[str, str]:
+    """Run ``main`` with ``argv``, return what it wrote to stdout and stderr"""
+    with (
+        patch("sys.argv", argv),
+        patch("sys.stdout", StringIO()) as stdout_mock,
+        patch("sys.stderr", StringIO()) as stderr_mock,
+    ):
+        main()
+    return stdout_mock.getvalue(), stderr_mock.getvalue()
+
+
 class ReplaceSpecialKeywordsTest(TestCase):
     @parameterized.expand(
         [
@@ -73,12 +103,52 @@ class EnrichConfigTest(TestCase):
         with self.assertRaises(ValueError):
             enrich_config(config)
 
+    def test_given__invalid_jobs(self):
+        config = parse_command_line(
+            ["gentoo-tree-diff", "--keywords", "one", "--jobs", "0", "dir1", "dir2"]
+        )
+        with self.assertRaises(ValueError):
+            enrich_config(config)
+
     def test_given__not_empty(self):
         config = parse_command_line(
             ["gentoo-tree-diff", "--keywords", "one    ~two *", "dir1", "dir2"]
         )
         enrich_config(config)
-        self.assertEqual(config.keywords, {"one", "two", "~two", "*"})
+        self.assertEqual(config.keywords, {None: {"one", "two", "~two", "*"}})
+
+    def test_given__labeled(self):
+        config = parse_command_line(
+            [
+                "gentoo-tree-diff",
+                "--keywords",
+                "amd64-stable=amd64",
+                "--keywords",
+                "amd64-testing=~amd64",
+                "dir1",
+                "dir2",
+            ]
+        )
+        enrich_config(config)
+        self.assertEqual(
+            config.keywords,
+            {"amd64-stable": {"amd64"}, "amd64-testing": {"amd64", "~amd64"}},
+        )
+
+    @parameterized.expand(
+        [
+            ("unlabeled", ["one", "label=two"]),
+            ("label used twice", ["label=one", "label=two"]),
+            ("labeled but empty", ["label="]),
+        ]
+    )
+    def test_given__labeled_invalid(self, _, labeled_keywords_list):
+        argv = ["gentoo-tree-diff"]
+        for labeled_keywords in labeled_keywords_list:
+            argv += ["--keywords", labeled_keywords]
+        config = parse_command_line(argv + ["dir1", "dir2"])
+        with self.assertRaises(ValueError):
+            enrich_config(config)
 
     def test_not_given__auto_detection(self):
         with patch("binary_gentoo.internal.cli.tree_diff.HOST_IS_GENTOO", True):
@@ -88,7 +158,7 @@ class EnrichConfigTest(TestCase):
             patch("sys.stdout", StringIO()),
         ):
             enrich_config(config)
-        self.assertEqual(config.keywords, {"one", "two", "~*"})
+        self.assertEqual(config.keywords, {None: {"one", "two", "~*"}})
 
 
 class IterateNewAndChangedEbuildsTest(TestCase):
@@ -98,6 +168,10 @@ class IterateNewAndChangedEbuildsTest(TestCase):
         cls,
         keywords: str,
         pessimistic: bool = False,
+        jobs: int = 1,
+        trust_stat: bool = False,
+        md5_cache: bool = False,
+        exclude: tuple[str] = (),
     ):
         with (
             TemporaryDirectory() as temp_old_portdir,
@@ -106,6 +180,12 @@ class IterateNewAndChangedEbuildsTest(TestCase):
             argv = ["gentoo-tree-diff", "--keywords", keywords]
             if pessimistic:
                 argv.append("--pessimistic")
+            if trust_stat:
+                argv.append("--trust-stat")
+            if md5_cache:
+                argv.append("--md5-cache")
+            argv += [f"--exclude={pattern}" for pattern in exclude]
+            argv += ["--jobs", str(jobs)]
             argv += [temp_old_portdir, temp_new_portdir]
 
             config = parse_command_line(argv)
@@ -130,6 +210,17 @@ class IterateNewAndChangedEbuildsTest(TestCase):
                 print(extra_content, file=f)
             f.flush()
 
+    @classmethod
+    def _create_md5_cache_entry(
+        cls, portdir, cpv, keywords: str, md5: str = "0" * 32, eclasses: str = ""
+    ):
+        filename = os.path.join(portdir, "metadata", "md5-cache", cpv)
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        with open(filename, "w") as f:
+            print(f"KEYWORDS={keywords}", file=f)
+            print(f"_eclasses_={eclasses}", file=f)
+            print(f"_md5_={md5}", file=f)
+
     def test_new_live_ebuild_ignored_by_filename(self):
         keywords = "one"
         with self._tempdir_config(keywords=keywords) as config:
@@ -216,6 +307,632 @@ class IterateNewAndChangedEbuildsTest(TestCase):
             actual_news = list(iterate_new_and_changed_ebuilds(config))
         self.assertEqual(actual_news, ["cat/pkg-123"])
 
+    def test_each_file_read_once(self):
+        ebuild_filename = "cat/pkg/pkg-123.ebuild"
+        with self._tempdir_config(keywords="one") as config:
+            self._create_ebuild(config.old_portdir, ebuild_filename, keywords="~one")
+            self._create_ebuild(config.new_portdir, ebuild_filename, keywords="one")
+            read_statistics = ReadStatistics()
+            actual_news = list(iterate_new_and_changed_ebuilds(config, read_statistics))
+        self.assertEqual(actual_news, ["cat/pkg-123"])
+        self.assertEqual(read_statistics.files_read, 2)
+        self.assertEqual(read_statistics.bytes_read, len('KEYWORDS="~one"\nKEYWORDS="one"\n'))
+
+    def test_non_package_directories_pruned(self):
+        keywords = "one"
+        with self._tempdir_config(keywords=keywords, exclude=("cat/pkg-9*",)) as config:
+            for ebuild_filename in (
+                "cat/pkg/pkg-1.ebuild",
+                "cat/pkg/files/pkg-2.ebuild",
+                "cat/pkg/pkg-9.ebuild",
+                "metadata/pkg/pkg-3.ebuild",
+                "profiles/pkg/pkg-4.ebuild",
+                ".git/pkg/pkg-5.ebuild",
+                "pkg-6.ebuild",
+            ):
+                self._create_ebuild(config.new_portdir, ebuild_filename, keywords=keywords)
+            read_statistics = ReadStatistics()
+            actual_news = list(iterate_new_and_changed_ebuilds(config, read_statistics))
+        self.assertEqual(actual_news, ["cat/pkg-1", "cat/pkg-9"])
+        self.assertEqual(read_statistics.files_read, 2)
+
+    def test_keywords_cache_saves_reading(self):
+        ebuild_filenames = ["cat/pkg/pkg-123.ebuild", "cat/pkg/pkg-456.ebuild"]
+        with self._tempdir_config(keywords="one") as config:
+            for ebuild_filename in ebuild_filenames:
+                self._create_ebuild(config.old_portdir, ebuild_filename, keywords="~one")
+                self._create_ebuild(config.new_portdir, ebuild_filename, keywords="one")
+            keywords_cache = KeywordsCache(max_entries=10)
+
+            actual_news_and_files_read = []
+            for _ in range(2):
+                read_statistics = ReadStatistics()
+                actual_news = list(
+                    iterate_new_and_changed_ebuilds(config, read_statistics, keywords_cache)
+                )
+                actual_news_and_files_read.append((actual_news, read_statistics.files_read))
+
+        self.assertEqual(
+            actual_news_and_files_read,
+            [
+                (["cat/pkg-123", "cat/pkg-456"], 4),
+                (["cat/pkg-123", "cat/pkg-456"], 0),
+            ],
+        )
+
+    def test_keywords_cache_tells_alike_files_apart(self):
+        ebuild_filename = "cat/pkg/pkg-1.ebuild"
+        with self._tempdir_config(keywords="one") as config:
+            self._create_ebuild(config.old_portdir, ebuild_filename, keywords="~one")
+            self._create_ebuild(
+                config.new_portdir, ebuild_filename, keywords="one", extra_content=""
+            )
+            # i.e. same size and modification time, yet different content
+            for portdir in (config.old_portdir, config.new_portdir):
+                os.utime(os.path.join(portdir, ebuild_filename), ns=(0, 0))
+            keywords_cache = KeywordsCache(max_entries=10)
+
+            actual_news = list(
+                iterate_new_and_changed_ebuilds(config, ReadStatistics(), keywords_cache)
+            )
+
+        self.assertEqual(actual_news, ["cat/pkg-1"])
+        self.assertEqual((keywords_cache.hits, keywords_cache.misses), (0, 2))
+
+    @parameterized.expand(
+        [
+            ("pessimistic, not ignored", True, ["cat/pkg-2", "cat/pkg-3", "cat/pkg-4"]),
+            ("not pessimistic, ignored", False, ["cat/pkg-2", "cat/pkg-3"]),
+        ]
+    )
+    def test_md5_cache(self, _, pessimistic: bool, expected_news: list[str]):
+        eclasses = "toolchain-funcs\t1234"
+        with self._tempdir_config(
+            keywords="one", md5_cache=True, pessimistic=pessimistic
+        ) as config:
+            for portdir in (config.old_portdir, config.new_portdir):
+                # i.e. unchanged
+                self._create_md5_cache_entry(portdir, "cat/pkg-1", keywords="one")
+                # i.e. live ebuild
+                self._create_md5_cache_entry(portdir, "cat/pkg-9999", keywords="one")
+            # i.e. went stable (without the ebuild necessarily saying so literally)
+            self._create_md5_cache_entry(config.old_portdir, "cat/pkg-2", keywords="~one")
+            self._create_md5_cache_entry(config.new_portdir, "cat/pkg-2", keywords="one", md5="1")
+            # i.e. added
+            self._create_md5_cache_entry(config.new_portdir, "cat/pkg-3", keywords="one")
+            # i.e. an inherited eclass changed, keywords did not
+            self._create_md5_cache_entry(
+                config.old_portdir, "cat/pkg-4", keywords="one", eclasses=eclasses
+            )
+            self._create_md5_cache_entry(
+                config.new_portdir, "cat/pkg-4", keywords="one", eclasses=eclasses + "5"
+            )
+            actual_news = list(iterate_new_and_changed_ebuilds(config))
+        self.assertEqual(actual_news, expected_news)
+
+    def test_md5_cache_missing(self):
+        with self._tempdir_config(keywords="one", md5_cache=True) as config:
+            with self.assertRaises(ValueError) as catcher:
+                list(iterate_new_and_changed_ebuilds(config))
+        self.assertIn("lacks directory 'metadata/md5-cache'", str(catcher.exception))
+
+    @parameterized.expand(
+        [
+            ("ebuilds listed, pruned", "DATA pkg/pkg-123.ebuild 16 BLAKE2B 12", True, [], 2),
+            (
+                "ebuilds not listed, not pruned",
+                "MANIFEST pkg/Manifest 34 BLAKE2B 56",
+                True,
+                ["cat/pkg-123"],
+                3,
+            ),
+            (
+                "different listing, not pruned",
+                "DATA pkg/pkg-123.ebuild 16 BLAKE2B 12",
+                False,
+                ["cat/pkg-123"],
+                4,
+            ),
+            ("no category manifest, not pruned", None, True, ["cat/pkg-123"], 2),
+        ]
+    )
+    def test_category_manifest(
+        self,
+        _,
+        manifest: str | None,
+        same_listing: bool,
+        expected_news: list[str],
+        expected_files_read: int,
+    ):
+        ebuild_filename = "cat/pkg/pkg-123.ebuild"
+        with self._tempdir_config(keywords="one") as config:
+            # NOTE: Identical Manifests yet different content is inconsistent on purpose,
+            #       to tell pruning apart from regular comparison
+            self._create_ebuild(config.old_portdir, ebuild_filename, keywords="~one")
+            self._create_ebuild(config.new_portdir, ebuild_filename, keywords="one")
+            if not same_listing:
+                self._create_ebuild(config.old_portdir, "cat/pkg/pkg-1.ebuild", keywords="one")
+            if manifest is not None:
+                for portdir in (config.old_portdir, config.new_portdir):
+                    with gzip.open(os.path.join(portdir, "cat", "Manifest.gz"), "wt") as f:
+                        print(manifest, file=f)
+            read_statistics = ReadStatistics()
+            actual_news = list(iterate_new_and_changed_ebuilds(config, read_statistics))
+        self.assertEqual(actual_news, expected_news)
+        self.assertEqual(read_statistics.files_read, expected_files_read)
+
+    @parameterized.expand(
+        [
+            ("trusting stat, ignored", True, []),
+            ("not trusting stat, not ignored", False, ["cat/pkg-123"]),
+        ]
+    )
+    def test_changed_ebuild_with_identical_size_and_mtime(
+        self, _, trust_stat: bool, expected_news: list[str]
+    ):
+        ebuild_filename = "cat/pkg/pkg-123.ebuild"
+        with self._tempdir_config(keywords="one", trust_stat=trust_stat) as config:
+            self._create_ebuild(config.old_portdir, ebuild_filename, keywords="two")
+            self._create_ebuild(config.new_portdir, ebuild_filename, keywords="one")
+            for portdir in (config.old_portdir, config.new_portdir):
+                os.utime(os.path.join(portdir, ebuild_filename), ns=(0, 0))
+            actual_news = list(iterate_new_and_changed_ebuilds(config))
+        self.assertEqual(actual_news, expected_news)
+
+    @parameterized.expand(
+        [
+            ("trusting stat, ignored", True, "cat/pkg/pkg-123.ebuild", []),
+            ("not trusting stat, not ignored", False, "cat/pkg/pkg-123.ebuild", ["cat/pkg-123"]),
+            ("trusting stat, different listing", True, "cat/pkg/pkg-456.ebuild", ["cat/pkg-123"]),
+        ]
+    )
+    def test_package_directory_with_identical_mtime(
+        self, _, trust_stat: bool, old_ebuild_filename: str, expected_news: list[str]
+    ):
+        with self._tempdir_config(keywords="one", trust_stat=trust_stat) as config:
+            self._create_ebuild(config.old_portdir, old_ebuild_filename, keywords="~one")
+            self._create_ebuild(config.new_portdir, "cat/pkg/pkg-123.ebuild", keywords="one")
+            for portdir in (config.old_portdir, config.new_portdir):
+                os.utime(os.path.join(portdir, "cat", "pkg"), ns=(0, 0))
+            actual_news = list(iterate_new_and_changed_ebuilds(config))
+        self.assertEqual(actual_news, expected_news)
+
+    @parameterized.expand(
+        [
+            ("serial", 1),
+            ("parallel", 4),
+        ]
+    )
+    def test_output_order_independent_of_jobs(self, _, jobs: int):
+        keywords = "one"
+        with self._tempdir_config(keywords=keywords, jobs=jobs) as config:
+            for ebuild_filename in (
+                "dog/pkg/pkg-1.ebuild",
+                "cat/pkg/pkg-2.ebuild",
+                "cat/other/other-3.ebuild",
+                "bird/pkg/pkg-4.ebuild",
+                "cat/pkg/pkg-1.ebuild",
+            ):
+                self._create_ebuild(config.new_portdir, ebuild_filename, keywords=keywords)
+            actual_news = list(iterate_new_and_changed_ebuilds(config))
+        self.assertEqual(
+            actual_news,
+            ["bird/pkg-4", "cat/other-3", "cat/pkg-1", "cat/pkg-2", "dog/pkg-1"],
+        )
+
+
+class IterateNewAndChangedEbuildsInGitTest(TestCase):
+    def setUp(self):
+        self._tempdir = TemporaryDirectory()
+        self._portdir = self._tempdir.name
+        self._git("init", "--quiet")
+
+    def tearDown(self):
+        self._tempdir.cleanup()
+
+    def _git(self, *args) -> str:
+        argv = ["git", "-C", self._portdir, "-c", "user.name=Test", "-c", "user.email=test@test"]
+        return subprocess.check_output(argv + list(args)).decode("utf-8").strip()
+
+    def _write_ebuild(self, ebuild_filename, keywords):
+        IterateNewAndChangedEbuildsTest._create_ebuild(
+            self._portdir, ebuild_filename, keywords=keywords
+        )
+
+    def _commit(self) -> str:
+        self._git("add", "--all")
+        self._git("commit", "--quiet", "--message", "Update")
+        return self._git("rev-parse", "HEAD")
+
+    def _iterate(self, *revisions) -> tuple[list[str], int]:
+        argv = ["gentoo-tree-diff", "--keywords", "one", "--git", "--portdir", self._portdir]
+        config = enrich_config(parse_command_line(argv + list(revisions)))
+        read_statistics = ReadStatistics()
+        news = list(iterate_new_and_changed_ebuilds(config, read_statistics))
+        return news, read_statistics.files_read
+
+    def test_revisions(self):
+        self._write_ebuild("cat/pkg/pkg-1.ebuild", keywords="~one")
+        self._write_ebuild("cat/pkg/pkg-2.ebuild", keywords="one")
+        self._write_ebuild("cat/pkg/pkg-3.ebuild", keywords="one")
+        self._write_ebuild("cat/pkg/pkg-9999.ebuild", keywords="")
+        old_rev = self._commit()
+
+        self._write_ebuild("cat/pkg/pkg-1.ebuild", keywords="one")  # i.e. went stable
+        os.remove(os.path.join(self._portdir, "cat/pkg/pkg-2.ebuild"))
+        os.chmod(os.path.join(self._portdir, "cat/pkg/pkg-3.ebuild"), 0o755)
+        self._write_ebuild("cat/pkg/pkg-9999.ebuild", keywords="one")
+        self._write_ebuild("cat/other/other-4.ebuild", keywords="one")
+        self._write_ebuild("cat/other/other-5.ebuild", keywords="other")
+        new_rev = self._commit()
+
+        self.assertEqual(self._iterate(old_rev, new_rev), (["cat/other-4", "cat/pkg-1"], 4))
+
+    def test_working_tree(self):
+        self._write_ebuild("cat/pkg/pkg-1.ebuild", keywords="~one")
+        old_rev = self._commit()
+        self._write_ebuild("cat/pkg/pkg-1.ebuild", keywords="one")
+
+        self.assertEqual(self._iterate(old_rev), (["cat/pkg-1"], 2))
+
+    def test_unknown_revision(self):
+        with self.assertRaises(subprocess.CalledProcessError):
+            self._iterate("does-not-exist")
+
+
+class SnapshotTest(TestCase):
+    def setUp(self):
+        self._tempdir = TemporaryDirectory()
+        self._portdir = os.path.join(self._tempdir.name, "portdir")
+        self._snapshot_filename = os.path.join(self._tempdir.name, "snapshot.json")
+
+    def tearDown(self):
+        self._tempdir.cleanup()
+
+    def _write_ebuild(self, ebuild_filename, keywords):
+        IterateNewAndChangedEbuildsTest._create_ebuild(
+            self._portdir, ebuild_filename, keywords=keywords
+        )
+
+    def _run(self, *extra_argv) -> tuple[str, str]:
+        argv = ["gentoo-tree-diff", "--keywords", "one", "--stats", "--snapshot"]
+        argv += [self._snapshot_filename, *extra_argv, self._portdir]
+        return _run_main(argv)
+
+    def test_update_snapshot(self):
+        self._write_ebuild("cat/pkg/pkg-1.ebuild", keywords="~one")
+        self._write_ebuild("cat/pkg/pkg-2.ebuild", keywords="one")
+        self._write_ebuild("cat/pkg/pkg-9999.ebuild", keywords="one")
+
+        self.assertEqual(self._run("--update-snapshot")[0], "cat/pkg-2\n")
+        self.assertTrue(os.path.exists(self._snapshot_filename))
+        self.assertEqual(self._run()[0], "")
+
+        self._write_ebuild("cat/pkg/pkg-1.ebuild", keywords="one")  # i.e. went stable
+        self._write_ebuild("cat/pkg/pkg-3.ebuild", keywords="one")
+        self.assertEqual(self._run()[0], "cat/pkg-1\ncat/pkg-3\n")
+
+        # NOTE: Without --update-snapshot, the snapshot is left untouched
+        self.assertEqual(self._run("--update-snapshot")[0], "cat/pkg-1\ncat/pkg-3\n")
+        self.assertEqual(self._run()[0], "")
+
+    def test_trust_stat(self):
+        self._write_ebuild("cat/pkg/pkg-1.ebuild", keywords="one")
+        self._run("--update-snapshot")
+
+        self.assertEqual(self._run("--trust-stat"), ("", "0 file(s) read, 0 bytes\n"))
+
+    def test_update_snapshot_from_changes(self):
+        self._write_ebuild("cat/a/a-1.ebuild", keywords="one")
+        self._write_ebuild("cat/b/b-1.ebuild", keywords="one")
+        self._write_ebuild("cat/c/c-1.ebuild", keywords="one")
+        self._run("--update-snapshot")
+
+        self._write_ebuild("cat/a/a-2.ebuild", keywords="one")
+        os.remove(os.path.join(self._portdir, "cat/c/c-1.ebuild"))
+        changes_filename = os.path.join(self._tempdir.name, "changes.json")
+        TreeChanges(changed=["cat/a/a-2.ebuild"], deleted=["cat/c/c-1.ebuild"]).save(
+            changes_filename
+        )
+
+        self.assertEqual(
+            self._run(f"--changes-from={changes_filename}", "--update-snapshot")[0], "cat/a-2\n"
+        )
+
+        # NOTE: Entries of ebuilds not listed as changed were carried over
+        self.assertEqual(self._run()[0], "")
+        snapshot = TreeSnapshot.load(self._snapshot_filename)
+        self.assertIsNotNone(snapshot.get("cat/b/b-1.ebuild"))
+        self.assertIsNone(snapshot.get("cat/c/c-1.ebuild"))
+
+        # NOTE: A deleted ebuild coming back is news again
+        self._write_ebuild("cat/c/c-1.ebuild", keywords="one")
+        self.assertEqual(self._run()[0], "cat/c-1\n")
+
+    def test_update_snapshot_with_exclude(self):
+        self._write_ebuild("cat/a/a-1.ebuild", keywords="one")
+        self._write_ebuild("cat/b/b-1.ebuild", keywords="one")
+        self._run("--update-snapshot")
+
+        self._write_ebuild("cat/a/a-2.ebuild", keywords="one")
+        self.assertEqual(self._run("--exclude=cat/b", "--update-snapshot")[0], "cat/a-2\n")
+
+        # NOTE: Entries of excluded packages were carried over
+        self.assertEqual(self._run()[0], "")
+
+    def test_only_one_portdir(self):
+        argv = ["gentoo-tree-diff", "--keywords", "one", "--snapshot", "FILE", "OLD", "NEW"]
+        with patch("sys.stderr", StringIO()), self.assertRaises(SystemExit):
+            parse_command_line(argv)
+
+
+class LabeledKeywordSetsTest(TestCase):
+    def test_single_walk(self):
+        with _temp_portdirs() as (_, old_portdir, new_portdir):
+            for portdir, ebuild_filename, keywords in (
+                (old_portdir, "cat/pkg/pkg-1.ebuild", "~amd64 ~x86"),
+                (new_portdir, "cat/pkg/pkg-1.ebuild", "amd64 ~x86"),
+                (new_portdir, "cat/pkg/pkg-2.ebuild", "~amd64 ~x86"),
+                (new_portdir, "cat/pkg/pkg-3.ebuild", "x86"),
+            ):
+                IterateNewAndChangedEbuildsTest._create_ebuild(
+                    portdir, ebuild_filename, keywords=keywords
+                )
+
+            argv = [
+                "gentoo-tree-diff",
+                "--keywords=amd64-stable=amd64",
+                "--keywords=amd64-testing=~amd64",
+                "--keywords=x86-testing=~x86",
+                "--stats",
+                old_portdir,
+                new_portdir,
+            ]
+            stdout, stderr = _run_main(argv)
+
+        self.assertEqual(
+            stdout,
+            dedent("""\
+                amd64-stable cat/pkg-1
+                amd64-testing cat/pkg-1
+                amd64-testing cat/pkg-2
+                x86-testing cat/pkg-2
+                x86-testing cat/pkg-3
+            """),
+        )
+        self.assertTrue(stderr.startswith("4 file(s) read"))
+
+
+class EclassImpactTest(TestCase):
+    def test_affected_ebuilds_reported(self):
+        with _temp_portdirs() as (tempdir, old_portdir, new_portdir):
+            eclass_index_filename = os.path.join(tempdir, "eclass-index.json")
+            for portdir, filename, content in (
+                (old_portdir, "eclass/cmake.eclass", "# old"),
+                (new_portdir, "eclass/cmake.eclass", "# new"),
+                (old_portdir, "eclass/other.eclass", "# same"),
+                (new_portdir, "eclass/other.eclass", "# same"),
+                (old_portdir, "cat/pkg/pkg-1.ebuild", 'KEYWORDS="~one"'),
+                (new_portdir, "cat/pkg/pkg-1.ebuild", 'KEYWORDS="one"'),
+                (new_portdir, "metadata/md5-cache/cat/pkg-1", "KEYWORDS=one\n_eclasses_=cmake\t1"),
+                (new_portdir, "metadata/md5-cache/cat/pkg-2", "KEYWORDS=one\n_eclasses_=cmake\t1"),
+                (new_portdir, "metadata/md5-cache/cat/pkg-3", "KEYWORDS=two\n_eclasses_=cmake\t1"),
+                (
+                    new_portdir,
+                    "metadata/md5-cache/cat/pkg-9999",
+                    "KEYWORDS=one\n_eclasses_=cmake\t1",
+                ),
+                (new_portdir, "metadata/md5-cache/dog/pkg-4", "KEYWORDS=one\n_eclasses_=other\t1"),
+            ):
+                IterateNewAndChangedEbuildsTest._create_ebuild(
+                    portdir, filename, extra_content=content
+                )
+
+            argv = [
+                "gentoo-tree-diff",
+                "--keywords=one",
+                f"--eclass-impact={eclass_index_filename}",
+                old_portdir,
+                new_portdir,
+            ]
+            stdout, _ = _run_main(argv)
+
+            self.assertEqual(stdout, "cat/pkg-1\ncat/pkg-2\n")
+            self.assertTrue(os.path.exists(eclass_index_filename))
+
+
+class PushToTest(TestCase):
+    def test_filtered_push(self):
+        with _temp_portdirs() as (tempdir, old_portdir, new_portdir):
+            for ebuild_filename in (
+                "cat/pkg/pkg-1.ebuild",
+                "cat/pkg-bin/pkg-bin-2.ebuild",
+                "cat/other/other-3.ebuild",
+                "sys-kernel/pkg/pkg-4.ebuild",
+            ):
+                IterateNewAndChangedEbuildsTest._create_ebuild(
+                    new_portdir, ebuild_filename, keywords="one"
+                )
+
+            include_filename = os.path.join(tempdir, "installed.txt")
+            with open(include_filename, "w") as f:
+                print("cat/pkg\ncat/pkg-bin\nsys-kernel/pkg\n", file=f)
+
+            state_filename = os.path.join(tempdir, "queue.json")
+            q = PriorityQueue()
+            q.push(1.0, "=cat/previous-1")
+            q.save(state_filename)
+
+            argv = [
+                "gentoo-tree-diff",
+                "--keywords=one",
+                f"--include-file={include_filename}",
+                "--exclude=sys-kernel/*",
+                "--exclude=*-bin",
+                f"--push-to={state_filename}",
+                "--stats",
+                "--priority=2.0",
+                old_portdir,
+                new_portdir,
+            ]
+            stdout, stderr = _run_main(argv)
+
+            self.assertEqual(stdout, "cat/pkg-1\n")
+            # NOTE: Excluded packages were never read
+            self.assertEqual(stderr, "1 file(s) read, 15 bytes\n")
+            self.assertEqual(
+                list(PriorityQueue.load(state_filename)),
+                [(1.0, "=cat/previous-1"), (2.0, "=cat/pkg-1")],
+            )
+
+    def test_priority_required(self):
+        argv = ["gentoo-tree-diff", "--keywords=one", "--push-to=queue.json", "OLD", "NEW"]
+        with patch("sys.stderr", StringIO()), self.assertRaises(SystemExit):
+            parse_command_line(argv)
+
+
+class ChangesFromTest(TestCase):
+    def test_only_listed_ebuilds_read(self):
+        with _temp_portdirs() as (tempdir, old_portdir, new_portdir):
+            for portdir, ebuild_filename, keywords in (
+                (old_portdir, "cat/pkg/pkg-1.ebuild", "~one"),
+                (new_portdir, "cat/pkg/pkg-1.ebuild", "one"),
+                (new_portdir, "cat/pkg/pkg-2.ebuild", "one"),
+                (new_portdir, "cat/unlisted/unlisted-1.ebuild", "one"),
+                (new_portdir, "cat/excluded/excluded-1.ebuild", "one"),
+            ):
+                IterateNewAndChangedEbuildsTest._create_ebuild(
+                    portdir, ebuild_filename, keywords=keywords
+                )
+
+            changes_filename = os.path.join(tempdir, "changes.json")
+            TreeChanges(
+                changed=[
+                    "cat/pkg/Manifest",
+                    "cat/pkg/pkg-2.ebuild",
+                    "cat/pkg/pkg-1.ebuild",
+                    "cat/excluded/excluded-1.ebuild",
+                    "cat/gone/gone-1.ebuild",
+                ],
+                deleted=["cat/pkg/pkg-0.ebuild"],
+            ).save(changes_filename)
+
+            argv = [
+                "gentoo-tree-diff",
+                "--keywords=one",
+                f"--changes-from={changes_filename}",
+                "--exclude=cat/excluded",
+                "--stats",
+                old_portdir,
+                new_portdir,
+            ]
+            stdout, stderr = _run_main(argv)
+
+        self.assertEqual(stdout, "cat/pkg-1\ncat/pkg-2\n")
+        self.assertEqual(stderr, "3 file(s) read, 46 bytes\n")
+
+    def test_not_allowed_with_git(self):
+        argv = ["gentoo-tree-diff", "--keywords=one", "--changes-from=FILE", "--git", "OLD"]
+        with patch("sys.stderr", StringIO()), self.assertRaises(SystemExit):
+            parse_command_line(argv)
+
+
+class _FakeTreeWatcher:
+    def __init__(self, dirty_package_dirs_per_round, changes_per_round=None):
+        self._dirty_package_dirs_per_round = list(dirty_package_dirs_per_round)
+        self._changes_per_round = list(changes_per_round or [])
+        self.closed = False
+
+    def wait_for_dirty_package_dirs(self, settle_seconds):
+        if self._changes_per_round:
+            self._changes_per_round.pop(0)()
+        return self._dirty_package_dirs_per_round.pop(0)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.closed = True
+
+
+class WatchTest(TestCase):
+    def test_only_dirty_package_dirs_compared(self):
+        with _temp_portdirs() as (tempdir, old_portdir, new_portdir):
+            for ebuild_filename in (
+                "cat/pkg/pkg-1.ebuild",
+                "cat/other/other-2.ebuild",
+                "dev-util/tool/tool-3.ebuild",
+            ):
+                IterateNewAndChangedEbuildsTest._create_ebuild(
+                    new_portdir, ebuild_filename, keywords="one"
+                )
+
+            state_filename = os.path.join(tempdir, "queue.json")
+            argv = [
+                "gentoo-tree-diff",
+                "--keywords=one",
+                "--watch",
+                f"--push-to={state_filename}",
+                "--priority=1.0",
+                old_portdir,
+                new_portdir,
+            ]
+            config = parse_command_line(argv)
+            enrich_config(config)
+            tree_watcher = _FakeTreeWatcher(
+                [{"dev-util/tool", "cat/pkg", "cat/gone"}, {"cat/other"}]
+            )
+
+            with patch("sys.stdout", StringIO()) as stdout_mock:
+                watch_new_and_changed_ebuilds(config, tree_watcher, max_rounds=2)
+
+            self.assertEqual(stdout_mock.getvalue(), "cat/pkg-1\ndev-util/tool-3\ncat/other-2\n")
+            self.assertEqual(
+                list(PriorityQueue.load(state_filename)),
+                [(1.0, "=cat/pkg-1"), (1.0, "=dev-util/tool-3"), (1.0, "=cat/other-2")],
+            )
+            self.assertTrue(tree_watcher.closed)
+
+    @parameterized.expand([("without keywords cache", []), ("with keywords cache", ["cache"])])
+    def test_news_reported_once_only(self, _label, keywords_cache_argv):
+        with _temp_portdirs() as (tempdir, old_portdir, new_portdir):
+
+            def write_ebuild(ebuild_filename, keywords):
+                IterateNewAndChangedEbuildsTest._create_ebuild(
+                    new_portdir, ebuild_filename, keywords=keywords
+                )
+
+            argv = ["gentoo-tree-diff", "--keywords=one", "--watch", old_portdir, new_portdir]
+            if keywords_cache_argv:
+                argv[1:1] = ["--keywords-cache", os.path.join(tempdir, "cache.json")]
+            config = parse_command_line(argv)
+            enrich_config(config)
+            tree_watcher = _FakeTreeWatcher(
+                [{"cat/pkg"}, {"cat/pkg"}, {"cat/pkg"}],
+                [
+                    lambda: write_ebuild("cat/pkg/pkg-1.ebuild", "one"),
+                    lambda: write_ebuild("cat/pkg/pkg-2.ebuild", "two"),
+                    lambda: write_ebuild("cat/pkg/pkg-2.ebuild", "one two"),
+                ],
+            )
+
+            with patch("sys.stdout", StringIO()) as stdout_mock:
+                watch_new_and_changed_ebuilds(config, tree_watcher, max_rounds=3)
+
+            self.assertEqual(stdout_mock.getvalue(), "cat/pkg-1\ncat/pkg-2\n")
+
+    @parameterized.expand(
+        [
+            ("git", ["--git"]),
+            ("md5-cache", ["--md5-cache"]),
+            ("eclass impact", ["--eclass-impact=index.json"]),
+        ]
+    )
+    def test_incompatible_arguments(self, _label, extra_argv):
+        argv = ["gentoo-tree-diff", "--keywords=one", "--watch"] + extra_argv + ["OLD", "NEW"]
+        with patch("sys.stderr", StringIO()), self.assertRaises(SystemExit):
+            parse_command_line(argv)
+
 
 class MainTest(TestCase):
     @staticmethod
@@ -254,6 +971,7 @@ class MainTest(TestCase):
                 "gentoo-tree-diff",
                 "--keywords",
                 "**",
+                "--stats",
                 old_portdir,
                 new_portdir,
             ]
@@ -265,6 +983,7 @@ class MainTest(TestCase):
             with (
                 patch("sys.argv", argv),
                 patch("sys.stdout", StringIO()) as stdout_mock,
+                patch("sys.stderr", StringIO()) as stderr_mock,
             ):
                 main()
 
@@ -272,3 +991,4 @@ class MainTest(TestCase):
                 self._sort_lines(stdout_mock.getvalue()),
                 self._sort_lines(expected_stdout),
             )
+            self.assertEqual(stderr_mock.getvalue(), "4 file(s) read, 84 bytes\n")
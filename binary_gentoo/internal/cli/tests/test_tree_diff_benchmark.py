@@ -0,0 +1,160 @@
+# Copyright (C) 2021 Sebastian Pipping <sebastian@pipping.org>
+# Licensed under GNU Affero GPL version 3 or later
+
+import os
+import shutil
+import subprocess
+import time
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+from parameterized import parameterized
+
+from ...keywords_cache import KeywordsCache
+from ...tree_snapshot import TreeSnapshot
+from ..tree_diff import (
+    ReadStatistics,
+    enrich_config,
+    iterate_new_and_changed_ebuilds,
+    parse_command_line,
+)
+from .synthetic_portdir import generate_synthetic_portdir_pair, write_portdir
+
+# NOTE: Raise e.g. to 10 for a tree of roughly the size of ::gentoo
+_SCALE = int(os.environ.get("BINARY_GENTOO_BENCHMARK_SCALE", "1"))
+
+# NOTE: Time taken depends too much on the machine to assert it unless asked to
+_ASSERT_TIME = "BINARY_GENTOO_BENCHMARK_SCALE" in os.environ
+
+# NOTE: Deliberately generous so as to only catch regressions of magnitude
+_MAX_SECONDS_PER_EBUILD = 0.005
+
+
+class TreeDiffBenchmarkTest(TestCase):
+    """Guards files read, bytes read and time taken per mode against regression"""
+
+    _thick_manifests = False
+
+    @classmethod
+    def setUpClass(cls):
+        cls._pair = generate_synthetic_portdir_pair(
+            categories=10 * _SCALE,
+            packages_per_category=20 * _SCALE,
+            ebuilds_per_package=3,
+            thick_manifests=cls._thick_manifests,
+        )
+        cls._tempdir = TemporaryDirectory()
+        cls._old_portdir = os.path.join(cls._tempdir.name, "old")
+        cls._new_portdir = os.path.join(cls._tempdir.name, "new")
+        write_portdir(cls._old_portdir, cls._pair.old_files)
+        write_portdir(cls._new_portdir, cls._pair.new_files)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls._tempdir.cleanup()
+
+    def _create_config(self, *extra_argv, portdirs=None):
+        argv = ["gentoo-tree-diff", "--keywords", self._pair.accept_keywords, *extra_argv]
+        argv += [self._old_portdir, self._new_portdir] if portdirs is None else portdirs
+        config = parse_command_line(argv)
+        enrich_config(config)
+        return config
+
+    def _assert_within_thresholds(self, config, max_files_read: int, **kwargs):
+        read_statistics = ReadStatistics()
+
+        before = time.perf_counter()
+        news = list(iterate_new_and_changed_ebuilds(config, read_statistics, **kwargs))
+        seconds = time.perf_counter() - before
+
+        self.assertEqual(sorted(news), sorted(self._pair.expected_news))
+        self.assertLessEqual(read_statistics.files_read, max_files_read)
+        self.assertLessEqual(read_statistics.bytes_read, max_files_read * self._pair.max_file_size)
+        if _ASSERT_TIME:
+            self.assertLessEqual(seconds, _MAX_SECONDS_PER_EBUILD * len(self._pair.new_files))
+
+    def test_generated_pair_has_news(self):
+        self.assertGreater(len(self._pair.expected_news), 0)
+        self.assertLess(self._pair.changed_package_count, self._pair.package_count)
+
+    @parameterized.expand([("serial", 1), ("parallel", 4)])
+    def test_default(self, _label, jobs):
+        # NOTE: Unchanged packages take no more than reading two Manifests per category
+        self._assert_within_thresholds(
+            self._create_config("--jobs", str(jobs)),
+            max_files_read=2 * self._pair.category_count
+            + 2 * self._pair.ebuild_count_in_changed_packages,
+        )
+
+    def test_trust_stat(self):
+        # NOTE: Unchanged packages are skipped by directory modification time alone
+        self._assert_within_thresholds(
+            self._create_config("--trust-stat"),
+            max_files_read=2 * self._pair.changed_package_count
+            + 2 * self._pair.changed_ebuild_count,
+        )
+
+    def test_keywords_cache__warm(self):
+        keywords_cache = KeywordsCache(max_entries=10 * len(self._pair.new_files))
+        config = self._create_config()
+        list(iterate_new_and_changed_ebuilds(config, keywords_cache=keywords_cache))
+
+        self._assert_within_thresholds(
+            config,
+            max_files_read=2 * self._pair.category_count,
+            keywords_cache=keywords_cache,
+        )
+
+    def test_md5_cache(self):
+        md5_cache_entries = [
+            path for path in self._pair.new_files if path.startswith("metadata/md5-cache/")
+        ]
+        self._assert_within_thresholds(
+            self._create_config("--md5-cache"), max_files_read=2 * len(md5_cache_entries)
+        )
+
+    def test_snapshot(self):
+        snapshot_filename = os.path.join(self._tempdir.name, "snapshot.json")
+        old_snapshot = TreeSnapshot()
+        list(
+            iterate_new_and_changed_ebuilds(
+                self._create_config("--snapshot", snapshot_filename, portdirs=[self._old_portdir]),
+                new_snapshot=old_snapshot,
+            )
+        )
+        old_snapshot.save(snapshot_filename)
+
+        self._assert_within_thresholds(
+            self._create_config(
+                "--snapshot", snapshot_filename, "--trust-stat", portdirs=[self._new_portdir]
+            ),
+            max_files_read=self._pair.changed_ebuild_count,
+        )
+
+    def test_git(self):
+        git_dir = os.path.join(self._tempdir.name, "git")
+        argv = ["git", "-C", git_dir, "-c", "user.name=Test", "-c", "user.email=test@test"]
+        subprocess.check_call(["git", "init", "--quiet", git_dir])
+        revisions = []
+        for portdir in (self._old_portdir, self._new_portdir):
+            for entry in os.listdir(git_dir):
+                if entry != ".git":
+                    shutil.rmtree(os.path.join(git_dir, entry))
+            shutil.copytree(portdir, git_dir, dirs_exist_ok=True)
+            subprocess.check_call(argv + ["add", "--all"])
+            subprocess.check_call(argv + ["commit", "--quiet", "--message", "Update"])
+            revisions.append(
+                subprocess.check_output(argv + ["rev-parse", "HEAD"]).decode("utf-8").strip()
+            )
+
+        # NOTE: Only changed ebuilds are read, never the unchanged bulk of the tree
+        self._assert_within_thresholds(
+            self._create_config("--git", "--portdir", git_dir, portdirs=revisions),
+            max_files_read=2 * self._pair.changed_ebuild_count,
+        )
+
+
+class ThickManifestsTreeDiffBenchmarkTest(TreeDiffBenchmarkTest):
+    """Same as with thin Manifests since package Manifests are not read at all"""
+
+    _thick_manifests = True
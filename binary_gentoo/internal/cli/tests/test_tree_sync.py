@@ -1,6 +1,8 @@
 # Copyright (C) 2021 Sebastian Pipping <sebastian@pipping.org>
 # Licensed under GNU Affero GPL version 3 or later
 
+import os
+import subprocess
 from dataclasses import dataclass
 from io import StringIO
 from subprocess import call
@@ -8,9 +10,11 @@ from tempfile import TemporaryDirectory
 from unittest import TestCase
 from unittest.mock import patch
 
+from freezegun import freeze_time
 from parameterized import parameterized
 
-from ..tree_sync import main
+from ...tree_changes import TreeChanges
+from ..tree_sync import _parse_itemized_changes, main, parse_command_line
 
 
 @dataclass
@@ -50,7 +54,356 @@ class MainTest(TestCase):
     def test_success_invokes_docker(self, _, backup: bool):
         run_record = self._run_gentoo_tree_sync_with_subprocess_mocked(backup=backup)
 
-        docker_run_call = run_record.call_args_list[0]
+        docker_run_call = run_record.call_args_list[-1]
         self.assertEqual(docker_run_call.args[0][:2], ["docker", "run"])
 
-        self.assertEqual(len(run_record.call_args_list), 1)
+        self.assertEqual(len(run_record.call_args_list), 2 if backup else 1)
+
+    def test_backup_runs_on_host_before_docker(self):
+        run_record = self._run_gentoo_tree_sync_with_subprocess_mocked(backup=True)
+
+        backup_call = run_record.call_args_list[0]
+        self.assertEqual(backup_call.args[0][:3], ["rsync", "--archive", "--delete"])
+
+    @parameterized.expand(
+        [
+            ("backup", "--backup-to"),
+            ("snapshot backup", "--backup-snapshots-to"),
+        ]
+    )
+    def test_backup_of_missing_portdir_skipped(self, _, backup_option):
+        with TemporaryDirectory() as tempdir:
+            backup_dir = os.path.join(tempdir, "backup")
+            portdir = os.path.join(tempdir, "portdir")
+            argv = ["gentoo-tree-sync", backup_option, backup_dir, portdir]
+
+            with (
+                patch("sys.argv", argv),
+                patch("subprocess.check_call") as check_call_mock,
+                patch("sys.stdout", StringIO()),
+            ):
+                main()
+
+            self.assertFalse(os.path.exists(backup_dir))
+
+        [docker_run_call] = check_call_mock.call_args_list
+        self.assertEqual(docker_run_call.args[0][:2], ["docker", "run"])
+
+
+class StagingTest(TestCase):
+    def test_backup_and_fetch_before_final_rsync(self):
+        with (
+            TemporaryDirectory() as temp_portdir,
+            TemporaryDirectory() as temp_backup_portdir,
+            TemporaryDirectory() as tempdir,
+        ):
+            temp_staging_portdir = os.path.join(tempdir, "staging")
+            argv = [
+                "gentoo-tree-sync",
+                "--backup-to",
+                temp_backup_portdir,
+                "--staging-dir",
+                temp_staging_portdir,
+                temp_portdir,
+            ]
+
+            with (
+                patch("sys.argv", argv),
+                patch("subprocess.check_call") as check_call_mock,
+                patch("sys.stdout", StringIO()),
+            ):
+                main()
+
+            self.assertTrue(os.path.isdir(temp_staging_portdir))
+
+        argvs = [call.args[0] for call in check_call_mock.call_args_list]
+        self.assertEqual(len(argvs), 3)
+
+        # NOTE: Backup and fetch run concurrently, i.e. in no particular order
+        [docker_run_argv] = [argv for argv in argvs[:2] if argv[:2] == ["docker", "run"]]
+        self.assertIn(f"{temp_staging_portdir}:/usr/portage:rw", docker_run_argv)
+        [backup_argv] = [argv for argv in argvs[:2] if argv[0] == "rsync"]
+        self.assertEqual(backup_argv[-2:], [f"{temp_portdir}/", f"{temp_backup_portdir}/"])
+
+        self.assertEqual(
+            argvs[2],
+            ["rsync", "--archive", "--delete", f"{temp_staging_portdir}/", f"{temp_portdir}/"],
+        )
+
+    def test_staging_dir_differs_from_portdir(self):
+        argv = ["gentoo-tree-sync", "--staging-dir", "PORTDIR", "PORTDIR"]
+        with patch("sys.stderr", StringIO()), self.assertRaises(SystemExit):
+            parse_command_line(argv)
+
+
+class SnapshotBackupTest(TestCase):
+    @staticmethod
+    def _fake_check_call(argv, stdout=None):
+        if argv[0] == "rsync":
+            os.makedirs(argv[-1], exist_ok=True)
+
+    def _run_gentoo_tree_sync(self, snapshots_dir, *extra_argv) -> tuple[str, list[str]]:
+        with TemporaryDirectory() as temp_portdir:
+            argv = ["gentoo-tree-sync", "--backup-snapshots-to", snapshots_dir, *extra_argv]
+            argv.append(temp_portdir)
+
+            with (
+                patch("sys.argv", argv),
+                patch(
+                    "subprocess.check_call", side_effect=self._fake_check_call
+                ) as check_call_mock,
+                patch("sys.stdout", StringIO()),
+                freeze_time("2021-12-31 23:59:59"),
+            ):
+                main()
+
+        [backup_call, _docker_run_call] = check_call_mock.call_args_list
+        return temp_portdir, backup_call.args[0]
+
+    def test_first_snapshot(self):
+        with TemporaryDirectory() as snapshots_dir:
+            temp_portdir, backup_argv = self._run_gentoo_tree_sync(snapshots_dir)
+
+            self.assertEqual(os.listdir(snapshots_dir), ["20211231T235959Z"])
+
+        self.assertEqual(
+            backup_argv,
+            [
+                "rsync",
+                "--archive",
+                "--delete",
+                f"{temp_portdir}/",
+                f"{snapshots_dir}/.incomplete/",
+            ],
+        )
+
+    def test_incomplete_snapshot_ignored_and_completed(self):
+        with TemporaryDirectory() as snapshots_dir:
+            os.mkdir(os.path.join(snapshots_dir, "20211230T000000Z"))
+            os.makedirs(os.path.join(snapshots_dir, ".incomplete", "cat"))
+
+            _, backup_argv = self._run_gentoo_tree_sync(snapshots_dir)
+
+            self.assertEqual(
+                sorted(os.listdir(snapshots_dir)), ["20211230T000000Z", "20211231T235959Z"]
+            )
+            self.assertEqual(os.listdir(os.path.join(snapshots_dir, "20211231T235959Z")), ["cat"])
+
+        self.assertEqual(backup_argv[3], "--link-dest=../20211230T000000Z")
+
+    def test_snapshot_of_same_second_replaced(self):
+        with TemporaryDirectory() as snapshots_dir:
+            os.makedirs(os.path.join(snapshots_dir, "20211231T235959Z", "stale"))
+
+            _, backup_argv = self._run_gentoo_tree_sync(snapshots_dir)
+
+            self.assertEqual(os.listdir(snapshots_dir), ["20211231T235959Z"])
+            self.assertEqual(os.listdir(os.path.join(snapshots_dir, "20211231T235959Z")), [])
+
+        self.assertEqual(backup_argv[3], "--link-dest=../20211231T235959Z")
+
+    def test_hardlinks_and_rotation(self):
+        with TemporaryDirectory() as snapshots_dir:
+            for name in ("20211229T000000Z", "20211230T000000Z", "unrelated"):
+                os.mkdir(os.path.join(snapshots_dir, name))
+
+            _, backup_argv = self._run_gentoo_tree_sync(snapshots_dir, "--keep", "2")
+
+            self.assertEqual(
+                sorted(os.listdir(snapshots_dir)),
+                ["20211230T000000Z", "20211231T235959Z", "unrelated"],
+            )
+
+        self.assertEqual(backup_argv[3], "--link-dest=../20211230T000000Z")
+
+    @parameterized.expand(
+        [
+            ("keep without snapshots", ["--keep", "2"]),
+            ("keep zero", ["--backup-snapshots-to", "DIR", "--keep", "0"]),
+            ("both backup kinds", ["--backup-snapshots-to", "DIR", "--backup-to", "DIR2"]),
+        ]
+    )
+    def test_invalid_arguments(self, _, extra_argv):
+        with patch("sys.stderr", StringIO()), self.assertRaises(SystemExit):
+            parse_command_line(["gentoo-tree-sync", *extra_argv, "PORTDIR"])
+
+
+class ChangesOutTest(TestCase):
+    @staticmethod
+    def _write_file(filename, content):
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        with open(filename, "w") as f:
+            f.write(content)
+
+    def test_stat_index_in_place(self):
+        with TemporaryDirectory() as temp_portdir, TemporaryDirectory() as tempdir:
+            self._write_file(os.path.join(temp_portdir, "cat/pkg/pkg-1.ebuild"), "1")
+            self._write_file(os.path.join(temp_portdir, "cat/pkg/pkg-2.ebuild"), "2")
+            self._write_file(os.path.join(temp_portdir, "cat/other/other-1.ebuild"), "1")
+            changes_filename = os.path.join(tempdir, "changes.json")
+
+            def fake_emerge_webrsync(argv, stdout=None):
+                self._write_file(os.path.join(temp_portdir, "cat/pkg/pkg-2.ebuild"), "22")
+                self._write_file(os.path.join(temp_portdir, "cat/pkg/pkg-3.ebuild"), "3")
+                os.remove(os.path.join(temp_portdir, "cat/other/other-1.ebuild"))
+
+            argv = ["gentoo-tree-sync", f"--changes-out={changes_filename}", temp_portdir]
+            with (
+                patch("sys.argv", argv),
+                patch("subprocess.check_call", fake_emerge_webrsync),
+                patch("sys.stdout", StringIO()),
+            ):
+                main()
+
+            changes = TreeChanges.load(changes_filename)
+
+        self.assertEqual(
+            changes,
+            TreeChanges(
+                changed=["cat/pkg/pkg-2.ebuild", "cat/pkg/pkg-3.ebuild"],
+                deleted=["cat/other/other-1.ebuild"],
+            ),
+        )
+
+    def test_parse_itemized_changes(self):
+        rsync_output = (
+            "cd+++++++++ cat/new/\n"
+            ">f+++++++++ cat/new/new-1.ebuild\n"
+            ">f.st...... cat/pkg/pkg-1.ebuild\n"
+            ".d..t...... cat/pkg/\n"
+            "*deleting   cat/old/old-1.ebuild\n"
+            "*deleting   cat/old/\n"
+        )
+
+        self.assertEqual(
+            _parse_itemized_changes(rsync_output),
+            TreeChanges(
+                changed=["cat/new/new-1.ebuild", "cat/pkg/pkg-1.ebuild"],
+                deleted=["cat/old/old-1.ebuild"],
+            ),
+        )
+
+    def test_itemized_changes_with_staging_dir(self):
+        with TemporaryDirectory() as temp_portdir, TemporaryDirectory() as tempdir:
+            changes_filename = os.path.join(tempdir, "changes.json")
+            argv = [
+                "gentoo-tree-sync",
+                f"--changes-out={changes_filename}",
+                f"--staging-dir={os.path.join(tempdir, 'staging')}",
+                temp_portdir,
+            ]
+            with (
+                patch("sys.argv", argv),
+                patch("subprocess.check_call"),
+                patch(
+                    "subprocess.check_output", return_value=b">f+++++++++ cat/pkg/pkg-1.ebuild\n"
+                ) as check_output_mock,
+                patch("sys.stdout", StringIO()),
+            ):
+                main()
+
+            changes = TreeChanges.load(changes_filename)
+
+        self.assertIn("--out-format=%i %n", check_output_mock.call_args.args[0])
+        self.assertEqual(changes, TreeChanges(changed=["cat/pkg/pkg-1.ebuild"]))
+
+
+class GitMethodTest(TestCase):
+    def setUp(self):
+        self._tempdir = TemporaryDirectory()
+        self._mirror = os.path.join(self._tempdir.name, "mirror.git")
+        self._work = os.path.join(self._tempdir.name, "work")
+        self._portdir = os.path.join(self._tempdir.name, "portdir")
+        self._changes_filename = os.path.join(self._tempdir.name, "changes.json")
+        subprocess.check_call(["git", "init", "--quiet", "--bare", self._mirror])
+        subprocess.check_call(["git", "clone", "--quiet", self._mirror, self._work])
+
+    def tearDown(self):
+        self._tempdir.cleanup()
+
+    def _git(self, *args) -> str:
+        argv = ["git", "-C", self._work, "-c", "user.name=Test", "-c", "user.email=test@test"]
+        return subprocess.check_output(argv + list(args)).decode("utf-8").strip()
+
+    def _commit_and_push(self, files: dict[str, str | None]) -> str:
+        for relative_path, content in files.items():
+            filename = os.path.join(self._work, relative_path)
+            if content is None:
+                os.remove(filename)
+                continue
+            os.makedirs(os.path.dirname(filename), exist_ok=True)
+            with open(filename, "w") as f:
+                f.write(content)
+        self._git("add", "--all")
+        self._git("commit", "--quiet", "--message", "Update")
+        self._git("push", "--quiet", "origin", "HEAD")
+        return self._git("rev-parse", "HEAD")
+
+    def _sync(self, *extra_argv):
+        argv = [
+            "gentoo-tree-sync",
+            "--method=git",
+            f"--git-url=file://{self._mirror}",
+            f"--changes-out={self._changes_filename}",
+            *extra_argv,
+            self._portdir,
+        ]
+        with patch("sys.argv", argv), patch("sys.stdout", StringIO()):
+            main()
+        return TreeChanges.load(self._changes_filename)
+
+    @parameterized.expand(
+        [
+            ("full history", []),
+            ("shallow", ["--depth=1"]),
+        ]
+    )
+    def test_clone_then_fast_forward(self, _, extra_argv):
+        first_commit = self._commit_and_push(
+            {"cat/pkg/pkg-1.ebuild": "1", "cat/old/old-1.ebuild": "1"}
+        )
+
+        self.assertEqual(
+            self._sync(*extra_argv),
+            TreeChanges(
+                changed=["cat/old/old-1.ebuild", "cat/pkg/pkg-1.ebuild"],
+                new_commit=first_commit,
+            ),
+        )
+
+        second_commit = self._commit_and_push(
+            {"cat/pkg/pkg-2.ebuild": "2", "cat/old/old-1.ebuild": None}
+        )
+        third_commit = self._commit_and_push({"cat/pkg/pkg-1.ebuild": "1-r1"})
+
+        self.assertNotEqual(second_commit, third_commit)
+        self.assertEqual(
+            self._sync(*extra_argv),
+            TreeChanges(
+                changed=["cat/pkg/pkg-1.ebuild", "cat/pkg/pkg-2.ebuild"],
+                deleted=["cat/old/old-1.ebuild"],
+                old_commit=first_commit,
+                new_commit=third_commit,
+            ),
+        )
+        with open(os.path.join(self._portdir, "cat/pkg/pkg-1.ebuild")) as f:
+            self.assertEqual(f.read(), "1-r1")
+
+    def test_refuses_non_empty_non_clone(self):
+        self._commit_and_push({"cat/pkg/pkg-1.ebuild": "1"})
+        os.mkdir(self._portdir)
+        with open(os.path.join(self._portdir, "unrelated"), "w"):
+            pass
+
+        with patch("sys.stderr", StringIO()), self.assertRaises(SystemExit):
+            self._sync()
+
+    @parameterized.expand(
+        [
+            ("depth without git", ["--depth=1"]),
+            ("staging with git", ["--method=git", "--staging-dir=DIR"]),
+        ]
+    )
+    def test_invalid_arguments(self, _, extra_argv):
+        with patch("sys.stderr", StringIO()), self.assertRaises(SystemExit):
+            parse_command_line(["gentoo-tree-sync", *extra_argv, "PORTDIR"])
@@ -1,19 +1,39 @@
 # Copyright (C) 2021 Sebastian Pipping <sebastian@pipping.org>
 # Licensed under GNU Affero GPL version 3 or later
 
-import filecmp
+import fnmatch
+import gzip
+import hashlib
+import itertools
 import os
 import re
+import subprocess
 import sys
 from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import suppress
+from functools import cached_property
+from threading import Lock
 
+from ..atoms import strip_version_from
+from ..fs_lock import file_based_interprocess_locking
+from ..keywords_cache import KeywordsCache
+from ..md5_cache import EclassIndex, parse_md5_cache_entry
+from ..priority_queue import PriorityQueue
 from ..reporter import announce_and_check_output, exception_reporting
+from ..tree_changes import TreeChanges
+from ..tree_snapshot import SnapshotEntry, TreeSnapshot
+from ..tree_watcher import create_tree_watcher
 from ._distro import HOST_IS_GENTOO
 from ._parser import add_version_argument_to
 
-_keywords_pattern = re.compile('KEYWORDS="(?P<keywords>[^"]*)"')
+_keywords_pattern = re.compile(b'KEYWORDS="(?P<keywords>[^"]*)"')
 _filename_9999_pattern = re.compile(r"9999(-r[0-9]+)?\.ebuild$")
 
+_MD5_CACHE_DIR = os.path.join("metadata", "md5-cache")
+_NON_CATEGORY_DIRS = {"eclass", "licenses", "metadata", "profiles"}
+_ECLASS_DIR = "eclass"
+
 
 def _replace_special_keywords_for_ebuild(
     accept_keywords: set[str], ebuild_keywords: set[str]
@@ -31,90 +51,938 @@ def _replace_special_keywords_for_ebuild(
     return effective_keywords
 
 
-def _get_relevant_keywords_set_for(ebuild_filepath: str, accept_keywords: set[str]) -> set[str]:
-    with open(ebuild_filepath) as ifile:
-        ebuild_content = ifile.read()
+class ReadStatistics:
+    """Counts the files and bytes that a run of the diff pipeline has read"""
+
+    def __init__(self):
+        self.files_read = 0
+        self.bytes_read = 0
+        self._lock = Lock()
+
+    def count(self, content: bytes) -> bytes:
+        with self._lock:
+            self.files_read += 1
+            self.bytes_read += len(content)
+        return content
+
+    def read_file(self, filename) -> bytes:
+        with open(filename, "rb") as ifile:
+            return self.count(ifile.read())
+
 
+def _parse_keywords_in(ebuild_content: bytes) -> set[str]:
     match = _keywords_pattern.search(ebuild_content)
     if match is None:
-        ebuild_keywords = set()
-    else:
-        ebuild_keywords = match.group("keywords")
-        ebuild_keywords = {kw for kw in ebuild_keywords.split(" ") if kw}
+        return set()
+    ebuild_keywords = match.group("keywords").decode("utf-8")
+    return {kw for kw in ebuild_keywords.split(" ") if kw}
+
 
+def _get_relevant_keywords_set_for(
+    ebuild_keywords: set[str], accept_keywords: set[str]
+) -> set[str]:
     accept_keywords = _replace_special_keywords_for_ebuild(accept_keywords, ebuild_keywords)
 
     return set(accept_keywords) & set(ebuild_keywords)
 
 
-def iterate_new_and_changed_ebuilds(config):
-    for root, dirs, files in os.walk(config.new_portdir):
-        ebuild_files = [f for f in files if f.endswith(".ebuild")]
-        if not ebuild_files:
+class _Ebuild:
+    def __init__(self, fingerprint, content: bytes | None = None, keywords=None):
+        self.fingerprint = fingerprint  # i.e. either the content itself or a digest of it
+        self._content = content
+        if keywords is not None:
+            self.keywords = keywords
+
+    @cached_property
+    def keywords(self) -> set[str]:
+        return _parse_keywords_in(self._content)
+
+
+def _get_digest_of(content: bytes) -> str:
+    return hashlib.blake2b(content, digest_size=16).hexdigest()
+
+
+class _EbuildLoader:
+    """Reads pairs of old and new ebuilds (each at most once)
+
+    ...unless the keywords cache already knows them or ``--trust-stat`` allows skipping them.
+    """
+
+    def __init__(
+        self, config, read_statistics: ReadStatistics, keywords_cache: KeywordsCache | None
+    ):
+        self._config = config
+        self.read_statistics = read_statistics
+        self._keywords_cache = keywords_cache
+        self.category_manifests = _CategoryManifests(read_statistics)
+
+    def _load(self, portdir: str, relative_path: str) -> _Ebuild:
+        filename = os.path.join(portdir, relative_path)
+        if self._keywords_cache is None:
+            content = self.read_statistics.read_file(filename)
+            return _Ebuild(content, content)
+
+        stat = os.stat(filename)
+        cached = self._keywords_cache.get(relative_path, stat)
+        if cached is not None:
+            digest, keywords = cached
+            return _Ebuild(digest, keywords=keywords)
+
+        content = self.read_statistics.read_file(filename)
+        ebuild = _Ebuild(_get_digest_of(content), content)
+        self._keywords_cache.put(relative_path, stat, ebuild.fingerprint, ebuild.keywords)
+        return ebuild
+
+    def load_old_and_new(self, relative_path: str) -> tuple[_Ebuild | None, _Ebuild] | None:
+        """Load old (if any) and new ebuild, or return ``None`` if they are known identical"""
+        old_filename = os.path.join(self._config.old_portdir, relative_path)
+        new_filename = os.path.join(self._config.new_portdir, relative_path)
+        old_filename_exists = os.path.exists(old_filename)
+
+        # don't output if files are identical as far as size and modification time go
+        # (and the user has asked to trust that)
+        if (
+            self._config.trust_stat
+            and old_filename_exists
+            and _get_size_and_mtime_of(old_filename) == _get_size_and_mtime_of(new_filename)
+        ):
+            return None
+
+        new_ebuild = self._load(self._config.new_portdir, relative_path)
+        if old_filename_exists:
+            old_ebuild = self._load(self._config.old_portdir, relative_path)
+        else:
+            old_ebuild = None
+        return old_ebuild, new_ebuild
+
+
+class _SnapshotEbuildLoader:
+    """Reads new ebuilds (each at most once) to pair them up with entries of a snapshot
+
+    Along the way, it records a snapshot of the new tree.
+    """
+
+    def __init__(
+        self,
+        config,
+        read_statistics: ReadStatistics,
+        old_snapshot: TreeSnapshot,
+        new_snapshot: TreeSnapshot,
+    ):
+        self._config = config
+        self.read_statistics = read_statistics
+        self._old_snapshot = old_snapshot
+        self._new_snapshot = new_snapshot
+
+    def load_old_and_new(self, relative_path: str) -> tuple[_Ebuild | None, _Ebuild] | None:
+        """Load old (if any) and new ebuild, or return ``None`` if they are known identical"""
+        stat = os.stat(os.path.join(self._config.new_portdir, relative_path))
+        old_entry = self._old_snapshot.get(relative_path)
+
+        # don't output if files are identical as far as size and modification time go
+        # (and the user has asked to trust that)
+        if (
+            self._config.trust_stat
+            and old_entry is not None
+            and (old_entry.size, old_entry.mtime_ns) == (stat.st_size, stat.st_mtime_ns)
+        ):
+            self._new_snapshot.put(relative_path, old_entry)
+            return None
+
+        content = self.read_statistics.read_file(
+            os.path.join(self._config.new_portdir, relative_path)
+        )
+        new_ebuild = _Ebuild(_get_digest_of(content), content)
+        self._new_snapshot.put(
+            relative_path,
+            SnapshotEntry(
+                stat.st_size,
+                stat.st_mtime_ns,
+                new_ebuild.fingerprint,
+                frozenset(new_ebuild.keywords),
+            ),
+        )
+
+        if old_entry is None:
+            old_ebuild = None
+        else:
+            old_ebuild = _Ebuild(old_entry.digest, keywords=old_entry.keywords)
+        return old_ebuild, new_ebuild
+
+
+class _WatchEbuildLoader(_EbuildLoader):
+    """Reads pairs of old and new ebuilds, preferring the state seen in an earlier round as old
+
+    The new state of every ebuild that it reads goes into ``baseline`` so that
+    later rounds of watching do not report the same news again.
+    """
+
+    def __init__(
+        self,
+        config,
+        read_statistics: ReadStatistics,
+        keywords_cache: KeywordsCache | None,
+        baseline: TreeSnapshot,
+    ):
+        super().__init__(config, read_statistics, keywords_cache)
+        self._baseline = baseline
+
+    def _load(self, portdir: str, relative_path: str) -> _Ebuild:
+        ebuild = super()._load(portdir, relative_path)
+        if self._keywords_cache is None:  # i.e. the fingerprint is the content itself
+            ebuild.fingerprint = _get_digest_of(ebuild.fingerprint)
+        return ebuild
+
+    def load_old_and_new(self, relative_path: str) -> tuple[_Ebuild | None, _Ebuild] | None:
+        """Load old (if any) and new ebuild, or return ``None`` if they are known identical"""
+        stat = os.stat(os.path.join(self._config.new_portdir, relative_path))
+        baseline_entry = self._baseline.get(relative_path)
+
+        if baseline_entry is None:
+            ebuilds = super().load_old_and_new(relative_path)
+            if ebuilds is None:
+                return None
+            old_ebuild, new_ebuild = ebuilds
+        else:
+            # don't output if files are identical as far as size and modification time go
+            # (and the user has asked to trust that)
+            if self._config.trust_stat and (baseline_entry.size, baseline_entry.mtime_ns) == (
+                stat.st_size,
+                stat.st_mtime_ns,
+            ):
+                return None
+            old_ebuild = _Ebuild(baseline_entry.digest, keywords=baseline_entry.keywords)
+            new_ebuild = self._load(self._config.new_portdir, relative_path)
+
+        self._baseline.put(
+            relative_path,
+            SnapshotEntry(
+                stat.st_size,
+                stat.st_mtime_ns,
+                new_ebuild.fingerprint,
+                frozenset(new_ebuild.keywords),
+            ),
+        )
+        return old_ebuild, new_ebuild
+
+
+def _get_size_and_mtime_of(path: str) -> tuple[int, int]:
+    stat = os.stat(path)
+    return stat.st_size, stat.st_mtime_ns
+
+
+def _is_unchanged_package_directory(old_dir: str, new_dir: str, new_entries: list[str]) -> bool:
+    """Tell if both directories have the same mtime and list the very same entries
+
+    Since adding, removing or replacing (i.e. renaming over) a file bumps
+    the mtime of its directory, this is a cheap indicator that nothing in there changed
+    for trees that are copied with preserved mtimes, e.g. by ``rsync --archive``.
+    """
+    try:
+        if os.stat(old_dir).st_mtime_ns != os.stat(new_dir).st_mtime_ns:
+            return False
+        return sorted(os.listdir(old_dir)) == sorted(new_entries)
+    except FileNotFoundError:
+        return False
+
+
+class _CategoryManifests:
+    """Reads GLEP 74 category Manifests (``<category>/Manifest.gz``), each at most once
+
+    Trees synced by rsync from ::gentoo come with these, and they list size and hashes
+    of the ebuilds of all packages of the category, even where package Manifests are thin.
+    """
+
+    def __init__(self, read_statistics: ReadStatistics):
+        self._read_statistics = read_statistics
+        self._entries_of_package_of_category_dir: dict[str, dict[str, set[str]]] = {}
+        self._lock = Lock()
+
+    def _load(self, category_dir: str) -> dict[str, set[str]]:
+        try:
+            content = self._read_statistics.read_file(os.path.join(category_dir, "Manifest.gz"))
+        except FileNotFoundError:
+            return {}
+
+        entries_of_package = {}
+        for line in gzip.decompress(content).decode("utf-8").splitlines():
+            fields = line.split(" ")
+            if len(fields) < 2 or "/" not in fields[1]:
+                continue
+            package = fields[1].split("/")[0]
+            entries_of_package.setdefault(package, set()).add(line)
+        return entries_of_package
+
+    def get_entries_of(self, package_dir: str) -> set[str]:
+        category_dir, package = os.path.split(package_dir)
+        with self._lock:
+            if category_dir not in self._entries_of_package_of_category_dir:
+                self._entries_of_package_of_category_dir[category_dir] = self._load(category_dir)
+            return self._entries_of_package_of_category_dir[category_dir].get(package, set())
+
+
+def _is_unchanged_package_in_category_manifests(
+    category_manifests: _CategoryManifests, old_dir: str, new_dir: str, new_entries: list[str]
+) -> bool:
+    """Tell if both category Manifests list the same ebuilds for a package (and the same files)
+
+    Only category Manifests that cover all of the ebuilds allow for that conclusion.
+    """
+    new_manifest_entries = category_manifests.get_entries_of(new_dir)
+    package = os.path.basename(new_dir)
+    covered_paths = {entry.split(" ")[1] for entry in new_manifest_entries}
+    if not all(
+        f"{package}/{entry}" in covered_paths for entry in new_entries if entry.endswith(".ebuild")
+    ):
+        return False
+    if category_manifests.get_entries_of(old_dir) != new_manifest_entries:
+        return False
+    try:
+        return sorted(os.listdir(old_dir)) == sorted(new_entries)
+    except FileNotFoundError:
+        return False
+
+
+def _is_relevant_change_for(
+    config, accept_keywords: set[str], old_ebuild: _Ebuild | None, new_ebuild: _Ebuild
+) -> bool:
+    # don't output if the new ebuild doesn't contain the accept keywords
+    new_ebuild_relevant_keywords = _get_relevant_keywords_set_for(
+        new_ebuild.keywords, accept_keywords
+    )
+    if not new_ebuild_relevant_keywords:
+        return False
+
+    # don't output if both old and new file include the same keywords
+    # unless the user has asked for all changes
+    # (i.e., when unrelated keywords or other parts of the ebuild have changed)
+    if not config.pessimistic and old_ebuild is not None:
+        old_ebuild_relevant_keywords = _get_relevant_keywords_set_for(
+            old_ebuild.keywords, accept_keywords
+        )
+        if new_ebuild_relevant_keywords == old_ebuild_relevant_keywords:
+            return False
+
+    return True
+
+
+def _get_labels_of_relevant_change(
+    config, old_ebuild: _Ebuild | None, new_ebuild: _Ebuild
+) -> list[str | None]:
+    """List the labels of all keyword sets that a change is relevant to
+
+    Unlabeled keywords have label ``None``.
+    """
+    # don't output if files are identical
+    if old_ebuild is not None and old_ebuild.fingerprint == new_ebuild.fingerprint:
+        return []
+
+    return [
+        label
+        for label, accept_keywords in config.keywords.items()
+        if _is_relevant_change_for(config, accept_keywords, old_ebuild, new_ebuild)
+    ]
+
+
+def _iterate_new_and_changed_ebuilds_in_directory(config, ebuild_loader, root, dirs, files):
+    ebuild_files = sorted(f for f in files if f.endswith(".ebuild"))
+    if not ebuild_files:
+        return
+
+    category_plus_package = os.path.relpath(root, config.new_portdir)
+
+    if config.old_portdir is not None:  # i.e. not comparing against a snapshot
+        old_package_dir = os.path.join(config.old_portdir, category_plus_package)
+        if config.trust_stat and _is_unchanged_package_directory(
+            old_package_dir, root, dirs + files
+        ):
+            return
+
+        if _is_unchanged_package_in_category_manifests(
+            ebuild_loader.category_manifests, old_package_dir, root, dirs + files
+        ):
+            return
+
+    yield from _iterate_new_and_changed_ebuilds_among(
+        config, ebuild_loader, category_plus_package, ebuild_files
+    )
+
+
+def _iterate_new_and_changed_ebuilds_among(
+    config, ebuild_loader, category_plus_package: str, ebuild_files: list[str]
+):
+    package = category_plus_package.split(os.sep)[-1]
+
+    for ebuild_file in ebuild_files:
+        # don't output 9999 ebuilds
+        if re.search(_filename_9999_pattern, ebuild_file) is not None:
             continue
 
+        # NOTE: Each file is read at most once, both for comparison and keyword extraction
+        ebuilds = ebuild_loader.load_old_and_new(os.path.join(category_plus_package, ebuild_file))
+        if ebuilds is None:
+            continue
+
+        labels = _get_labels_of_relevant_change(config, *ebuilds)
+        if not labels:
+            continue
+
+        version = ebuild_file[len(package + "-") : -len(".ebuild")]
+        yield labels, f"{category_plus_package}-{version}"
+
+
+def _is_wanted_category(config, category: str) -> bool:
+    if category in _NON_CATEGORY_DIRS or category.startswith("."):
+        return False
+    return config.include is None or category in config.include_categories
+
+
+def _is_wanted_package(config, category_plus_package: str) -> bool:
+    if config.include is not None and category_plus_package not in config.include:
+        return False
+    return not any(
+        fnmatch.fnmatchcase(category_plus_package, pattern) for pattern in config.exclude
+    )
+
+
+def _is_wanted(config, cpv: str) -> bool:
+    if not _is_wanted_package(config, strip_version_from(cpv)):
+        return False
+    return not any(fnmatch.fnmatchcase(cpv, pattern) for pattern in config.exclude)
+
+
+def _iterate_new_and_changed_ebuilds_below(config, ebuild_loader, top):
+    for root, dirs, files in os.walk(top):
         category_plus_package = os.path.relpath(root, config.new_portdir)
-        package = category_plus_package.split(os.sep)[-1]
+        depth = 0 if category_plus_package == "." else category_plus_package.count(os.sep) + 1
 
-        for ebuild_file in ebuild_files:
-            old_portdir_ebuild_filepath = os.path.join(
-                config.old_portdir, category_plus_package, ebuild_file
+        # NOTE: Pruning dirs in place keeps os.walk from ever descending into them
+        if depth == 0:
+            dirs[:] = [d for d in dirs if _is_wanted_category(config, d)]
+        elif depth == 1:
+            dirs[:] = [
+                d for d in dirs if _is_wanted_package(config, f"{category_plus_package}/{d}")
+            ]
+        dirs.sort()  # for deterministic output
+
+        if depth == 2:
+            yield from _iterate_new_and_changed_ebuilds_in_directory(
+                config, ebuild_loader, root, dirs, files
             )
-            new_portdir_ebuild_filepath = os.path.join(root, ebuild_file)
+            dirs.clear()  # i.e. no need to descend into files/
+
+
+def _iterate_new_and_changed_ebuilds_in_changes(config, ebuild_loader, changes: TreeChanges):
+    """Yield ``(labels, cpv)`` of new and changed ebuilds among the changed files only"""
+    ebuild_files_of_package_dir: dict[str, list[str]] = {}
+    for relative_path in changes.changed:
+        path_components = relative_path.split("/")
+        if len(path_components) != 3 or not relative_path.endswith(".ebuild"):
+            continue
+        category, package, ebuild_file = path_components
+        category_plus_package = f"{category}/{package}"
+        if not _is_wanted_category(config, category) or not _is_wanted_package(
+            config, category_plus_package
+        ):
+            continue
+        if not os.path.exists(os.path.join(config.new_portdir, relative_path)):
+            continue  # i.e. changed by an earlier sync but gone since
+        ebuild_files_of_package_dir.setdefault(category_plus_package, []).append(ebuild_file)
+
+    for category_plus_package, ebuild_files in sorted(
+        ebuild_files_of_package_dir.items(), key=lambda item: item[0].split("/")
+    ):
+        yield from _iterate_new_and_changed_ebuilds_among(
+            config, ebuild_loader, category_plus_package, sorted(ebuild_files)
+        )
+
+
+def _iterate_new_and_changed_ebuilds_in_package_dirs(config, ebuild_loader, package_dirs):
+    """Yield ``(labels, cpv)`` of new and changed ebuilds below the given package dirs only"""
+    for category_plus_package in sorted(package_dirs, key=lambda d: d.split("/")):
+        category = category_plus_package.split("/")[0]
+        if not _is_wanted_category(config, category) or not _is_wanted_package(
+            config, category_plus_package
+        ):
+            continue
+
+        root = os.path.join(config.new_portdir, category_plus_package)
+        try:
+            entries = list(os.scandir(root))
+        except FileNotFoundError:
+            continue  # i.e. package removed
+        dirs = sorted(entry.name for entry in entries if entry.is_dir())
+        files = sorted(entry.name for entry in entries if not entry.is_dir())
+
+        yield from _iterate_new_and_changed_ebuilds_in_directory(
+            config, ebuild_loader, root, dirs, files
+        )
+
+
+class _GitBlobReader:
+    """Reads blobs through a single long-running ``git cat-file --batch`` process"""
+
+    def __init__(self, git_dir: str, read_statistics: ReadStatistics):
+        self._read_statistics = read_statistics
+        self._process = subprocess.Popen(
+            ["git", "-C", git_dir, "cat-file", "--batch"],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self._process.stdin.close()
+        self._process.stdout.close()
+        self._process.wait()
+
+    def read_blob(self, object_id: str) -> bytes:
+        self._process.stdin.write(f"{object_id}\n".encode("ascii"))
+        self._process.stdin.flush()
+
+        header = self._process.stdout.readline().decode("ascii").split()
+        if len(header) != 3 or header[1] != "blob":
+            raise ValueError(f"Git object {object_id!r} is not an available blob")
+        content = self._process.stdout.read(int(header[2]))
+        self._process.stdout.read(1)  # i.e. the trailing newline
+
+        return self._read_statistics.count(content)
+
+
+def _is_null_object_id(object_id: str) -> bool:
+    return not object_id.strip("0")
+
+
+def _list_changed_ebuilds_in_git(config) -> list[tuple[str, str, str]]:
+    """List ``(path, old_object_id, new_object_id)`` of ebuilds that were added or modified
+
+    A new object ID of all zeros denotes a file of the working tree.
+    """
+    argv = ["git", "-C", config.portdir, "diff", "--raw", "-z", "--no-abbrev", "--no-renames"]
+    argv.append(config.old_rev)
+    if config.new_rev is not None:
+        argv.append(config.new_rev)
+    argv += ["--", "*.ebuild"]
+
+    fields = subprocess.check_output(argv).decode("utf-8").split("\0")
+    changes = []
+    for meta, path in zip(fields[0:-1:2], fields[1::2]):
+        _old_mode, _new_mode, old_object_id, new_object_id, status = meta[1:].split(" ")
+        if status == "D" or len(path.split("/")) != 3:  # i.e. only <cat>/<pkg>/<pf>.ebuild
+            continue
+        # don't output ebuilds with changes of mode only
+        if old_object_id == new_object_id and not _is_null_object_id(new_object_id):
+            continue
+        changes.append((path, old_object_id, new_object_id))
+
+    return sorted(changes, key=lambda change: change[0].split("/"))  # i.e. like os.walk
+
+
+def _iterate_new_and_changed_ebuilds_in_git(config, read_statistics):
+    changes = _list_changed_ebuilds_in_git(config)
+    if not changes:
+        return
+
+    with _GitBlobReader(config.portdir, read_statistics) as blob_reader:
+        for path, old_object_id, new_object_id in changes:
+            category, package, ebuild_file = path.split("/")
 
             # don't output 9999 ebuilds
             if re.search(_filename_9999_pattern, ebuild_file) is not None:
                 continue
 
-            # don't output if files are identical
-            # old_portdir_ebuild_filepath_exists = os.path.exists(old_portdir_ebuild_filepath)
-            # if old_portdir_ebuild_filepath_exists:
-            if os.path.exists(old_portdir_ebuild_filepath):
-                if filecmp.cmp(
-                    old_portdir_ebuild_filepath,
-                    new_portdir_ebuild_filepath,
-                    shallow=False,
-                ):
-                    continue
+            if _is_null_object_id(new_object_id):
+                new_content = read_statistics.read_file(os.path.join(config.portdir, path))
+            else:
+                new_content = blob_reader.read_blob(new_object_id)
+            new_ebuild = _Ebuild(new_content, new_content)
 
-            # don't output if the new ebuild doesn't contain the accept keywords
-            new_ebuild_relevant_keywords = _get_relevant_keywords_set_for(
-                new_portdir_ebuild_filepath, config.keywords
-            )
-            if not new_ebuild_relevant_keywords:
+            if _is_null_object_id(old_object_id):
+                old_ebuild = None
+            else:
+                old_content = blob_reader.read_blob(old_object_id)
+                old_ebuild = _Ebuild(old_content, old_content)
+
+            labels = _get_labels_of_relevant_change(config, old_ebuild, new_ebuild)
+            if not labels:
                 continue
 
-            # don't output if both old and new file include the same keywords
-            # unless the user has asked for all changes
-            # (i.e., when unrelated keywords or other parts of the ebuild have changed)
-            # if not config.pessimistic and old_portdir_ebuild_filepath_exists:
-            if not config.pessimistic and os.path.exists(old_portdir_ebuild_filepath):
-                old_ebuild_relevant_keywords = _get_relevant_keywords_set_for(
-                    old_portdir_ebuild_filepath, config.keywords
-                )
-                if new_ebuild_relevant_keywords == old_ebuild_relevant_keywords:
+            version = ebuild_file[len(package + "-") : -len(".ebuild")]
+            yield labels, f"{category}/{package}-{version}"
+
+
+def _load_md5_cache_entry(read_statistics: ReadStatistics, filename: str) -> _Ebuild:
+    """Load an entry of ``metadata/md5-cache`` as a stand-in for the ebuild it describes
+
+    Since an entry carries both the MD5 sum of its ebuild and the MD5 sums of all
+    inherited eclasses, those are all that need comparing to detect relevant changes.
+    """
+    entry = parse_md5_cache_entry(read_statistics.read_file(filename).decode("utf-8"))
+    return _Ebuild(
+        fingerprint=(entry.get("_md5_"), entry.get("_eclasses_")),
+        keywords={kw for kw in entry.get("KEYWORDS", "").split(" ") if kw},
+    )
+
+
+def _iterate_new_and_changed_ebuilds_in_md5_cache_category(config, read_statistics, category):
+    old_category_dir = os.path.join(config.old_portdir, _MD5_CACHE_DIR, category)
+    new_category_dir = os.path.join(config.new_portdir, _MD5_CACHE_DIR, category)
+
+    for pf in sorted(os.listdir(new_category_dir)):
+        # don't output 9999 ebuilds
+        if re.search(_filename_9999_pattern, f"{pf}.ebuild") is not None:
+            continue
+
+        if not _is_wanted(config, f"{category}/{pf}"):
+            continue
+
+        old_filename = os.path.join(old_category_dir, pf)
+        new_filename = os.path.join(new_category_dir, pf)
+
+        # don't output if entries are identical as far as size and modification time go
+        # (and the user has asked to trust that)
+        if config.trust_stat:
+            with suppress(FileNotFoundError):
+                if _get_size_and_mtime_of(old_filename) == _get_size_and_mtime_of(new_filename):
                     continue
 
-            version = ebuild_file[len(package + "-") : -len(".ebuild")]
-            yield f"{category_plus_package}-{version}"
+        new_ebuild = _load_md5_cache_entry(read_statistics, new_filename)
+        try:
+            old_ebuild = _load_md5_cache_entry(read_statistics, old_filename)
+        except FileNotFoundError:
+            old_ebuild = None
+
+        labels = _get_labels_of_relevant_change(config, old_ebuild, new_ebuild)
+        if not labels:
+            continue
+
+        yield labels, f"{category}/{pf}"
+
+
+def _iterate_new_and_changed_ebuilds_in_md5_cache(config, read_statistics):
+    try:
+        categories = sorted(os.listdir(os.path.join(config.new_portdir, _MD5_CACHE_DIR)))
+    except FileNotFoundError:
+        raise ValueError(f"Portdir {config.new_portdir!r} lacks directory {_MD5_CACHE_DIR!r}")
+    categories = [category for category in categories if _is_wanted_category(config, category)]
+
+    def list_new_and_changed_ebuilds_in(category):
+        return list(
+            _iterate_new_and_changed_ebuilds_in_md5_cache_category(
+                config, read_statistics, category
+            )
+        )
+
+    with ThreadPoolExecutor(max_workers=config.jobs) as executor:
+        for labeled_cpvs in executor.map(list_new_and_changed_ebuilds_in, categories):
+            yield from labeled_cpvs
+
+
+def iterate_labeled_new_and_changed_ebuilds(
+    config,
+    read_statistics: ReadStatistics | None = None,
+    keywords_cache: KeywordsCache | None = None,
+    new_snapshot: TreeSnapshot | None = None,
+):
+    """Yield ``(labels, cpv)`` of new and changed ebuilds
+
+    ...where ``labels`` lists the labels of the keyword sets that the ebuild is relevant to.
+    When comparing against a snapshot, ``new_snapshot`` (if given)
+    is filled with a snapshot of the new tree along the way.
+    """
+    if read_statistics is None:
+        read_statistics = ReadStatistics()
+
+    if config.git:
+        yield from _iterate_new_and_changed_ebuilds_in_git(config, read_statistics)
+        return
+
+    if config.md5_cache:
+        yield from _iterate_new_and_changed_ebuilds_in_md5_cache(config, read_statistics)
+        return
+
+    changes = None if config.changes_from is None else TreeChanges.load(config.changes_from)
+
+    if config.snapshot is not None:
+        old_snapshot = TreeSnapshot.load(config.snapshot)
+        if new_snapshot is None:
+            new_snapshot = TreeSnapshot()
+        if changes is not None:
+            # NOTE: Only changed ebuilds are visited, so all others carry over unchanged
+            new_snapshot.update(old_snapshot)
+            for relative_path in changes.deleted:
+                new_snapshot.remove(relative_path)
+        else:
+            # NOTE: Packages pruned by --include-file or --exclude are never visited,
+            #       so their entries carry over unchanged
+            for relative_path in old_snapshot:
+                category, package = relative_path.split("/")[:2]
+                if not _is_wanted_category(config, category) or not _is_wanted_package(
+                    config, f"{category}/{package}"
+                ):
+                    new_snapshot.put(relative_path, old_snapshot.get(relative_path))
+        ebuild_loader = _SnapshotEbuildLoader(config, read_statistics, old_snapshot, new_snapshot)
+    else:
+        ebuild_loader = _EbuildLoader(config, read_statistics, keywords_cache)
+
+    if changes is not None:
+        yield from _iterate_new_and_changed_ebuilds_in_changes(config, ebuild_loader, changes)
+        return
+
+    if config.jobs == 1:
+        yield from _iterate_new_and_changed_ebuilds_below(
+            config, ebuild_loader, config.new_portdir
+        )
+        return
+
+    # NOTE: Categories are processed in parallel but yielded in the very same order
+    #       as in serial mode, so that output is identical for any number of jobs
+    categories = [
+        category
+        for category in next(os.walk(config.new_portdir))[1]
+        if _is_wanted_category(config, category)
+    ]
+
+    def list_new_and_changed_ebuilds_below(category_dir):
+        return list(
+            _iterate_new_and_changed_ebuilds_below(
+                config, ebuild_loader, os.path.join(config.new_portdir, category_dir)
+            )
+        )
+
+    with ThreadPoolExecutor(max_workers=config.jobs) as executor:
+        for labeled_cpvs in executor.map(list_new_and_changed_ebuilds_below, sorted(categories)):
+            yield from labeled_cpvs
+
+
+def _list_changed_eclasses(config, read_statistics: ReadStatistics) -> list[str]:
+    """List eclasses that were added to or modified in the new portdir"""
+    changed_eclasses = []
+    new_eclass_dir = os.path.join(config.new_portdir, _ECLASS_DIR)
+    for filename in sorted(os.listdir(new_eclass_dir)):
+        if not filename.endswith(".eclass"):
+            continue
+        new_content = read_statistics.read_file(os.path.join(new_eclass_dir, filename))
+        try:
+            old_content = read_statistics.read_file(
+                os.path.join(config.old_portdir, _ECLASS_DIR, filename)
+            )
+        except FileNotFoundError:
+            old_content = None
+        if old_content != new_content:
+            changed_eclasses.append(filename[: -len(".eclass")])
+    return changed_eclasses
+
+
+def iterate_ebuilds_affected_by_eclass_changes(
+    config, eclass_index_filename: str, read_statistics: ReadStatistics | None = None
+):
+    """Yield ``(labels, cpv)`` of ebuilds that inherit an eclass that changed
+
+    ...where ``labels`` lists the labels of the keyword sets that the ebuild is relevant to.
+    The eclass index file is only loaded and updated (from the new portdir's md5-cache)
+    if any eclasses changed at all.
+    """
+    if read_statistics is None:
+        read_statistics = ReadStatistics()
+
+    changed_eclasses = _list_changed_eclasses(config, read_statistics)
+    if not changed_eclasses:
+        return
+
+    md5_cache_dir = os.path.join(config.new_portdir, _MD5_CACHE_DIR)
+    if not os.path.isdir(md5_cache_dir):
+        raise ValueError(f"Portdir {config.new_portdir!r} lacks directory {_MD5_CACHE_DIR!r}")
+    eclass_index = EclassIndex.load(eclass_index_filename)
+    eclass_index.update(md5_cache_dir)
+    eclass_index.save(eclass_index_filename)
+
+    keywords_of_cpv = {}
+    for eclass in changed_eclasses:
+        for cpv, keywords in eclass_index.iterate_inheriting(eclass):
+            keywords_of_cpv[cpv] = keywords
+
+    for cpv in sorted(keywords_of_cpv, key=lambda cpv: cpv.split("/")):
+        # don't output 9999 ebuilds
+        if re.search(_filename_9999_pattern, f"{cpv}.ebuild") is not None:
+            continue
+
+        labels = [
+            label
+            for label, accept_keywords in config.keywords.items()
+            if _get_relevant_keywords_set_for(keywords_of_cpv[cpv], accept_keywords)
+        ]
+        if labels:
+            yield labels, cpv
+
+
+def iterate_new_and_changed_ebuilds(config, *args, **kwargs):
+    """Yield CPVs of new and changed ebuilds, relevant to any of the keyword sets"""
+    for _labels, cpv in iterate_labeled_new_and_changed_ebuilds(config, *args, **kwargs):
+        yield cpv
+
+
+def push_to_queue(config, cpvs: list[str]):
+    with file_based_interprocess_locking(f"{config.push_to}.lock"):
+        q = PriorityQueue.load(config.push_to)
+        for cpv in cpvs:
+            q.push(config.priority, f"={cpv}")
+        q.save(config.push_to)
+
+
+def _print_labeled_cpvs(config, labeled_cpvs) -> list[str]:
+    """Print wanted CPVs (prefixed by label, if any) once per label, return them in order"""
+    reported_labels_of_cpv: dict[str, set[str | None]] = {}  # i.e. ordered by first report
+
+    for labels, cpv in labeled_cpvs:
+        if not _is_wanted(config, cpv):
+            continue
+        reported_labels = reported_labels_of_cpv.setdefault(cpv, set())
+        for label in labels:
+            if label in reported_labels:
+                continue  # e.g. both changed itself and affected by an eclass change
+            reported_labels.add(label)
+            print(cpv if label is None else f"{label} {cpv}")
+
+    return list(reported_labels_of_cpv)
+
+
+def _print_statistics(read_statistics: ReadStatistics, keywords_cache: KeywordsCache | None):
+    print(
+        f"{read_statistics.files_read} file(s) read, {read_statistics.bytes_read} bytes",
+        file=sys.stderr,
+    )
+    if keywords_cache is not None:
+        print(
+            f"{keywords_cache.hits} keywords cache hit(s), {keywords_cache.misses} miss(es)",
+            file=sys.stderr,
+        )
 
 
 def report_new_and_changed_ebuilds(config):
-    for cpv in iterate_new_and_changed_ebuilds(config):
-        print(cpv)
+    read_statistics = ReadStatistics()
+    if config.keywords_cache is None:
+        keywords_cache = None
+    else:
+        keywords_cache = KeywordsCache.load(config.keywords_cache, config.keywords_cache_size)
+
+    new_snapshot = TreeSnapshot()
+
+    labeled_cpvs = iterate_labeled_new_and_changed_ebuilds(
+        config, read_statistics, keywords_cache, new_snapshot
+    )
+    if config.eclass_impact is not None:
+        labeled_cpvs = itertools.chain(
+            labeled_cpvs,
+            iterate_ebuilds_affected_by_eclass_changes(
+                config, config.eclass_impact, read_statistics
+            ),
+        )
+
+    wanted_cpvs = _print_labeled_cpvs(config, labeled_cpvs)
+
+    # NOTE: The queue is only locked once the (potentially long) comparison is complete
+    if config.push_to is not None:
+        push_to_queue(config, wanted_cpvs)
+
+    if keywords_cache is not None:
+        keywords_cache.save(config.keywords_cache)
+
+    if config.update_snapshot:
+        new_snapshot.save(config.snapshot)
+
+    if config.stats:
+        _print_statistics(read_statistics, keywords_cache)
+
+
+def watch_new_and_changed_ebuilds(config, tree_watcher=None, max_rounds: int | None = None):
+    """Report new and changed ebuilds as changes to the new portdir come in, round by round
+
+    Each round waits for changes to settle and then compares
+    only the package directories that saw changes against the old portdir,
+    or rather against what earlier rounds have already seen of them.
+    """
+    if config.keywords_cache is None:
+        keywords_cache = None
+    else:
+        keywords_cache = KeywordsCache.load(config.keywords_cache, config.keywords_cache_size)
+
+    if tree_watcher is None:
+        tree_watcher = create_tree_watcher(config.new_portdir, config.settle)
+
+    baseline = TreeSnapshot()  # i.e. ebuilds as seen by earlier rounds
+
+    with tree_watcher:
+        rounds = itertools.count() if max_rounds is None else range(max_rounds)
+        for _ in rounds:
+            dirty_package_dirs = tree_watcher.wait_for_dirty_package_dirs(config.settle)
+
+            read_statistics = ReadStatistics()
+            ebuild_loader = _WatchEbuildLoader(config, read_statistics, keywords_cache, baseline)
+            wanted_cpvs = _print_labeled_cpvs(
+                config,
+                _iterate_new_and_changed_ebuilds_in_package_dirs(
+                    config, ebuild_loader, dirty_package_dirs
+                ),
+            )
+            sys.stdout.flush()  # i.e. stream results when piped
+
+            if config.push_to is not None and wanted_cpvs:
+                push_to_queue(config, wanted_cpvs)
+
+            if keywords_cache is not None:
+                keywords_cache.save(config.keywords_cache)
+
+            if config.stats:
+                _print_statistics(read_statistics, keywords_cache)
 
 
 def enrich_config(config):
     if config.keywords is None:
-        config.keywords = announce_and_check_output(
-            ["portageq", "envvar", "ACCEPT_KEYWORDS"]
-        ).rstrip()
-    if not config.keywords:
-        raise ValueError("At least one keyword must be specified")
+        config.keywords = [
+            announce_and_check_output(["portageq", "envvar", "ACCEPT_KEYWORDS"]).rstrip()
+        ]
+
+    keyword_sets = {}
+    for labeled_keywords in config.keywords:
+        if "=" in labeled_keywords:
+            label, keywords = labeled_keywords.split("=", maxsplit=1)
+        else:
+            label, keywords = None, labeled_keywords
+        keywords = {kw for kw in keywords.split(" ") if kw}
+        if not keywords:
+            raise ValueError("At least one keyword must be specified")
+        if label in keyword_sets:
+            raise ValueError(f"Keyword set label {label!r} is used more than once")
+        keyword_sets[label] = keywords
+
+    if len(keyword_sets) > 1 and None in keyword_sets:
+        raise ValueError("Multiple keyword sets need a label each, e.g. amd64-stable=amd64")
+
+    if config.jobs < 1:
+        raise ValueError("Number of jobs must be at least 1")
+
+    if config.keywords_cache_size < 1:
+        raise ValueError("Keywords cache size must be at least 1")
+
+    if config.settle <= 0:
+        raise ValueError("Settle time must be positive")
+
+    if config.include_file is None:
+        config.include = None
+    else:
+        with open(config.include_file) as f:
+            config.include = {line.strip() for line in f if line.strip()}
+        config.include_categories = {
+            category_plus_package.split("/")[0] for category_plus_package in config.include
+        }
 
     # add stable keywords for testing keywords
-    config.keywords = {kw for kw in config.keywords.split(" ") if kw}
-    config.keywords |= {k[1:] for k in config.keywords if k.startswith("~") and not k == "~*"}
+    for keywords in keyword_sets.values():
+        keywords |= {k[1:] for k in keywords if k.startswith("~") and not k == "~*"}
+    config.keywords = keyword_sets
 
     return config
 
@@ -129,9 +997,15 @@ def parse_command_line(argv):
 
     parser.add_argument(
         "--keywords",
+        metavar="[LABEL=]KEYWORDS",
+        action="append",
         required=not HOST_IS_GENTOO,
         help="include only packages/versions/revisions that have these keywords; "
-        "in case of multiple keywords a space-separated list can be provided"
+        "in case of multiple keywords a space-separated list can be provided; "
+        "can be passed multiple times with a distinct label each "
+        "(e.g. amd64-stable=amd64 and amd64-testing=~amd64) "
+        "to compare for multiple keyword sets at once, reading files only once, "
+        'with output lines prefixed by the label (i.e. "LABEL CPV")'
         f"{' (default: auto-detect using portageq)' if HOST_IS_GENTOO else ''}",
     )
 
@@ -144,13 +1018,222 @@ def parse_command_line(argv):
         "existing ebuilds when relevant keywords have been added)",
     )
 
-    parser.add_argument("old_portdir", metavar="OLD", help="location of old portdir")
-    parser.add_argument("new_portdir", metavar="NEW", help="location of new portdir")
+    parser.add_argument(
+        "--md5-cache",
+        default=False,
+        action="store_true",
+        help="take keywords and change detection from metadata/md5-cache "
+        "rather than from ebuilds; more accurate for keywords set by eclasses or "
+        "spanning multiple lines, and catches eclass changes "
+        "(default: parse KEYWORDS from ebuilds)",
+    )
+
+    parser.add_argument(
+        "--snapshot",
+        metavar="FILE",
+        help="compare portdir NEW against a snapshot file of an old state of it "
+        "rather than against a copy of the old portdir; "
+        "a missing snapshot file is treated as empty (default: compare two portdirs)",
+    )
+
+    parser.add_argument(
+        "--update-snapshot",
+        default=False,
+        action="store_true",
+        help="after comparison, atomically replace the snapshot file "
+        "by a snapshot of portdir NEW (default: leave the snapshot file untouched)",
+    )
+
+    parser.add_argument(
+        "--eclass-impact",
+        metavar="FILE",
+        help="also report ebuilds that inherit any eclass that changed, "
+        "resolved through a reverse index from eclasses to ebuilds "
+        "that is built from metadata/md5-cache of NEW, "
+        "kept in FILE and updated incrementally (default: ignore eclass changes)",
+    )
+
+    parser.add_argument(
+        "--trust-stat",
+        default=False,
+        action="store_true",
+        help="consider ebuilds of identical size and modification time unchanged, "
+        "and skip package directories of identical modification time and listing, "
+        "without comparing file content; only safe for trees synced with preserved "
+        "modification times, e.g. by rsync --archive (default: compare file content)",
+    )
+
+    parser.add_argument(
+        "--changes-from",
+        metavar="FILE",
+        help="compare only ebuilds listed as changed in FILE, "
+        "as written by gentoo-tree-sync --changes-out, rather than walking the whole tree "
+        "(default: walk the whole tree)",
+    )
+
+    parser.add_argument(
+        "--watch",
+        default=False,
+        action="store_true",
+        help="keep running and watch portdir NEW for changes (through inotify where available, "
+        "by polling otherwise); whenever changes have settled, compare only the package "
+        "directories that saw changes, and report (or push) news right away "
+        "(default: compare once and exit)",
+    )
+
+    parser.add_argument(
+        "--settle",
+        type=float,
+        default=5.0,
+        metavar="SECONDS",
+        help="with --watch, wait for SECONDS without further changes "
+        "before comparing (default: %(default)s)",
+    )
+
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=1,
+        metavar="N",
+        help="compare up to N categories in parallel (default: %(default)s)",
+    )
+
+    parser.add_argument(
+        "--keywords-cache",
+        metavar="FILE",
+        help="remember KEYWORDS and content digests of ebuilds across runs in FILE, "
+        "keyed by path, inode, size and times of the file, to save on reading ebuilds "
+        "(default: no cache)",
+    )
+
+    parser.add_argument(
+        "--keywords-cache-size",
+        type=int,
+        default=250_000,
+        metavar="N",
+        help="keep up to N least recently used ebuilds in the keywords cache "
+        "(default: %(default)s)",
+    )
+
+    parser.add_argument(
+        "--include-file",
+        metavar="FILE",
+        help="include only packages listed in FILE, one <category>/<package> per line, "
+        "e.g. as generated by: EIX_LIMIT=0 eix -I --only-names; other packages are not even "
+        "read (default: include all packages)",
+    )
+
+    parser.add_argument(
+        "--exclude",
+        metavar="GLOB",
+        action="append",
+        default=[],
+        help="exclude packages whose <category>/<package> or <category>/<package>-<version> "
+        "matches GLOB, e.g. 'sys-kernel/*' or '*-bin'; excluded packages are not even read; "
+        "can be passed multiple times (default: exclude nothing)",
+    )
+
+    parser.add_argument(
+        "--push-to",
+        metavar="STATEFILE",
+        help="push news as =<category>/<package>-<version> atoms "
+        "onto the gentoo-local-queue build queue at STATEFILE, all at once "
+        "(default: only list news)",
+    )
+
+    parser.add_argument(
+        "--priority",
+        type=float,
+        metavar="PRIORITY",
+        help="task priority for --push-to (float, smallest priority wins)",
+    )
+
+    parser.add_argument(
+        "--stats",
+        default=False,
+        action="store_true",
+        help="report the number of files and bytes read to stderr (default: do not report)",
+    )
+
+    parser.add_argument(
+        "--git",
+        default=False,
+        action="store_true",
+        help="compare two revisions of a git checkout of a portdir rather than two portdirs, "
+        "i.e. interpret OLD and NEW as revisions (default: compare two portdirs)",
+    )
+
+    parser.add_argument(
+        "--portdir",
+        default=".",
+        metavar="DIR",
+        help="location of the git checkout to compare revisions of, for --git "
+        "(default: current working directory)",
+    )
+
+    parser.add_argument(
+        "old_portdir",
+        metavar="OLD",
+        help="location of old portdir (or old revision for --git; "
+        "or rather location of new portdir for --snapshot)",
+    )
+    parser.add_argument(
+        "new_portdir",
+        metavar="NEW",
+        nargs="?",
+        help="location of new portdir (or new revision for --git, "
+        "default for --git: the working tree)",
+    )
 
     config = parser.parse_args(argv[1:])
 
-    config.old_portdir = os.path.realpath(config.old_portdir)
-    config.new_portdir = os.path.realpath(config.new_portdir)
+    if config.md5_cache and (config.git or config.keywords_cache is not None):
+        parser.error("argument --md5-cache: not allowed with --git or --keywords-cache")
+
+    if (config.push_to is None) != (config.priority is None):
+        parser.error("arguments --push-to and --priority: require each other")
+
+    if config.update_snapshot and config.snapshot is None:
+        parser.error("argument --update-snapshot: requires --snapshot")
+
+    if config.eclass_impact is not None and (config.git or config.snapshot is not None):
+        parser.error("argument --eclass-impact: not allowed with --git or --snapshot")
+
+    if config.watch and (
+        config.git
+        or config.md5_cache
+        or config.snapshot is not None
+        or config.eclass_impact is not None
+    ):
+        parser.error(
+            "argument --watch: not allowed with --git, --md5-cache, --snapshot or --eclass-impact"
+        )
+
+    if config.changes_from is not None and (config.git or config.md5_cache or config.watch):
+        parser.error("argument --changes-from: not allowed with --git, --md5-cache or --watch")
+
+    if config.snapshot is not None:
+        if config.git or config.md5_cache or config.keywords_cache is not None:
+            parser.error(
+                "argument --snapshot: not allowed with --git, --md5-cache or --keywords-cache"
+            )
+        if config.new_portdir is not None:
+            parser.error("argument --snapshot: only a single portdir (NEW) is allowed")
+        config.old_portdir, config.new_portdir = None, os.path.realpath(config.old_portdir)
+    elif config.git:
+        if config.trust_stat or config.keywords_cache is not None:
+            parser.error("argument --git: not allowed with --trust-stat or --keywords-cache")
+        config.old_rev, config.new_rev = config.old_portdir, config.new_portdir
+        config.old_portdir = config.new_portdir = None
+        config.portdir = os.path.realpath(config.portdir)
+    else:
+        if config.new_portdir is None:
+            parser.error("the following arguments are required: NEW")
+        config.old_portdir = os.path.realpath(config.old_portdir)
+        config.new_portdir = os.path.realpath(config.new_portdir)
+
+    if config.push_to is not None:
+        config.push_to = os.path.realpath(config.push_to)
 
     return config
 
@@ -159,4 +1242,7 @@ def main():
     with exception_reporting():
         config = parse_command_line(sys.argv)
         enrich_config(config)
-        report_new_and_changed_ebuilds(config)
+        if config.watch:
+            watch_new_and_changed_ebuilds(config)
+        else:
+            report_new_and_changed_ebuilds(config)
@@ -2,17 +2,24 @@
 # Licensed under GNU Affero GPL version 3 or later
 
 import os
+import re
 import shlex
+import shutil
 import sys
 from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
 
-from ..reporter import announce_and_call, exception_reporting
+from ..reporter import announce_and_call, announce_and_check_output, exception_reporting
+from ..tree_changes import TreeChanges
 from ._parser import (
     add_docker_image_argument_to,
     add_interactive_argument_to,
     add_version_argument_to,
 )
 
+_DEFAULT_GIT_URL = "https://github.com/gentoo-mirror/gentoo.git"
+
 
 def parse_command_line(argv):
     parser = ArgumentParser(
@@ -41,17 +48,123 @@ def parse_command_line(argv):
         help=(
             "location to backup original state of PORTDIR to"
             ' (e.g. "/var/db/repos/gentoo-old" or "/usr/portage-old")'
-            ' prior to synchronisation (using "rsync --archive --delete [..]")'
+            ' prior to synchronisation (using "rsync --archive --delete [..]" on the host)'
         ),
     )
 
+    parser.add_argument(
+        "--backup-snapshots-to",
+        dest="host_backup_snapshots_dir",
+        metavar="DIR",
+        help=(
+            "location to backup original state of PORTDIR to"
+            " prior to synchronisation, as a new snapshot directory named by UTC timestamp"
+            ' (e.g. "20211231T235959Z") below DIR, with unchanged files hardlinked'
+            ' to the previous snapshot (using "rsync --archive --link-dest [..]" on the host),'
+            " so that a snapshot costs little more than metadata"
+        ),
+    )
+
+    parser.add_argument(
+        "--keep",
+        type=int,
+        metavar="N",
+        help="with --backup-snapshots-to, remove all but the N most recent snapshots"
+        " (default: keep all snapshots)",
+    )
+
+    parser.add_argument(
+        "--staging-dir",
+        dest="host_staging_portdir",
+        metavar="DIR",
+        help=(
+            "synchronise into DIR rather than into PORTDIR, concurrently with the backup,"
+            " and only then bring PORTDIR in line with DIR"
+            ' (using "rsync --archive --delete [..]"),'
+            " so that backup and synchronisation overlap;"
+            " DIR is kept around so that it is only ever updated incrementally"
+            " (default: backup first, then synchronise PORTDIR in place)"
+        ),
+    )
+
+    parser.add_argument(
+        "--changes-out",
+        metavar="FILE",
+        help=(
+            "write the paths of files (relative to PORTDIR) that synchronisation"
+            " changed, added or deleted to FILE, for use with"
+            ' "gentoo-tree-diff --changes-from FILE"'
+            " (taken from the itemized changes of the final rsync with --staging-dir,"
+            " from git with --method git,"
+            " or from comparing file size and modification time before and after otherwise;"
+            " default: do not record changes)"
+        ),
+    )
+
+    parser.add_argument(
+        "--method",
+        choices=["webrsync", "git"],
+        default="webrsync",
+        help=(
+            'synchronise using "emerge-webrsync" in a Docker container,'
+            " or by fetching and fast-forwarding a git clone of PORTDIR on the host,"
+            " transferring only what changed; the git commit IDs before and after"
+            " are reported and recorded with --changes-out (default: %(default)s)"
+        ),
+    )
+
+    parser.add_argument(
+        "--git-url",
+        default=_DEFAULT_GIT_URL,
+        metavar="URL",
+        help="with --method git, the repository to clone from and fetch from"
+        ' (default: "%(default)s")',
+    )
+
+    parser.add_argument(
+        "--depth",
+        type=int,
+        metavar="N",
+        help="with --method git, clone and fetch shallowly, i.e. only the N most recent commits"
+        " (default: full history)",
+    )
+
     config = parser.parse_args(argv[1:])
 
+    if config.method == "git":
+        if config.host_staging_portdir is not None:
+            parser.error("argument --staging-dir: not allowed with --method git")
+    elif config.depth is not None:
+        parser.error("argument --depth: requires --method git")
+
+    if config.depth is not None and config.depth < 1:
+        parser.error("argument --depth: must be at least 1")
+
+    if config.host_backup_portdir is not None and config.host_backup_snapshots_dir is not None:
+        parser.error("argument --backup-snapshots-to: not allowed with --backup-to")
+
+    if config.keep is not None:
+        if config.host_backup_snapshots_dir is None:
+            parser.error("argument --keep: requires --backup-snapshots-to")
+        if config.keep < 1:
+            parser.error("argument --keep: must be at least 1")
+
     config.host_portdir = os.path.realpath(config.host_portdir)
 
     if config.host_backup_portdir is not None:
         config.host_backup_portdir = os.path.realpath(config.host_backup_portdir)
 
+    if config.host_backup_snapshots_dir is not None:
+        config.host_backup_snapshots_dir = os.path.realpath(config.host_backup_snapshots_dir)
+
+    if config.host_staging_portdir is not None:
+        config.host_staging_portdir = os.path.realpath(config.host_staging_portdir)
+        if config.host_staging_portdir == config.host_portdir:
+            parser.error("argument --staging-dir: must differ from PORTDIR")
+
+    if config.changes_out is not None:
+        config.changes_out = os.path.realpath(config.changes_out)
+
     return config
 
 
@@ -59,28 +172,91 @@ def _with_trailing_slash(text):
     return text.rstrip("/") + "/"
 
 
-def sync(config):
-    container_portdir = "/usr/portage"
-    container_backup_portdir = "/mnt/portage-backup"
+_SNAPSHOT_NAME_FORMAT = "%Y%m%dT%H%M%SZ"
+_snapshot_name_pattern = re.compile("^[0-9]{8}T[0-9]{6}Z$")
+_INCOMPLETE_SNAPSHOT_NAME = ".incomplete"  # i.e. never matched by _snapshot_name_pattern
 
-    container_command = [
-        "set -x",
+
+def _list_snapshot_names_in(snapshots_dir) -> list[str]:
+    """List the names of the snapshots in ``snapshots_dir``, oldest first"""
+    return sorted(name for name in os.listdir(snapshots_dir) if _snapshot_name_pattern.match(name))
+
+
+def _create_snapshot_name() -> str:
+    return datetime.now(timezone.utc).strftime(_SNAPSHOT_NAME_FORMAT)
+
+
+def _backup_to_snapshot(config):
+    """Backup PORTDIR to a new snapshot, made visible under its final name only once complete
+
+    An incomplete snapshot left behind by an interrupted run is picked up and completed.
+    """
+    os.makedirs(config.host_backup_snapshots_dir, exist_ok=True)
+    previous_snapshot_names = _list_snapshot_names_in(config.host_backup_snapshots_dir)
+    incomplete_snapshot_dir = os.path.join(
+        config.host_backup_snapshots_dir, _INCOMPLETE_SNAPSHOT_NAME
+    )
+
+    rsync_argv = [
+        "rsync",
+        "--archive",
+        "--delete",
     ]
+    if previous_snapshot_names:
+        # NOTE: Relative to the destination directory
+        rsync_argv.append(f"--link-dest=../{previous_snapshot_names[-1]}")
+    rsync_argv += [
+        _with_trailing_slash(config.host_portdir),
+        _with_trailing_slash(incomplete_snapshot_dir),
+    ]
+    announce_and_call(rsync_argv)
+
+    snapshot_name = _create_snapshot_name()
+    snapshot_dir = os.path.join(config.host_backup_snapshots_dir, snapshot_name)
+    if os.path.exists(snapshot_dir):  # i.e. created by a run within the very same second
+        print(f"# Replacing snapshot {snapshot_name!r}")
+        shutil.rmtree(snapshot_dir)
+    os.rename(incomplete_snapshot_dir, snapshot_dir)
+
+    if config.keep is not None:
+        snapshot_names = sorted(set(previous_snapshot_names) | {snapshot_name})
+        for expired_snapshot_name in snapshot_names[: -config.keep]:
+            print(f"# Removing expired snapshot {expired_snapshot_name!r}")
+            shutil.rmtree(os.path.join(config.host_backup_snapshots_dir, expired_snapshot_name))
+
+
+def backup(config):
+    """Backup PORTDIR on the host, i.e. without the need for a container
+
+    A PORTDIR that does not exist yet (e.g. on first sync) has nothing to backup.
+    """
+    if not os.path.isdir(config.host_portdir):
+        print(f"# Skipping backup of missing directory {config.host_portdir!r}")
+        return
 
     if config.host_backup_portdir:
-        rsync_argv = [
-            "rsync",
-            "--archive",
-            "--delete",
-            "--verbose",
-            "--progress",
-            _with_trailing_slash(container_portdir),
-            _with_trailing_slash(container_backup_portdir),
-        ]
-        rsync_command = shlex.join(rsync_argv)
-        container_command.append(rsync_command)
+        announce_and_call(
+            [
+                "rsync",
+                "--archive",
+                "--delete",
+                "--verbose",
+                "--progress",
+                _with_trailing_slash(config.host_portdir),
+                _with_trailing_slash(config.host_backup_portdir),
+            ]
+        )
+
+    if config.host_backup_snapshots_dir:
+        _backup_to_snapshot(config)
+
 
-    container_command += [
+def fetch_using_webrsync(config, host_portdir):
+    """Bring ``host_portdir`` up to date using emerge-webrsync in a container"""
+    container_portdir = "/usr/portage"
+
+    container_command = [
+        "set -x",
         # This will suppress the warning about an invalid profile
         # by giving symlink /etc/portage/make.profile (that currently points to
         # non-existing "../../var/db/repos/gentoo/profiles/[..]") a valid target
@@ -90,12 +266,7 @@ def sync(config):
 
     container_command_flat = " && ".join(container_command)
 
-    docker_volume_args = ["-v", f"{config.host_portdir}:{container_portdir}:rw"]
-    if config.host_backup_portdir:
-        docker_volume_args += [
-            "-v",
-            f"{config.host_backup_portdir}:{container_backup_portdir}:rw",
-        ]
+    docker_volume_args = ["-v", f"{host_portdir}:{container_portdir}:rw"]
 
     docker_run_args = (
         [
@@ -116,6 +287,151 @@ def sync(config):
     announce_and_call(["docker", "run"] + docker_run_args)
 
 
+def _index_files_below(portdir) -> dict[str, tuple[int, int]]:
+    """Map paths of all files below ``portdir`` (relative to it) to size and modification time"""
+    size_and_mtime_of_path = {}
+    for root, _dirs, files in os.walk(portdir):
+        for file in files:
+            stat = os.lstat(os.path.join(root, file))
+            relative_path = os.path.relpath(os.path.join(root, file), portdir)
+            size_and_mtime_of_path[relative_path] = stat.st_size, stat.st_mtime_ns
+    return size_and_mtime_of_path
+
+
+def _compare_file_indices(
+    old_index: dict[str, tuple[int, int]], new_index: dict[str, tuple[int, int]]
+) -> TreeChanges:
+    return TreeChanges(
+        changed=[path for path, stat in new_index.items() if old_index.get(path) != stat],
+        deleted=[path for path in old_index if path not in new_index],
+    )
+
+
+def _parse_itemized_changes(rsync_output: str) -> TreeChanges:
+    """Extract files changed and deleted from rsync output of format ``"%i %n"``
+
+    Lines look like ``">f.st...... cat/pkg/pkg-1.ebuild"`` or ``"*deleting   cat/pkg/"``,
+    where the second character of itemized changes tells the type of file.
+    """
+    changes = TreeChanges()
+    for line in rsync_output.splitlines():
+        itemized, _, path = line.partition(" ")
+        path = path.lstrip(" ")  # i.e. "*deleting" is padded to the width of the others
+        if not path or path.endswith("/"):  # i.e. directories
+            continue
+        if itemized.startswith("*deleting"):
+            changes.deleted.append(path)
+        elif itemized[1] != "d":
+            changes.changed.append(path)
+    return changes
+
+
+def _git(host_portdir, *args) -> list[str]:
+    return ["git", "-C", host_portdir, *args]
+
+
+def _list_changes_in_git(host_portdir, old_commit, new_commit) -> TreeChanges:
+    if old_commit is None:
+        output = announce_and_check_output(_git(host_portdir, "ls-files", "-z"))
+        return TreeChanges(changed=[path for path in output.split("\0") if path])
+
+    output = announce_and_check_output(
+        _git(host_portdir, "diff", "--name-status", "-z", "--no-renames", old_commit, new_commit)
+    )
+    changes = TreeChanges()
+    fields = output.split("\0")
+    for status, path in zip(fields[0:-1:2], fields[1::2]):  # i.e. "<status>\0<path>\0"..
+        if status == "D":
+            changes.deleted.append(path)
+        else:
+            changes.changed.append(path)
+    return changes
+
+
+def fetch_using_git(config) -> TreeChanges:
+    """Clone or fetch and fast-forward the git clone at PORTDIR, on the host"""
+    depth_args = [] if config.depth is None else [f"--depth={config.depth}"]
+
+    if not os.path.exists(os.path.join(config.host_portdir, ".git")):
+        if os.path.isdir(config.host_portdir) and os.listdir(config.host_portdir):
+            raise ValueError(f"Directory {config.host_portdir!r} is neither empty nor a git clone")
+        announce_and_call(
+            ["git", "clone", "--quiet", *depth_args, config.git_url, config.host_portdir]
+        )
+        old_commit = None
+    else:
+        old_commit = announce_and_check_output(
+            _git(config.host_portdir, "rev-parse", "HEAD")
+        ).strip()
+        announce_and_call(
+            _git(config.host_portdir, "fetch", "--quiet", *depth_args, config.git_url, "HEAD")
+        )
+        if config.depth is None:
+            announce_and_call(_git(config.host_portdir, "merge", "--ff-only", "FETCH_HEAD"))
+        else:
+            # NOTE: History cut off by the shallow fetch may not connect to the old commit,
+            #       so there is no way to tell a fast-forward apart (as with "emerge --sync")
+            announce_and_call(
+                _git(config.host_portdir, "reset", "--quiet", "--merge", "FETCH_HEAD")
+            )
+
+    new_commit = announce_and_check_output(_git(config.host_portdir, "rev-parse", "HEAD")).strip()
+    print(f"Synchronised from commit {old_commit} to commit {new_commit}.")
+
+    changes = _list_changes_in_git(config.host_portdir, old_commit, new_commit)
+    changes.old_commit = old_commit
+    changes.new_commit = new_commit
+    return changes
+
+
+def sync(config):
+    if config.method == "git":
+        backup(config)
+        changes = fetch_using_git(config)
+        if config.changes_out is not None:
+            changes.save(config.changes_out)
+        return
+
+    if config.host_staging_portdir is None:
+        backup(config)
+        if config.changes_out is not None:
+            old_index = _index_files_below(config.host_portdir)
+        fetch_using_webrsync(config, config.host_portdir)
+        if config.changes_out is not None:
+            changes = _compare_file_indices(old_index, _index_files_below(config.host_portdir))
+            changes.save(config.changes_out)
+        return
+
+    os.makedirs(config.host_staging_portdir, exist_ok=True)
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        futures = [
+            executor.submit(backup, config),
+            executor.submit(fetch_using_webrsync, config, config.host_staging_portdir),
+        ]
+        for future in futures:
+            future.result()
+
+    # NOTE: Only this final step needs both backup and synchronisation to be complete
+    rsync_argv = [
+        "rsync",
+        "--archive",
+        "--delete",
+    ]
+    if config.changes_out is not None:
+        rsync_argv.append("--out-format=%i %n")
+    rsync_argv += [
+        _with_trailing_slash(config.host_staging_portdir),
+        _with_trailing_slash(config.host_portdir),
+    ]
+
+    if config.changes_out is None:
+        announce_and_call(rsync_argv)
+    else:
+        changes = _parse_itemized_changes(announce_and_check_output(rsync_argv))
+        changes.save(config.changes_out)
+
+
 def main():
     with exception_reporting():
         config = parse_command_line(sys.argv)
@@ -0,0 +1,76 @@
+# Copyright (C) 2021 Sebastian Pipping <sebastian@pipping.org>
+# Licensed under GNU Affero GPL version 3 or later
+
+import os
+from collections import OrderedDict
+from threading import Lock
+
+from .atomic_files import load_versioned_json, save_versioned_json
+
+
+class KeywordsCache:
+    """Bounded least-recently-used cache of the KEYWORDS (and content digests) of ebuilds
+
+    Entries are keyed by path relative to the portdir and by the identity (i.e. device and
+    inode), size, modification time and status change time of the file.  So the very same
+    file (e.g. hardlinked into a snapshot backup) yields a hit across trees and runs,
+    while two different files never share an entry, however alike their size and times.
+    """
+
+    def __init__(self, max_entries: int):
+        self._max_entries = max_entries
+        self._entries: OrderedDict[str, tuple[str, frozenset[str]]] = OrderedDict()
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key_for(relative_path: str, stat: os.stat_result) -> str:
+        return (
+            f"{relative_path}:{stat.st_dev}:{stat.st_ino}"
+            f":{stat.st_size}:{stat.st_mtime_ns}:{stat.st_ctime_ns}"
+        )
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, relative_path: str, stat: os.stat_result) -> tuple[str, frozenset[str]] | None:
+        key = self._key_for(relative_path, stat)
+        with self._lock:
+            try:
+                entry = self._entries[key]
+            except KeyError:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, relative_path: str, stat: os.stat_result, digest: str, keywords: set[str]):
+        key = self._key_for(relative_path, stat)
+        with self._lock:
+            self._entries[key] = (digest, frozenset(keywords))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+
+    @staticmethod
+    def load(filename, max_entries: int):
+        cache = KeywordsCache(max_entries)
+
+        doc = load_versioned_json(filename, 2, cache=True)
+        if doc is not None:
+            # NOTE: Entries are stored least-recently-used first
+            for key, digest, keywords in doc["entries"][-max_entries:]:
+                cache._entries[key] = (digest, frozenset(keywords))
+
+        return cache
+
+    def save(self, filename):
+        doc = {
+            "entries": [
+                [key, digest, sorted(keywords)]
+                for key, (digest, keywords) in self._entries.items()
+            ],
+        }
+        save_versioned_json(filename, 2, doc, compact=True)
@@ -0,0 +1,117 @@
+# Copyright (C) 2021 Sebastian Pipping <sebastian@pipping.org>
+# Licensed under GNU Affero GPL version 3 or later
+
+import os
+
+from .atomic_files import load_versioned_json, save_versioned_json
+
+
+def parse_md5_cache_entry(content: str) -> dict[str, str]:
+    """Parse the ``KEY=value`` lines of an entry of a portdir's ``metadata/md5-cache``"""
+    return dict(line.split("=", maxsplit=1) for line in content.splitlines() if "=" in line)
+
+
+def get_eclasses_of(md5_cache_entry: dict[str, str]) -> list[str]:
+    eclasses_and_md5s = md5_cache_entry.get("_eclasses_")
+    if not eclasses_and_md5s:
+        return []
+    return eclasses_and_md5s.split("\t")[0::2]  # i.e. "<eclass>\t<md5>\t<eclass>\t<md5>..."
+
+
+class EclassIndex:
+    """Reverse index from eclasses to the ebuilds that inherit them, built from md5-cache
+
+    Both the reverse index and the md5-cache entries it was built from are kept, so that
+    it can be patched incrementally: an update takes one ``stat`` per md5-cache entry
+    but only re-reads entries whose size or modification time changed, and only
+    touches the eclasses of those.  Lookups cost O(ebuilds inheriting the eclass).
+    """
+
+    def __init__(self):
+        # i.e. [size, mtime_ns, keywords, eclasses] per PF per category
+        self._entry_of_pf_of_category: dict[str, dict[str, list]] = {}
+        self._cpvs_of_eclass: dict[str, set[str]] = {}
+
+    def _add_cpv(self, cpv: str, eclasses: list[str]):
+        for eclass in eclasses:
+            self._cpvs_of_eclass.setdefault(eclass, set()).add(cpv)
+
+    def _remove_cpv(self, cpv: str, eclasses: list[str]):
+        for eclass in eclasses:
+            cpvs = self._cpvs_of_eclass.get(eclass)
+            if cpvs is None:
+                continue
+            cpvs.discard(cpv)
+            if not cpvs:
+                del self._cpvs_of_eclass[eclass]
+
+    def update(self, md5_cache_dir: str) -> int:
+        """Bring the index in line with ``md5_cache_dir``, return the number of entries read"""
+        entries_read = 0
+        entry_of_pf_of_category = {}
+        for category_dir_entry in os.scandir(md5_cache_dir):
+            if not category_dir_entry.is_dir():
+                continue
+            category = category_dir_entry.name
+            previous_entry_of_pf = self._entry_of_pf_of_category.pop(category, {})
+            entry_of_pf = {}
+            for pf_dir_entry in os.scandir(category_dir_entry.path):
+                stat = pf_dir_entry.stat()
+                entry = previous_entry_of_pf.pop(pf_dir_entry.name, None)
+                if entry is None or entry[:2] != [stat.st_size, stat.st_mtime_ns]:
+                    with open(pf_dir_entry.path) as f:
+                        md5_cache_entry = parse_md5_cache_entry(f.read())
+                    cpv = f"{category}/{pf_dir_entry.name}"
+                    if entry is not None:
+                        self._remove_cpv(cpv, entry[3])
+                    entry = [
+                        stat.st_size,
+                        stat.st_mtime_ns,
+                        md5_cache_entry.get("KEYWORDS", ""),
+                        get_eclasses_of(md5_cache_entry),
+                    ]
+                    self._add_cpv(cpv, entry[3])
+                    entries_read += 1
+                entry_of_pf[pf_dir_entry.name] = entry
+            entry_of_pf_of_category[category] = entry_of_pf
+
+            # NOTE: What is left over are entries that were removed
+            for pf, entry in previous_entry_of_pf.items():
+                self._remove_cpv(f"{category}/{pf}", entry[3])
+
+        # NOTE: What is left over are categories that were removed
+        for category, entry_of_pf in self._entry_of_pf_of_category.items():
+            for pf, entry in entry_of_pf.items():
+                self._remove_cpv(f"{category}/{pf}", entry[3])
+
+        self._entry_of_pf_of_category = entry_of_pf_of_category
+        return entries_read
+
+    def iterate_inheriting(self, eclass: str):
+        """Yield ``(cpv, keywords)`` of all ebuilds inheriting ``eclass``"""
+        for cpv in sorted(self._cpvs_of_eclass.get(eclass, ())):
+            category, pf = cpv.split("/")
+            keywords = self._entry_of_pf_of_category[category][pf][2]
+            yield cpv, {kw for kw in keywords.split(" ") if kw}
+
+    @staticmethod
+    def load(filename):
+        index = EclassIndex()
+
+        doc = load_versioned_json(filename, 3, cache=True)
+        if doc is not None:
+            index._entry_of_pf_of_category = doc["entry_of_pf_of_category"]
+            index._cpvs_of_eclass = {
+                eclass: set(cpvs) for eclass, cpvs in doc["cpvs_of_eclass"].items()
+            }
+
+        return index
+
+    def save(self, filename):
+        doc = {
+            "entry_of_pf_of_category": self._entry_of_pf_of_category,
+            "cpvs_of_eclass": {
+                eclass: sorted(cpvs) for eclass, cpvs in self._cpvs_of_eclass.items()
+            },
+        }
+        save_versioned_json(filename, 3, doc, compact=True)
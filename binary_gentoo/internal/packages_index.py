@@ -0,0 +1,156 @@
+# Copyright (C) 2021 Sebastian Pipping <sebastian@pipping.org>
+# Licensed under GNU Affero GPL version 3 or later
+
+import mmap
+import os
+import re
+import sys
+from array import array
+
+from .atomic_files import atomically_written
+
+_BLOCK_SEPARATOR = b"\n\n"
+_NOT_AVAILABLE = -1
+# NOTE: The leading newline (rather than "^" with re.MULTILINE) allows for a fast literal search
+_FIELD_PATTERN = re.compile(b"\n(?P<key>BUILD_ID|BUILD_TIME|CPV|PATH|SIZE): (?P<value>[^\n]*)")
+
+
+class PackagesIndex:
+    """Column-oriented in-memory representation of a pkgdir "Packages" index file
+
+    Rather than one object per package entry, there is one array (or list of interned
+    strings) per field of interest, and the raw text of package blocks is kept in
+    the memory-mapped source file and only addressed by offsets.
+    """
+
+    def __init__(self):
+        self.filename = None
+        self.header = ""
+        self.categories: list[str] = []
+        self.cpvs: list[str] = []
+        self.build_ids = array("q")
+        self.build_times = array("q")
+        self.sizes = array("q")
+        self._path_starts = array("q")
+        self._path_ends = array("q")
+        self._block_starts = array("q")
+        self._block_ends = array("q")
+        self._empty_block_count = 0
+        self._file = None
+        self._source = b""
+
+    def __len__(self):
+        return len(self.cpvs)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        if isinstance(self._source, mmap.mmap):
+            self._source.close()
+        self._source = b""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _text(self, start: int, end: int) -> str:
+        return self._source[start:end].decode("utf-8")
+
+    def _append_package_block(self, block_start: int, block_end: int):
+        value_span_of = {
+            match.group("key"): match.span("value")
+            # NOTE: The character before any block is the newline of the preceding separator
+            for match in _FIELD_PATTERN.finditer(self._source, block_start - 1, block_end)
+        }
+
+        def value_of(key):
+            try:
+                return self._text(*value_span_of[key])
+            except KeyError:
+                block = self._text(block_start, block_end)
+                raise ValueError(f"Package entry {block!r} lacks field {key.decode()!r}")
+
+        cpv = sys.intern(value_of(b"CPV"))
+        build_time = int(value_of(b"BUILD_TIME"))
+        build_id = int(value_of(b"BUILD_ID")) if b"BUILD_ID" in value_span_of else _NOT_AVAILABLE
+        size = int(value_of(b"SIZE")) if b"SIZE" in value_span_of else _NOT_AVAILABLE
+        path_start, path_end = value_span_of.get(b"PATH", (_NOT_AVAILABLE, _NOT_AVAILABLE))
+
+        self.categories.append(sys.intern(cpv.split("/")[0]))
+        self.cpvs.append(cpv)
+        self.build_ids.append(build_id)
+        self.build_times.append(build_time)
+        self.sizes.append(size)
+        self._path_starts.append(path_start)
+        self._path_ends.append(path_end)
+        self._block_starts.append(block_start)
+        self._block_ends.append(block_end)
+
+    def _parse(self):
+        source_size = len(self._source)
+        header_end = self._source.find(_BLOCK_SEPARATOR)
+        if header_end == -1:
+            header_end = source_size
+        self.header = self._text(0, header_end)
+
+        # NOTE: This mirrors the semantics of content.split("\n\n") without the copying
+        block_start = header_end + len(_BLOCK_SEPARATOR)
+        while block_start <= source_size:
+            block_end = self._source.find(_BLOCK_SEPARATOR, block_start)
+            if block_end == -1:
+                block_end = source_size
+            if block_end == block_start:
+                self._empty_block_count += 1
+            else:
+                self._append_package_block(block_start, block_end)
+            block_start = block_end + len(_BLOCK_SEPARATOR)
+
+    @staticmethod
+    def load(filename):
+        index = PackagesIndex()
+        index.filename = filename
+        index._file = open(filename, "rb")
+        try:
+            if os.fstat(index._file.fileno()).st_size > 0:
+                index._source = mmap.mmap(index._file.fileno(), 0, access=mmap.ACCESS_READ)
+            index._parse()
+        except BaseException:
+            index.close()
+            raise
+        return index
+
+    def block(self, i: int) -> str:
+        return self._text(self._block_starts[i], self._block_ends[i])
+
+    def path(self, i: int) -> str:
+        if self._path_starts[i] == _NOT_AVAILABLE:
+            return f"{self.cpvs[i]}.tbz2"  # for FEATURES=-binpkg-multi-instance
+        return self._text(self._path_starts[i], self._path_ends[i])
+
+    def size(self, i: int) -> int | None:
+        size = self.sizes[i]
+        return None if size == _NOT_AVAILABLE else size
+
+    def full_name(self, i: int) -> str:
+        build_id = self.build_ids[i]
+        if build_id == _NOT_AVAILABLE:  # for FEATURES=-binpkg-multi-instance
+            return self.cpvs[i]
+        return f"{self.cpvs[i]}-{build_id}"
+
+    def indices_sorted_by_build_time(self) -> array:
+        """Indices of all entries sorted by ``(build_time, full_name)``"""
+        return array(
+            "q", sorted(range(len(self)), key=lambda i: (self.build_times[i], self.full_name(i)))
+        )
+
+    def save(self, filename, header: str, indices):
+        """Write ``header`` and the package entries at ``indices`` to ``filename``, atomically"""
+        with atomically_written(filename, "wb") as f:
+            f.write(header.encode("utf-8"))
+            for i in indices:
+                f.write(_BLOCK_SEPARATOR)
+                f.write(self._source[self._block_starts[i] : self._block_ends[i]])
+            f.write(_BLOCK_SEPARATOR * self._empty_block_count)
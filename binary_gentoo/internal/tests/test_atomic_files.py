@@ -0,0 +1,65 @@
+# Copyright (C) 2021 Sebastian Pipping <sebastian@pipping.org>
+# Licensed under GNU Affero GPL version 3 or later
+
+import os
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+from parameterized import parameterized
+
+from ..atomic_files import atomically_written, load_versioned_json, save_versioned_json
+
+
+class AtomicallyWrittenTest(TestCase):
+    def test_interrupted_write_keeps_original(self):
+        with TemporaryDirectory() as tempdir:
+            filename = os.path.join(tempdir, "file.txt")
+            with open(filename, "w") as f:
+                f.write("original")
+
+            with self.assertRaises(KeyboardInterrupt):
+                with atomically_written(filename) as f:
+                    f.write("partial")
+                    raise KeyboardInterrupt
+
+            with open(filename) as f:
+                self.assertEqual(f.read(), "original")
+            self.assertEqual(os.listdir(tempdir), ["file.txt"])
+
+
+class VersionedJsonTest(TestCase):
+    @parameterized.expand(
+        [
+            ("for humans", False, '{\n  "entries": [\n    1\n  ],\n  "version": 2\n}\n'),
+            ("compact", True, '{"entries":[1],"version":2}'),
+        ]
+    )
+    def test_round_trip(self, _label, compact, expected_content):
+        with TemporaryDirectory() as tempdir:
+            filename = os.path.join(tempdir, "doc.json")
+
+            save_versioned_json(filename, 2, {"entries": [1]}, compact=compact)
+
+            with open(filename) as f:
+                self.assertEqual(f.read(), expected_content)
+            self.assertEqual(load_versioned_json(filename, 2), {"version": 2, "entries": [1]})
+
+    def test_missing_or_empty(self):
+        with TemporaryDirectory() as tempdir:
+            filename = os.path.join(tempdir, "doc.json")
+
+            self.assertIsNone(load_versioned_json(filename, 1))
+            with self.assertRaises(FileNotFoundError):
+                load_versioned_json(filename, 1, required=True)
+
+            open(filename, "w").close()
+            self.assertIsNone(load_versioned_json(filename, 1, required=True))
+
+    def test_unsupported_version(self):
+        with TemporaryDirectory() as tempdir:
+            filename = os.path.join(tempdir, "doc.json")
+            save_versioned_json(filename, 1, {})
+
+            with self.assertRaises(ValueError):
+                load_versioned_json(filename, 2)
+            self.assertIsNone(load_versioned_json(filename, 2, cache=True))
@@ -5,7 +5,7 @@ from unittest import TestCase
 
 from parameterized import parameterized
 
-from ..atoms import extract_category_package_from
+from ..atoms import extract_category_package_from, strip_version_from
 
 
 class ExtractCategoryPackageFromTest(TestCase):
@@ -38,3 +38,17 @@ class ExtractCategoryPackageFromTest(TestCase):
     def test_failure(self, candidate, expected_exception_class):
         with self.assertRaises(expected_exception_class):
             extract_category_package_from(candidate)
+
+
+class StripVersionFromTest(TestCase):
+    @parameterized.expand(
+        [
+            ("dev-util/meld-3.20.3", "dev-util/meld"),
+            ("dev-util/meld-3.20.3-r1", "dev-util/meld"),
+            ("x11-libs/gtk+-3.24.29", "x11-libs/gtk+"),
+            ("dev-python/typing_extensions-4.0.1_p2", "dev-python/typing_extensions"),
+            ("app-misc/foo-bar-2-1.0", "app-misc/foo-bar-2"),
+        ]
+    )
+    def test(self, cpv, expected_category_package):
+        self.assertEqual(strip_version_from(cpv), expected_category_package)
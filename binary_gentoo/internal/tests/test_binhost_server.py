@@ -0,0 +1,235 @@
+# Copyright (C) 2021 Sebastian Pipping <sebastian@pipping.org>
+# Licensed under GNU Affero GPL version 3 or later
+
+import asyncio
+import gzip
+import os
+from dataclasses import dataclass
+from io import StringIO
+from tempfile import TemporaryDirectory
+from textwrap import dedent
+from unittest import IsolatedAsyncioTestCase, TestCase
+from unittest.mock import patch
+
+from parameterized import parameterized
+
+from ..binhost_server import BinhostServer, parse_byte_range
+
+_DUMMY_INDEX_CONTENT = dedent("""\
+    PACKAGES: 1
+    TIMESTAMP: 1627149542
+    VERSION: 0
+
+    BUILD_ID: 1
+    BUILD_TIME: 1
+    CPV: cat/pkg-1
+    PATH: cat/pkg/pkg-1-1.gpkg.tar
+
+""")
+_DUMMY_PACKAGE_CONTENT = b"0123456789"
+
+
+@dataclass
+class HttpResponse:
+    status: int
+    headers: dict
+    body: bytes
+
+
+class _FakeStreamWriter:
+    def __init__(self):
+        self.data = b""
+        self.closed = False
+
+    def get_extra_info(self, name):
+        return None
+
+    def write(self, data):
+        self.data += data
+
+    async def drain(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+
+class ParseByteRangeTest(TestCase):
+    @parameterized.expand(
+        [
+            ("bytes=0-3", (0, 4)),
+            ("bytes=5-", (5, 5)),
+            ("bytes=5-999", (5, 5)),
+            ("bytes=-3", (7, 3)),
+            ("bytes=-999", (0, 10)),
+            ("bytes=10-", None),
+            ("bytes=-0", None),
+        ]
+    )
+    def test_supported(self, range_header, expected_range):
+        self.assertEqual(parse_byte_range(range_header, file_size=10), expected_range)
+
+    @parameterized.expand(
+        [
+            ("bytes=-",),
+            ("bytes=0-1,3-4",),
+            ("lines=1-2",),
+        ]
+    )
+    def test_unsupported(self, range_header):
+        with self.assertRaises(ValueError):
+            parse_byte_range(range_header, file_size=10)
+
+
+class BinhostServerTest(IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self._tempdir = TemporaryDirectory()
+        self._pkgdir = self._tempdir.name
+        with open(os.path.join(self._pkgdir, "Packages"), "w") as f:
+            f.write(_DUMMY_INDEX_CONTENT)
+        os.makedirs(os.path.join(self._pkgdir, "cat", "pkg"))
+        with open(os.path.join(self._pkgdir, "cat", "pkg", "pkg-1-1.gpkg.tar"), "wb") as f:
+            f.write(_DUMMY_PACKAGE_CONTENT)
+
+        self._stdout_patcher = patch("sys.stdout", StringIO())
+        self._stdout_mock = self._stdout_patcher.start()
+        self._server = await BinhostServer(self._pkgdir).start("127.0.0.1", 0)
+        self._port = self._server.sockets[0].getsockname()[1]
+
+    async def asyncTearDown(self):
+        self._server.close()
+        await self._server.wait_closed()
+        self._stdout_patcher.stop()
+        self._tempdir.cleanup()
+
+    async def _request(self, path, method="GET", **headers) -> HttpResponse:
+        reader, writer = await asyncio.open_connection("127.0.0.1", self._port)
+        lines = [f"{method} {path} HTTP/1.1", "Host: localhost", "Connection: close"]
+        lines += [f"{name.replace('_', '-')}: {value}" for name, value in headers.items()]
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("ascii"))
+        await writer.drain()
+
+        raw_response = await reader.read()
+        writer.close()
+        await writer.wait_closed()
+
+        raw_head, _, body = raw_response.partition(b"\r\n\r\n")
+        status_line, *header_lines = raw_head.decode("latin-1").split("\r\n")
+        response_headers = dict(line.split(": ", maxsplit=1) for line in header_lines)
+        return HttpResponse(int(status_line.split(" ")[1]), response_headers, body)
+
+    async def test_package_file(self):
+        response = await self._request("/cat/pkg/pkg-1-1.gpkg.tar")
+
+        self.assertEqual(response.status, 200)
+        self.assertEqual(response.body, _DUMMY_PACKAGE_CONTENT)
+        self.assertEqual(response.headers["Content-Length"], "10")
+        self.assertEqual(response.headers["Accept-Ranges"], "bytes")
+
+    async def test_head(self):
+        response = await self._request("/cat/pkg/pkg-1-1.gpkg.tar", method="HEAD")
+
+        self.assertEqual(response.status, 200)
+        self.assertEqual(response.body, b"")
+        self.assertEqual(response.headers["Content-Length"], "10")
+
+    async def test_range(self):
+        response = await self._request("/cat/pkg/pkg-1-1.gpkg.tar", Range="bytes=2-5")
+
+        self.assertEqual(response.status, 206)
+        self.assertEqual(response.body, b"2345")
+        self.assertEqual(response.headers["Content-Range"], "bytes 2-5/10")
+
+    async def test_range_not_satisfiable(self):
+        response = await self._request("/cat/pkg/pkg-1-1.gpkg.tar", Range="bytes=20-")
+
+        self.assertEqual(response.status, 416)
+        self.assertEqual(response.headers["Content-Range"], "bytes */10")
+
+    async def test_index_caching_headers(self):
+        response = await self._request("/Packages")
+
+        self.assertEqual(response.status, 200)
+        self.assertEqual(response.body.decode("utf-8"), _DUMMY_INDEX_CONTENT)
+        self.assertEqual(response.headers["ETag"], '"1627149542"')
+        self.assertEqual(response.headers["Last-Modified"], "Sat, 24 Jul 2021 17:59:02 GMT")
+
+        response = await self._request("/Packages", If_None_Match='"1627149542"')
+        self.assertEqual(response.status, 304)
+        self.assertEqual(response.body, b"")
+
+        response = await self._request(
+            "/Packages", If_Modified_Since="Sat, 24 Jul 2021 17:59:02 GMT"
+        )
+        self.assertEqual(response.status, 304)
+
+        response = await self._request(
+            "/Packages", If_Modified_Since="Sat, 24 Jul 2021 17:59:01 GMT"
+        )
+        self.assertEqual(response.status, 200)
+
+    async def test_compressed_index_regenerated_on_change(self):
+        response = await self._request("/Packages.gz")
+        self.assertEqual(response.status, 200)
+        self.assertEqual(gzip.decompress(response.body).decode("utf-8"), _DUMMY_INDEX_CONTENT)
+
+        new_index_content = _DUMMY_INDEX_CONTENT.replace("1627149542", "1627149543")
+        with open(os.path.join(self._pkgdir, "Packages"), "w") as f:
+            f.write(new_index_content)
+
+        response = await self._request("/Packages", Accept_Encoding="gzip, deflate")
+        self.assertEqual(response.status, 200)
+        self.assertEqual(response.headers["Content-Encoding"], "gzip")
+        self.assertEqual(response.headers["ETag"], '"1627149543-gzip"')
+        self.assertEqual(gzip.decompress(response.body).decode("utf-8"), new_index_content)
+
+    async def test_compressed_index_not_writable(self):
+        with patch(
+            "binary_gentoo.internal.binhost_server._write_compressed_index",
+            side_effect=PermissionError(13, "Permission denied"),
+        ):
+            response = await self._request("/Packages", Accept_Encoding="gzip, deflate")
+            self.assertEqual(response.status, 200)
+            self.assertNotIn("Content-Encoding", response.headers)
+            self.assertEqual(response.body.decode("utf-8"), _DUMMY_INDEX_CONTENT)
+
+            response = await self._request("/Packages.gz")
+            self.assertEqual(response.status, 404)
+
+    async def test_overlong_header_line(self):
+        reader = asyncio.StreamReader(limit=64)
+        reader.feed_data(b"GET /Packages HTTP/1.1\r\nX-Long: " + b"x" * 100 + b"\r\n\r\n")
+        reader.feed_eof()
+        writer = _FakeStreamWriter()
+
+        await BinhostServer(self._pkgdir)._handle_connection(reader, writer)
+
+        self.assertTrue(writer.data.startswith(b"HTTP/1.1 431 "))
+        self.assertTrue(writer.closed)
+
+    @parameterized.expand(
+        [
+            ("/cat/pkg/missing.gpkg.tar",),
+            ("/cat/pkg/",),
+            ("/../etc/passwd",),
+            ("/cat/../../etc/passwd",),
+        ]
+    )
+    async def test_not_found(self, path):
+        response = await self._request(path)
+
+        self.assertEqual(response.status, 404)
+
+    async def test_method_not_allowed(self):
+        response = await self._request("/Packages", method="POST")
+
+        self.assertEqual(response.status, 405)
+        self.assertEqual(response.headers["Allow"], "GET, HEAD")
+
+    async def test_request_logged(self):
+        await self._request("/cat/pkg/pkg-1-1.gpkg.tar")
+
+        self.assertRegex(
+            self._stdout_mock.getvalue(),
+            r'^127\.0\.0\.1 "GET /cat/pkg/pkg-1-1\.gpkg\.tar HTTP/1\.1" 200 10 [0-9.]+ms\n$',
+        )
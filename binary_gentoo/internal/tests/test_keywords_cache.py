@@ -0,0 +1,89 @@
+# Copyright (C) 2021 Sebastian Pipping <sebastian@pipping.org>
+# Licensed under GNU Affero GPL version 3 or later
+
+import os
+from tempfile import TemporaryDirectory
+from types import SimpleNamespace
+from unittest import TestCase
+
+from parameterized import parameterized
+
+from ..keywords_cache import KeywordsCache
+
+
+def _stat(ino: int, size: int = 1, mtime_ns: int = 1, ctime_ns: int = 1):
+    return SimpleNamespace(
+        st_dev=1, st_ino=ino, st_size=size, st_mtime_ns=mtime_ns, st_ctime_ns=ctime_ns
+    )
+
+
+class GetPutTest(TestCase):
+    def test_hit_and_miss(self):
+        cache = KeywordsCache(max_entries=10)
+        cache.put("cat/pkg/pkg-1.ebuild", _stat(1, 123, 456), "digest1", {"amd64", "~x86"})
+
+        self.assertEqual(
+            cache.get("cat/pkg/pkg-1.ebuild", _stat(1, 123, 456)), ("digest1", {"amd64", "~x86"})
+        )
+        self.assertIsNone(cache.get("cat/pkg/pkg-1.ebuild", _stat(1, 123, 457)))
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    @parameterized.expand(
+        [
+            ("other inode", _stat(2, 123, 456)),
+            ("other status change time", _stat(1, 123, 456, ctime_ns=2)),
+        ]
+    )
+    def test_other_file_alike_misses(self, _label, stat):
+        cache = KeywordsCache(max_entries=10)
+        cache.put("cat/pkg/pkg-1.ebuild", _stat(1, 123, 456), "digest1", {"amd64"})
+
+        self.assertIsNone(cache.get("cat/pkg/pkg-1.ebuild", stat))
+
+    def test_least_recently_used_evicted(self):
+        cache = KeywordsCache(max_entries=2)
+        cache.put("cat/pkg/pkg-1.ebuild", _stat(1), "digest1", set())
+        cache.put("cat/pkg/pkg-2.ebuild", _stat(2), "digest2", set())
+        cache.get("cat/pkg/pkg-1.ebuild", _stat(1))
+        cache.put("cat/pkg/pkg-3.ebuild", _stat(3), "digest3", set())
+
+        self.assertEqual(len(cache), 2)
+        self.assertIsNotNone(cache.get("cat/pkg/pkg-1.ebuild", _stat(1)))
+        self.assertIsNone(cache.get("cat/pkg/pkg-2.ebuild", _stat(2)))
+        self.assertIsNotNone(cache.get("cat/pkg/pkg-3.ebuild", _stat(3)))
+
+
+class LoadSaveTest(TestCase):
+    def test_round_trip(self):
+        cache = KeywordsCache(max_entries=10)
+        cache.put("cat/pkg/pkg-1.ebuild", _stat(1), "digest1", {"amd64"})
+        cache.put("cat/pkg/pkg-2.ebuild", _stat(2), "digest2", {"~x86", "amd64"})
+
+        with TemporaryDirectory() as tempdir:
+            filename = os.path.join(tempdir, "keywords-cache.json")
+            cache.save(filename)
+            loaded_cache = KeywordsCache.load(filename, max_entries=1)
+
+        # NOTE: The least recently used entry did not make it past the smaller bound
+        self.assertEqual(len(loaded_cache), 1)
+        self.assertEqual(
+            loaded_cache.get("cat/pkg/pkg-2.ebuild", _stat(2)), ("digest2", {"~x86", "amd64"})
+        )
+
+    @parameterized.expand(
+        [
+            ("missing file", None),
+            ("empty file", ""),
+            ("outdated version", '{"version": 1, "entries": [["k", "d", []]]}'),
+        ]
+    )
+    def test_starts_empty(self, _label, content):
+        with TemporaryDirectory() as tempdir:
+            filename = os.path.join(tempdir, "keywords-cache.json")
+            if content is not None:
+                with open(filename, "w") as f:
+                    f.write(content)
+
+            cache = KeywordsCache.load(filename, max_entries=10)
+
+        self.assertEqual(len(cache), 0)
@@ -0,0 +1,110 @@
+# Copyright (C) 2021 Sebastian Pipping <sebastian@pipping.org>
+# Licensed under GNU Affero GPL version 3 or later
+
+import os
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+from parameterized import parameterized
+
+from ..md5_cache import EclassIndex, get_eclasses_of, parse_md5_cache_entry
+
+
+class ParseMd5CacheEntryTest(TestCase):
+    def test(self):
+        content = "DEPEND=>=dev-libs/foo-1\nKEYWORDS=amd64 ~x86\n_md5_=123\n"
+        self.assertEqual(
+            parse_md5_cache_entry(content),
+            {"DEPEND": ">=dev-libs/foo-1", "KEYWORDS": "amd64 ~x86", "_md5_": "123"},
+        )
+
+
+class GetEclassesOfTest(TestCase):
+    @parameterized.expand(
+        [
+            ("none", {}, []),
+            ("empty", {"_eclasses_": ""}, []),
+            ("two", {"_eclasses_": "cmake\t123\tflag-o-matic\t456"}, ["cmake", "flag-o-matic"]),
+        ]
+    )
+    def test(self, _, entry, expected_eclasses):
+        self.assertEqual(get_eclasses_of(entry), expected_eclasses)
+
+
+class EclassIndexTest(TestCase):
+    def setUp(self):
+        self._tempdir = TemporaryDirectory()
+        self._md5_cache_dir = os.path.join(self._tempdir.name, "md5-cache")
+
+    def tearDown(self):
+        self._tempdir.cleanup()
+
+    def _write_entry(self, cpv, keywords, eclasses):
+        filename = os.path.join(self._md5_cache_dir, cpv)
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        with open(filename, "w") as f:
+            print(f"KEYWORDS={keywords}", file=f)
+            print("_eclasses_=" + "\t".join(f"{eclass}\t0" for eclass in eclasses), file=f)
+
+    def test_incremental_update(self):
+        self._write_entry("cat/pkg-1", "amd64", ["cmake", "flag-o-matic"])
+        self._write_entry("dog/other-2", "~amd64", ["cmake"])
+        index = EclassIndex()
+
+        self.assertEqual(index.update(self._md5_cache_dir), 2)
+        self.assertEqual(
+            list(index.iterate_inheriting("cmake")),
+            [("cat/pkg-1", {"amd64"}), ("dog/other-2", {"~amd64"})],
+        )
+
+        self._write_entry("dog/other-3", "amd64", ["flag-o-matic"])
+        self.assertEqual(index.update(self._md5_cache_dir), 1)
+        self.assertEqual(
+            list(index.iterate_inheriting("flag-o-matic")),
+            [("cat/pkg-1", {"amd64"}), ("dog/other-3", {"amd64"})],
+        )
+        self.assertEqual(list(index.iterate_inheriting("unknown")), [])
+
+    def test_changed_and_removed_entries(self):
+        self._write_entry("cat/pkg-1", "amd64", ["cmake"])
+        self._write_entry("cat/pkg-2", "amd64", ["cmake"])
+        self._write_entry("cat/pkg-3", "amd64", ["cmake"])
+        index = EclassIndex()
+        index.update(self._md5_cache_dir)
+        category_dir = os.path.join(self._md5_cache_dir, "cat")
+        category_mtime_ns = os.stat(category_dir).st_mtime_ns
+
+        # NOTE: Neither of these needs to bump the modification time of the category
+        self._write_entry("cat/pkg-1", "~amd64", ["meson"])
+        os.remove(os.path.join(category_dir, "pkg-2"))
+        os.utime(category_dir, ns=(category_mtime_ns, category_mtime_ns))
+
+        self.assertEqual(index.update(self._md5_cache_dir), 1)
+        self.assertEqual(list(index.iterate_inheriting("cmake")), [("cat/pkg-3", {"amd64"})])
+        self.assertEqual(list(index.iterate_inheriting("meson")), [("cat/pkg-1", {"~amd64"})])
+
+    def test_removed_category(self):
+        self._write_entry("cat/pkg-1", "amd64", ["cmake"])
+        self._write_entry("dog/other-2", "amd64", ["cmake"])
+        index = EclassIndex()
+        index.update(self._md5_cache_dir)
+
+        os.remove(os.path.join(self._md5_cache_dir, "dog", "other-2"))
+        os.rmdir(os.path.join(self._md5_cache_dir, "dog"))
+
+        self.assertEqual(index.update(self._md5_cache_dir), 0)
+        self.assertEqual(list(index.iterate_inheriting("cmake")), [("cat/pkg-1", {"amd64"})])
+
+    def test_round_trip(self):
+        self._write_entry("cat/pkg-1", "amd64", ["cmake"])
+        index = EclassIndex()
+        index.update(self._md5_cache_dir)
+        filename = os.path.join(self._tempdir.name, "eclass-index.json")
+
+        index.save(filename)
+        loaded_index = EclassIndex.load(filename)
+
+        self.assertEqual(
+            list(loaded_index.iterate_inheriting("cmake")), [("cat/pkg-1", {"amd64"})]
+        )
+        self.assertEqual(loaded_index.update(self._md5_cache_dir), 0)
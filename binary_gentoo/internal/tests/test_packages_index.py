@@ -0,0 +1,124 @@
+# Copyright (C) 2021 Sebastian Pipping <sebastian@pipping.org>
+# Licensed under GNU Affero GPL version 3 or later
+
+import os
+from tempfile import TemporaryDirectory
+from textwrap import dedent
+from unittest import TestCase
+
+from parameterized import parameterized
+
+from ..packages_index import PackagesIndex
+
+_DUMMY_INDEX_CONTENT = dedent("""\
+    PACKAGES: 3
+    TIMESTAMP: 123
+    VERSION: 0
+
+    BUILD_ID: 2
+    BUILD_TIME: 2
+    CPV: cat/pkg-1
+    PATH: cat/pkg/pkg-1-2.gpkg.tar
+    SIZE: 456
+
+    BUILD_ID: 1
+    BUILD_TIME: 2
+    CPV: cat/pkg-1
+    PATH: cat/pkg/pkg-1-1.gpkg.tar
+
+    BUILD_TIME: 1
+    CPV: dog/other-2
+
+""")
+
+
+class PackagesIndexTest(TestCase):
+    def setUp(self):
+        self._tempdir = TemporaryDirectory()
+        self._filename = os.path.join(self._tempdir.name, "Packages")
+        with open(self._filename, "w") as f:
+            f.write(_DUMMY_INDEX_CONTENT)
+        self._index = PackagesIndex.load(self._filename)
+
+    def tearDown(self):
+        self._index.close()
+        self._tempdir.cleanup()
+
+    def test_columns(self):
+        index = self._index
+        self.assertEqual(len(index), 3)
+        self.assertEqual(index.header, "PACKAGES: 3\nTIMESTAMP: 123\nVERSION: 0")
+        self.assertEqual(index.categories, ["cat", "cat", "dog"])
+        self.assertEqual(index.cpvs, ["cat/pkg-1", "cat/pkg-1", "dog/other-2"])
+        self.assertEqual(list(index.build_times), [2, 2, 1])
+        self.assertIs(index.cpvs[0], index.cpvs[1])  # i.e. interned
+
+    def test_accessors(self):
+        index = self._index
+        self.assertEqual(
+            [index.full_name(i) for i in range(3)], ["cat/pkg-1-2", "cat/pkg-1-1", "dog/other-2"]
+        )
+        self.assertEqual(
+            [index.path(i) for i in range(3)],
+            ["cat/pkg/pkg-1-2.gpkg.tar", "cat/pkg/pkg-1-1.gpkg.tar", "dog/other-2.tbz2"],
+        )
+        self.assertEqual([index.size(i) for i in range(3)], [456, None, None])
+        self.assertEqual(index.block(2), "BUILD_TIME: 1\nCPV: dog/other-2")
+
+    def test_indices_sorted_by_build_time(self):
+        self.assertEqual(list(self._index.indices_sorted_by_build_time()), [2, 1, 0])
+
+    def test_save(self):
+        self._index.save(self._filename, "NEW: header", [2, 0])
+
+        with open(self._filename) as f:
+            self.assertEqual(
+                f.read(),
+                dedent("""\
+                    NEW: header
+
+                    BUILD_TIME: 1
+                    CPV: dog/other-2
+
+                    BUILD_ID: 2
+                    BUILD_TIME: 2
+                    CPV: cat/pkg-1
+                    PATH: cat/pkg/pkg-1-2.gpkg.tar
+                    SIZE: 456
+
+                """),
+            )
+
+        # Saving must not have disturbed the memory-mapped original
+        self.assertEqual(self._index.full_name(0), "cat/pkg-1-2")
+
+
+class PackagesIndexLoadTest(TestCase):
+    @parameterized.expand(
+        [
+            ("empty file", "", ""),
+            ("header only", "K1: v1\n", "K1: v1\n"),
+        ]
+    )
+    def test_no_packages(self, _label, content, expected_header):
+        with TemporaryDirectory() as tempdir:
+            filename = os.path.join(tempdir, "Packages")
+            with open(filename, "w") as f:
+                f.write(content)
+
+            with PackagesIndex.load(filename) as index:
+                self.assertEqual(len(index), 0)
+                self.assertEqual(index.header, expected_header)
+
+    def test_missing_field(self):
+        with TemporaryDirectory() as tempdir:
+            filename = os.path.join(tempdir, "Packages")
+            with open(filename, "w") as f:
+                f.write("K1: v1\n\nCPV: cat/pkg-1\n")
+
+            with self.assertRaises(ValueError) as catcher:
+                PackagesIndex.load(filename)
+        self.assertEqual(
+            str(catcher.exception),
+            "Package entry 'CPV: cat/pkg-1\\n' lacks field 'BUILD_TIME'",
+        )
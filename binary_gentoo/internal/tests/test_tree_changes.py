@@ -0,0 +1,43 @@
+# Copyright (C) 2021 Sebastian Pipping <sebastian@pipping.org>
+# Licensed under GNU Affero GPL version 3 or later
+
+import os
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+from ..tree_changes import TreeChanges
+
+
+class LoadSaveTest(TestCase):
+    def test_round_trip(self):
+        changes = TreeChanges(
+            changed=["cat/pkg/pkg-2.ebuild", "cat/pkg/Manifest"],
+            deleted=["cat/pkg/pkg-1.ebuild"],
+        )
+
+        with TemporaryDirectory() as tempdir:
+            filename = os.path.join(tempdir, "changes.json")
+            changes.save(filename)
+            loaded_changes = TreeChanges.load(filename)
+
+        self.assertEqual(
+            loaded_changes,
+            TreeChanges(
+                changed=["cat/pkg/Manifest", "cat/pkg/pkg-2.ebuild"],
+                deleted=["cat/pkg/pkg-1.ebuild"],
+            ),
+        )
+
+    def test_missing_file(self):
+        with TemporaryDirectory() as tempdir:
+            with self.assertRaises(FileNotFoundError):
+                TreeChanges.load(os.path.join(tempdir, "changes.json"))
+
+    def test_unsupported_version(self):
+        with TemporaryDirectory() as tempdir:
+            filename = os.path.join(tempdir, "changes.json")
+            with open(filename, "w") as f:
+                f.write('{"version": 2, "changed": [], "deleted": []}')
+
+            with self.assertRaises(ValueError):
+                TreeChanges.load(filename)
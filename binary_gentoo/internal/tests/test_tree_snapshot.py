@@ -0,0 +1,70 @@
+# Copyright (C) 2021 Sebastian Pipping <sebastian@pipping.org>
+# Licensed under GNU Affero GPL version 3 or later
+
+import os
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+from parameterized import parameterized
+
+from ..tree_snapshot import SnapshotEntry, TreeSnapshot
+
+
+class UpdateRemoveTest(TestCase):
+    def test_update_then_remove(self):
+        entry1 = SnapshotEntry(1, 1, "digest1", frozenset({"amd64"}))
+        entry2 = SnapshotEntry(2, 2, "digest2", frozenset({"amd64"}))
+        old_snapshot = TreeSnapshot()
+        old_snapshot.put("cat/pkg/pkg-1.ebuild", entry1)
+        old_snapshot.put("cat/pkg/pkg-2.ebuild", entry1)
+        snapshot = TreeSnapshot()
+        snapshot.put("cat/pkg/pkg-2.ebuild", entry2)
+
+        snapshot.update(old_snapshot)
+        snapshot.remove("cat/pkg/pkg-1.ebuild")
+        snapshot.remove("cat/pkg/pkg-3.ebuild")
+
+        self.assertEqual(len(snapshot), 1)
+        self.assertEqual(snapshot.get("cat/pkg/pkg-2.ebuild"), entry1)
+
+
+class LoadSaveTest(TestCase):
+    def test_round_trip(self):
+        entry = SnapshotEntry(123, 456, "digest1", frozenset({"amd64", "~x86"}))
+        snapshot = TreeSnapshot()
+        snapshot.put("cat/pkg/pkg-1.ebuild", entry)
+
+        with TemporaryDirectory() as tempdir:
+            filename = os.path.join(tempdir, "snapshot.json")
+            snapshot.save(filename)
+            loaded_snapshot = TreeSnapshot.load(filename)
+
+        self.assertEqual(len(loaded_snapshot), 1)
+        self.assertEqual(loaded_snapshot.get("cat/pkg/pkg-1.ebuild"), entry)
+        self.assertIsNone(loaded_snapshot.get("cat/pkg/pkg-2.ebuild"))
+
+    @parameterized.expand(
+        [
+            ("missing file", None),
+            ("empty file", ""),
+        ]
+    )
+    def test_starts_empty(self, _label, content):
+        with TemporaryDirectory() as tempdir:
+            filename = os.path.join(tempdir, "snapshot.json")
+            if content is not None:
+                with open(filename, "w") as f:
+                    f.write(content)
+
+            snapshot = TreeSnapshot.load(filename)
+
+        self.assertEqual(len(snapshot), 0)
+
+    def test_unsupported_version(self):
+        with TemporaryDirectory() as tempdir:
+            filename = os.path.join(tempdir, "snapshot.json")
+            with open(filename, "w") as f:
+                f.write('{"version": 2, "entries": {}}')
+
+            with self.assertRaises(ValueError):
+                TreeSnapshot.load(filename)
@@ -0,0 +1,105 @@
+# Copyright (C) 2021 Sebastian Pipping <sebastian@pipping.org>
+# Licensed under GNU Affero GPL version 3 or later
+
+import errno
+import os
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+from unittest.mock import patch
+
+from parameterized import parameterized
+
+from ..tree_watcher import (
+    _EVENT_HEADER,
+    _IN_Q_OVERFLOW,
+    InotifyTreeWatcher,
+    PollingTreeWatcher,
+)
+
+
+def _write_file(filename, content=""):
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    with open(filename, "w") as f:
+        f.write(content)
+
+
+def _create_watcher(kind, portdir):
+    if kind == "inotify":
+        return InotifyTreeWatcher(portdir)
+    return PollingTreeWatcher(portdir, interval_seconds=0.01)
+
+
+class WaitForDirtyPackageDirsTest(TestCase):
+    @parameterized.expand([("inotify",), ("polling",)])
+    def test_added_ebuild_in_existing_package(self, kind):
+        with TemporaryDirectory() as portdir:
+            _write_file(os.path.join(portdir, "cat", "pkg", "pkg-1.ebuild"))
+            _write_file(os.path.join(portdir, "cat", "other", "other-1.ebuild"))
+
+            with _create_watcher(kind, portdir) as watcher:
+                _write_file(os.path.join(portdir, "cat", "pkg", "pkg-2.ebuild"))
+
+                dirty_package_dirs = watcher.wait_for_dirty_package_dirs(settle_seconds=0.1)
+
+        self.assertEqual(dirty_package_dirs, {"cat/pkg"})
+
+    @parameterized.expand([("inotify",), ("polling",)])
+    def test_new_category_and_package(self, kind):
+        with TemporaryDirectory() as portdir:
+            _write_file(os.path.join(portdir, "cat", "pkg", "pkg-1.ebuild"))
+
+            with _create_watcher(kind, portdir) as watcher:
+                os.makedirs(os.path.join(portdir, "newcat", "newpkg"))
+                os.mkdir(os.path.join(portdir, "cat", "pkg2"))
+
+                dirty_package_dirs = watcher.wait_for_dirty_package_dirs(settle_seconds=0.1)
+
+        self.assertEqual(dirty_package_dirs, {"cat/pkg2", "newcat/newpkg"})
+
+    def test_in_place_modification__inotify(self):
+        with TemporaryDirectory() as portdir:
+            filename = os.path.join(portdir, "cat", "pkg", "pkg-1.ebuild")
+            _write_file(filename)
+
+            with InotifyTreeWatcher(portdir) as watcher:
+                with open(filename, "a") as f:
+                    f.write('KEYWORDS="amd64"\n')
+                first_dirty_package_dirs = watcher.wait_for_dirty_package_dirs(0.1)
+
+                # NOTE: Changes to newly created packages are picked up as well
+                _write_file(os.path.join(portdir, "cat", "pkg2", "pkg2-1.ebuild"))
+                watcher.wait_for_dirty_package_dirs(0.1)
+                with open(os.path.join(portdir, "cat", "pkg2", "pkg2-1.ebuild"), "a") as f:
+                    f.write('KEYWORDS="amd64"\n')
+                second_dirty_package_dirs = watcher.wait_for_dirty_package_dirs(0.1)
+
+        self.assertEqual(first_dirty_package_dirs, {"cat/pkg"})
+        self.assertEqual(second_dirty_package_dirs, {"cat/pkg2"})
+
+    def test_queue_overflow__inotify(self):
+        with TemporaryDirectory() as portdir:
+            _write_file(os.path.join(portdir, "cat", "pkg", "pkg-1.ebuild"))
+            _write_file(os.path.join(portdir, "dev-util", "tool", "tool-1.ebuild"))
+
+            with InotifyTreeWatcher(portdir) as watcher:
+                overflow_event = _EVENT_HEADER.pack(-1, _IN_Q_OVERFLOW, 0, 0)
+                dirty_package_dirs = watcher._process_events(overflow_event)
+
+        self.assertEqual(dirty_package_dirs, {"cat/pkg", "dev-util/tool"})
+
+    def test_out_of_watches_falls_back_to_polling__inotify(self):
+        with TemporaryDirectory() as portdir:
+            _write_file(os.path.join(portdir, "cat", "pkg", "pkg-1.ebuild"))
+
+            with InotifyTreeWatcher(portdir, polling_interval_seconds=0.01) as watcher:
+                with patch.object(
+                    watcher, "_add_watch", side_effect=OSError(errno.ENOSPC, "No space left")
+                ):
+                    os.mkdir(os.path.join(portdir, "cat", "pkg2"))
+                    first_dirty_package_dirs = watcher.wait_for_dirty_package_dirs(0.1)
+
+                _write_file(os.path.join(portdir, "cat", "pkg3", "pkg3-1.ebuild"))
+                second_dirty_package_dirs = watcher.wait_for_dirty_package_dirs(0.1)
+
+        self.assertEqual(first_dirty_package_dirs, {"cat/pkg", "cat/pkg2"})
+        self.assertEqual(second_dirty_package_dirs, {"cat/pkg3"})
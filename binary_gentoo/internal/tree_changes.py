@@ -0,0 +1,42 @@
+# Copyright (C) 2021 Sebastian Pipping <sebastian@pipping.org>
+# Licensed under GNU Affero GPL version 3 or later
+
+from dataclasses import dataclass, field
+
+from .atomic_files import load_versioned_json, save_versioned_json
+
+
+@dataclass
+class TreeChanges:
+    """Record of the files that a sync of a portdir changed (including added) and deleted
+
+    Files are given by path relative to the portdir.  For portdirs synced by git,
+    the commit IDs before (if any) and after the sync are recorded as well.
+    """
+
+    changed: list[str] = field(default_factory=list)
+    deleted: list[str] = field(default_factory=list)
+    old_commit: str | None = None
+    new_commit: str | None = None
+
+    @staticmethod
+    def load(filename):
+        doc = load_versioned_json(filename, 1, required=True)
+        if doc is None:
+            raise ValueError(f"Changes file {filename!r} is empty")
+
+        return TreeChanges(
+            changed=doc["changed"],
+            deleted=doc["deleted"],
+            old_commit=doc.get("old_commit"),
+            new_commit=doc.get("new_commit"),
+        )
+
+    def save(self, filename):
+        doc = {
+            "changed": sorted(self.changed),
+            "deleted": sorted(self.deleted),
+            "old_commit": self.old_commit,
+            "new_commit": self.new_commit,
+        }
+        save_versioned_json(filename, 1, doc)
@@ -0,0 +1,72 @@
+# Copyright (C) 2021 Sebastian Pipping <sebastian@pipping.org>
+# Licensed under GNU Affero GPL version 3 or later
+
+from dataclasses import dataclass
+from threading import Lock
+
+from .atomic_files import load_versioned_json, save_versioned_json
+
+
+@dataclass(frozen=True)
+class SnapshotEntry:
+    size: int
+    mtime_ns: int
+    digest: str
+    keywords: frozenset[str]
+
+
+class TreeSnapshot:
+    """Compact record of the ebuilds of a portdir, to compare a later state of it against
+
+    Entries are keyed by path relative to the portdir.
+    """
+
+    def __init__(self):
+        self._entries: dict[str, SnapshotEntry] = {}
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __iter__(self):
+        """Iterate over the paths of all entries"""
+        with self._lock:
+            return iter(list(self._entries))
+
+    def get(self, relative_path: str) -> SnapshotEntry | None:
+        return self._entries.get(relative_path)
+
+    def put(self, relative_path: str, entry: SnapshotEntry):
+        with self._lock:
+            self._entries[relative_path] = entry
+
+    def remove(self, relative_path: str):
+        with self._lock:
+            self._entries.pop(relative_path, None)
+
+    def update(self, other: "TreeSnapshot"):
+        """Take over all entries of ``other``, replacing entries of the same path"""
+        with self._lock:
+            self._entries.update(other._entries)
+
+    @staticmethod
+    def load(filename):
+        snapshot = TreeSnapshot()
+
+        doc = load_versioned_json(filename, 1)
+        if doc is not None:
+            for relative_path, (size, mtime_ns, digest, keywords) in doc["entries"].items():
+                snapshot._entries[relative_path] = SnapshotEntry(
+                    size, mtime_ns, digest, frozenset(keywords)
+                )
+
+        return snapshot
+
+    def save(self, filename):
+        doc = {
+            "entries": {
+                relative_path: [entry.size, entry.mtime_ns, entry.digest, sorted(entry.keywords)]
+                for relative_path, entry in self._entries.items()
+            },
+        }
+        save_versioned_json(filename, 1, doc, compact=True)
@@ -0,0 +1,260 @@
+# Copyright (C) 2021 Sebastian Pipping <sebastian@pipping.org>
+# Licensed under GNU Affero GPL version 3 or later
+
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import time
+from abc import ABC, abstractmethod
+
+# NOTE: Values from <sys/inotify.h>
+_IN_MODIFY = 0x00000002
+_IN_ATTRIB = 0x00000004
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_FROM = 0x00000040
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_DELETE = 0x00000200
+_IN_DELETE_SELF = 0x00000400
+_IN_Q_OVERFLOW = 0x00004000
+_IN_IGNORED = 0x00008000
+_IN_ISDIR = 0x40000000
+_IN_NONBLOCK = 0o4000
+_IN_CLOEXEC = 0o2000000
+
+_WATCH_MASK = (
+    _IN_MODIFY
+    | _IN_ATTRIB
+    | _IN_CLOSE_WRITE
+    | _IN_MOVED_FROM
+    | _IN_MOVED_TO
+    | _IN_CREATE
+    | _IN_DELETE
+    | _IN_DELETE_SELF
+)
+_EVENT_HEADER = struct.Struct("iIII")  # i.e. wd, mask, cookie, len of struct inotify_event
+
+
+def _is_hidden(name: str) -> bool:
+    return name.startswith(".")
+
+
+def _list_subdirectories(path: str) -> list[str]:
+    try:
+        return sorted(
+            entry.name
+            for entry in os.scandir(path)
+            if entry.is_dir(follow_symlinks=False) and not _is_hidden(entry.name)
+        )
+    except (FileNotFoundError, NotADirectoryError):
+        return []
+
+
+def _list_package_dirs(portdir: str) -> list[str]:
+    return [
+        f"{category}/{package}"
+        for category in _list_subdirectories(portdir)
+        for package in _list_subdirectories(os.path.join(portdir, category))
+    ]
+
+
+class _TreeWatcher(ABC):
+    """Reports package directories (``<category>/<package>``) that saw changes below a portdir"""
+
+    def wait_for_dirty_package_dirs(self, settle_seconds: float) -> set[str]:
+        """Block until changes came in and then settled for ``settle_seconds``"""
+        dirty_package_dirs = set()
+        while True:
+            timeout = None if not dirty_package_dirs else settle_seconds
+            news = self._wait_for_changes(timeout)
+            if not news and dirty_package_dirs:
+                return dirty_package_dirs
+            dirty_package_dirs |= news
+
+    @abstractmethod
+    def _wait_for_changes(self, timeout: float | None) -> set[str]:
+        """Block for up to ``timeout`` seconds (or forever) for changes to come in"""
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class InotifyTreeWatcher(_TreeWatcher):
+    """Watches a portdir through Linux inotify, with one watch per (category and package) dir
+
+    The standard library offers no inotify bindings, so this goes through libc by ctypes.
+    If the kernel runs out of watches for directories created later on,
+    it falls back to polling every ``polling_interval_seconds`` for good.
+    """
+
+    def __init__(self, portdir: str, polling_interval_seconds: float = 1.0):
+        self._portdir = portdir
+        self._polling_interval_seconds = polling_interval_seconds
+        self._polling_tree_watcher = None
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self._fd = self._libc.inotify_init1(_IN_NONBLOCK | _IN_CLOEXEC)
+        if self._fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, f"inotify_init1 failed: {os.strerror(errno)}")
+        self._relative_dir_of_wd: dict[int, str] = {}
+
+        try:
+            self._add_watch("")
+            self._add_all_watches()
+        except BaseException:
+            self.close()
+            raise
+
+    def _add_watch(self, relative_dir: str):
+        path = os.path.join(self._portdir, relative_dir)
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(path), _WATCH_MASK)
+        if wd < 0:
+            errno = ctypes.get_errno()
+            if errno == 2:  # i.e. ENOENT: gone again already
+                return
+            raise OSError(errno, f"inotify_add_watch failed for {path!r}: {os.strerror(errno)}")
+        self._relative_dir_of_wd[wd] = relative_dir
+
+    def _add_category_watches(self, category: str) -> set[str]:
+        self._add_watch(category)
+        package_dirs = set()
+        for package in _list_subdirectories(os.path.join(self._portdir, category)):
+            package_dir = f"{category}/{package}"
+            self._add_watch(package_dir)
+            package_dirs.add(package_dir)
+        return package_dirs
+
+    def _add_all_watches(self) -> set[str]:
+        package_dirs = set()
+        for category in _list_subdirectories(self._portdir):
+            package_dirs |= self._add_category_watches(category)
+        return package_dirs
+
+    def _fall_back_to_polling(self) -> set[str]:
+        self.close()
+        self._polling_tree_watcher = PollingTreeWatcher(
+            self._portdir, self._polling_interval_seconds
+        )
+        # NOTE: Changes may have slipped through in between, so all package dirs are dirty
+        return set(_list_package_dirs(self._portdir))
+
+    def _wait_for_changes(self, timeout: float | None) -> set[str]:
+        if self._polling_tree_watcher is not None:
+            return self._polling_tree_watcher._wait_for_changes(timeout)
+
+        readable, _, _ = select.select([self._fd], [], [], timeout)
+        if not readable:
+            return set()
+
+        buffer = os.read(self._fd, 64 * 1024)
+        try:
+            return self._process_events(buffer)
+        except OSError:  # e.g. ENOSPC, i.e. out of watches
+            return self._fall_back_to_polling()
+
+    def _process_events(self, buffer: bytes) -> set[str]:
+        dirty_package_dirs = set()
+        offset = 0
+        while offset < len(buffer):
+            wd, mask, _cookie, name_length = _EVENT_HEADER.unpack_from(buffer, offset)
+            offset += _EVENT_HEADER.size
+            name = os.fsdecode(buffer[offset : offset + name_length].rstrip(b"\0"))
+            offset += name_length
+
+            if mask & _IN_Q_OVERFLOW:  # i.e. events were lost, with wd -1
+                dirty_package_dirs |= self._add_all_watches()
+                continue
+
+            relative_dir = self._relative_dir_of_wd.get(wd)
+            if relative_dir is None:
+                continue
+            if mask & _IN_IGNORED:
+                del self._relative_dir_of_wd[wd]
+                continue
+
+            depth = 0 if not relative_dir else relative_dir.count("/") + 1
+            if depth == 0:
+                if (
+                    mask & _IN_ISDIR
+                    and mask & (_IN_CREATE | _IN_MOVED_TO)
+                    and not _is_hidden(name)
+                ):
+                    dirty_package_dirs |= self._add_category_watches(name)
+            elif depth == 1:
+                if mask & _IN_ISDIR and not _is_hidden(name):
+                    package_dir = f"{relative_dir}/{name}"
+                    if mask & (_IN_CREATE | _IN_MOVED_TO):
+                        self._add_watch(package_dir)
+                    dirty_package_dirs.add(package_dir)
+            else:
+                dirty_package_dirs.add(relative_dir)
+
+        return dirty_package_dirs
+
+    def close(self):
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+
+class PollingTreeWatcher(_TreeWatcher):
+    """Watches a portdir by polling the modification time of all package directories
+
+    This is a fallback for where inotify is not available.  It notices ebuilds that
+    are added, removed or replaced (e.g. by rsync without ``--inplace``)
+    but not ebuilds that are modified in place.
+    """
+
+    def __init__(self, portdir: str, interval_seconds: float):
+        self._portdir = portdir
+        self._interval_seconds = interval_seconds
+        self._mtime_ns_of_package_dir = self._scan()
+
+    def _scan(self) -> dict[str, int]:
+        mtime_ns_of_package_dir = {}
+        for package_dir in _list_package_dirs(self._portdir):
+            try:
+                mtime_ns = os.stat(os.path.join(self._portdir, package_dir)).st_mtime_ns
+            except FileNotFoundError:
+                continue
+            mtime_ns_of_package_dir[package_dir] = mtime_ns
+        return mtime_ns_of_package_dir
+
+    def _wait_for_changes(self, timeout: float | None) -> set[str]:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            mtime_ns_of_package_dir = self._scan()
+            dirty_package_dirs = {
+                package_dir
+                for package_dir in self._mtime_ns_of_package_dir.keys()
+                | mtime_ns_of_package_dir.keys()
+                if self._mtime_ns_of_package_dir.get(package_dir)
+                != mtime_ns_of_package_dir.get(package_dir)
+            }
+            self._mtime_ns_of_package_dir = mtime_ns_of_package_dir
+            if dirty_package_dirs:
+                return dirty_package_dirs
+
+            if deadline is not None:
+                remaining_seconds = deadline - time.monotonic()
+                if remaining_seconds <= 0:
+                    return set()
+                time.sleep(min(self._interval_seconds, remaining_seconds))
+            else:
+                time.sleep(self._interval_seconds)
+
+
+def create_tree_watcher(portdir: str, polling_interval_seconds: float) -> _TreeWatcher:
+    """Create an inotify-based watcher if possible, a polling one otherwise"""
+    try:
+        return InotifyTreeWatcher(portdir, polling_interval_seconds)
+    except (AttributeError, OSError):  # e.g. libc without inotify_init1, or out of watches
+        return PollingTreeWatcher(portdir, polling_interval_seconds)